@@ -63,8 +63,8 @@ def upload():
             f.save(full_path)
             file_size = os.path.getsize(full_path) # bytes
             
-            # buffer for ciphertext. 1.2 is arbitrary and intended as a ceiling but can be adjusted
-            required_storage = int(file_size * 1.3) 
+            # exact ciphertext size: AES-GCM adds a header and a 16 byte tag per 1MB segment
+            required_storage = new_enc.encrypted_size(file_size)
 
             result = backend.pDistribute(filename = filename, required_storage = required_storage)
             session["upload-result"] = result
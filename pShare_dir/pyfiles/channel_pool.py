@@ -0,0 +1,123 @@
+import threading
+from typing import Dict, Optional
+
+import grpc
+import storage_node_pb2_grpc
+
+""" Long-lived gRPC channels to the S-nodes, one per UUID.
+
+    A channel is opened when the S-node's first heartbeat reports its file service
+    port and is closed when the S-node disconnects (StorageService.pop_client), so
+    uploads, downloads and deletes reuse one HTTP/2 connection instead of paying for
+    a new TCP connection on every chunk and leaking the old ones. """
+
+MAX_MESSAGE_SIZE = 8 * 1024 * 1024 # bytes, both directions
+KEEPALIVE_TIME_MS = 30000 # ping an idle connection this often...
+KEEPALIVE_TIMEOUT_MS = 10000 # ...and drop it if the ping is not answered in time
+WINDOW_SIZE = 4 * 1024 * 1024 # initial HTTP/2 flow-control window, per stream
+
+
+def channel_options(max_message_size: int = MAX_MESSAGE_SIZE, keepalive_time_ms: int = KEEPALIVE_TIME_MS,
+                    keepalive_timeout_ms: int = KEEPALIVE_TIMEOUT_MS, window_size: int = WINDOW_SIZE) -> list:
+    """gRPC channel arguments shared by the pool (and the S-node server it talks to)"""
+    return [
+        ('grpc.max_send_message_length', max_message_size),
+        ('grpc.max_receive_message_length', max_message_size),
+        ('grpc.keepalive_time_ms', keepalive_time_ms),
+        ('grpc.keepalive_timeout_ms', keepalive_timeout_ms),
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.max_pings_without_data', 0),
+        ('grpc.http2.lookahead_bytes', window_size),
+        ('grpc.http2.bdp_probe', 1), # grow the window past the initial size on fast links
+    ]
+
+
+def server_options(max_message_size: int = MAX_MESSAGE_SIZE, keepalive_time_ms: int = KEEPALIVE_TIME_MS,
+                   window_size: int = WINDOW_SIZE) -> list:
+    """Server side of channel_options: accept the pool's keepalive pings"""
+    return [
+        ('grpc.max_send_message_length', max_message_size),
+        ('grpc.max_receive_message_length', max_message_size),
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.min_ping_interval_without_data_ms', keepalive_time_ms // 2),
+        ('grpc.http2.max_ping_strikes', 0),
+        ('grpc.http2.lookahead_bytes', window_size),
+        ('grpc.http2.bdp_probe', 1),
+    ]
+
+
+class _Entry:
+    def __init__(self, address: str, options: list):
+        self.address = address
+        self.channel = grpc.insecure_channel(address, options=options)
+        self.stub = storage_node_pb2_grpc.StorageServiceStub(self.channel)
+
+
+class ChannelPool:
+    def __init__(self, **options):
+        self.options = channel_options(**options)
+        self.lock = threading.Lock()
+        self.entries: Dict[str, _Entry] = {} # {uuid: channel + stub}
+        self.created = 0 # channels opened
+        self.reused = 0 # operations served by an already open channel
+        self.closed = 0 # channels closed
+
+
+    def open(self, uuid: str, address: str) -> None:
+        """Make sure uuid has a channel to address (called on every heartbeat, cheap when it does)"""
+        self._get(uuid, address, count_reuse=False)
+
+
+    def stub(self, uuid: str, address: str) -> storage_node_pb2_grpc.StorageServiceStub:
+        """Return the stub for uuid, opening (or re-opening on an address change) its channel if needed"""
+        return self._get(uuid, address, count_reuse=True).stub
+
+
+    def channel(self, uuid: str) -> Optional[grpc.Channel]:
+        with self.lock:
+            entry = self.entries.get(uuid)
+            return entry.channel if entry else None
+
+
+    def _get(self, uuid: str, address: str, count_reuse: bool) -> _Entry:
+        stale = None
+        with self.lock:
+            entry = self.entries.get(uuid)
+            if entry is not None and entry.address == address:
+                if count_reuse:
+                    self.reused += 1
+                return entry
+            stale = entry
+            entry = _Entry(address, self.options)
+            self.entries[uuid] = entry
+            self.created += 1
+        if stale is not None:
+            self._close(stale)
+        return entry
+
+
+    def close(self, uuid: str) -> None:
+        """Drop the channel of a disconnected S-node"""
+        with self.lock:
+            entry = self.entries.pop(uuid, None)
+        if entry is not None:
+            self._close(entry)
+
+
+    def close_all(self) -> None:
+        with self.lock:
+            entries, self.entries = list(self.entries.values()), {}
+        for entry in entries:
+            self._close(entry)
+
+
+    def _close(self, entry: _Entry) -> None:
+        entry.channel.close()
+        with self.lock:
+            self.closed += 1
+
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"open": len(self.entries), "created": self.created,
+                    "reused": self.reused, "closed": self.closed}
@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import argparse
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import erasure
+import erasurelrc
+import erasurezfec
+from erasurezfec import STRIPE_SIZE, ErasureEngine, StripeLayout, trim
+
+
+""" Registry of the erasure codecs a file can be stored with.
+
+    A codec is an ErasureEngine: its encoder turns a stripe into m blocks (all of them, or
+    only some share numbers), its decoder rebuilds the stripe from the blocks select()
+    picks, and repair(i, ...) rebuilds block i of one stripe. Every codec splits stripes with
+    erasurezfec.StripeLayout, so share sizes and padding are the same whatever the codec.
+
+    Backends:
+      zfec        - Reed-Solomon in C, any 1 <= k <= m <= 256 (the default)
+      rs          - vectorized Reed-Solomon over GF(256) of erasure.py, m <= 255
+      xor         - one XOR parity, m = k + 1
+      replication - m copies of the stripe, k = 1
+      lrc         - local groups plus global parities (erasurelrc.py), not MDS: some sets
+                    of k shares cannot rebuild the file, so `auto` never picks it
+
+    The codec id is written in the .meta of every file (codec=..., plus the codec's own
+    parameters); files without one were coded by zfec. `python codec.py bench -k K -m M`
+    times every codec that supports (k, m) on this machine and, with --save, records the
+    fastest MDS one in CHOICES_FILE, where ERASURE_CODEC = "auto" of rnode.py reads it. """
+
+DEFAULT_CODEC = "zfec" # codec of files whose .meta names none
+CHOICES_FILE = Path("registry_conf/codec.json") # {"k,m": fastest codec} saved by bench --save
+
+
+class Codec:
+    """A registered backend: factory(k, m, stripe_size, window, **params) builds its engine"""
+    def __init__(self, name: str, factory: Callable, supports: Callable[[int, int], bool], mds: bool = True):
+        self.name = name
+        self.factory = factory
+        self.supports = supports
+        self.mds = mds # any k shares rebuild the stripe
+
+    def __repr__(self):
+        return f"Codec({self.name})"
+
+
+_codecs: Dict[str, Codec] = {}
+
+
+def register(name: str, factory: Callable, supports: Callable[[int, int], bool], mds: bool = True) -> None:
+    _codecs[name] = Codec(name, factory, supports, mds)
+
+
+def codecs(k: Optional[int] = None, m: Optional[int] = None) -> List[str]:
+    """Names of the registered codecs, only those supporting (k, m) when given"""
+    return [name for name, codec in _codecs.items() if k is None or codec.supports(k, m)]
+
+
+def create(name: str, k: int, m: int, stripe_size: int = STRIPE_SIZE, window=None, **params) -> ErasureEngine:
+    """Engine of codec name for k of m shares, ValueError if it is unknown or does not support (k, m)"""
+    codec = _codecs.get(name)
+    if codec is None:
+        raise ValueError(f"unknown codec {name}")
+    if not codec.supports(k, m):
+        raise ValueError(f"codec {name} does not support k={k} m={m}")
+    return codec.factory(k, m, stripe_size, window, **params)
+
+
+def engine_for(meta: dict, window=None) -> ErasureEngine:
+    """The engine that coded the file described by a .meta"""
+    params = {}
+    if 'local_groups' in meta:
+        params['local_groups'] = int(meta['local_groups'])
+    return create(meta.get('codec', DEFAULT_CODEC), meta['k'], meta['m'], meta['stripe_size'], window, **params)
+
+
+# ==== BACKENDS ====
+class RSEncoder(StripeLayout):
+    def __init__(self, k, m, stripe_size=STRIPE_SIZE):
+        super().__init__(k, m, stripe_size)
+        self.parity = erasure.parity_matrix(k, m - k)
+
+    def encode(self, stripe, sharenums=None):
+        blocks = self.primary(stripe)
+        wanted = range(self.m) if sharenums is None else sharenums
+        data = None
+        result = []
+        for n in wanted:
+            if n < self.k:
+                result.append(blocks[n])
+                continue
+            if data is None:
+                data = [np.frombuffer(block, dtype=np.uint8) for block in blocks]
+            result.append(erasure.combine(self.parity[:, n - self.k], data).data)
+        return result
+
+
+class RSDecoder:
+    def __init__(self, k, m):
+        self.k = k
+        self.code = np.concatenate([np.eye(k, dtype=np.uint8), erasure.parity_matrix(k, m - k)], axis=1)
+        self.inverses = {} # {share numbers: inverse of their code matrix}
+        self.lock = threading.Lock()
+
+    def decode(self, blocks, sharenums, data_size):
+        have = dict(zip(sharenums, blocks))
+        if all(i in have for i in range(self.k)):
+            return trim([have[i] for i in range(self.k)], data_size)
+        used = tuple(sorted(have))
+        with self.lock:
+            inverse = self.inverses.get(used)
+            if inverse is None:
+                inverse = self.inverses[used] = erasure.gf_invert_matrix(self.code[:, list(used)])
+        arrays = [np.frombuffer(have[n], dtype=np.uint8) for n in used]
+        primary = [have[i] if i in have else erasure.combine(inverse[:, i], arrays).data for i in range(self.k)]
+        return trim(primary, data_size)
+
+
+class XOREncoder(StripeLayout):
+    def encode(self, stripe, sharenums=None):
+        blocks = self.primary(stripe)
+        wanted = range(self.m) if sharenums is None else sharenums
+        return [blocks[n] if n < self.k else erasurelrc.xor_blocks(blocks) for n in wanted]
+
+
+class XORDecoder:
+    def __init__(self, k):
+        self.k = k
+
+    def decode(self, blocks, sharenums, data_size):
+        have = dict(zip(sharenums, blocks))
+        primary = [have[i] if i in have else erasurelrc.xor_blocks(blocks) for i in range(self.k)]
+        return trim(primary, data_size)
+
+
+class ReplicaEncoder(StripeLayout):
+    def encode(self, stripe, sharenums=None):
+        block = self.primary(stripe)[0]
+        return [block] * (self.m if sharenums is None else len(sharenums))
+
+
+class ReplicaDecoder:
+    def decode(self, blocks, sharenums, data_size):
+        return trim(blocks[:1], data_size)
+
+
+def _zfec(k, m, stripe_size, window):
+    return ErasureEngine(k, m, stripe_size, window)
+
+
+def _rs(k, m, stripe_size, window):
+    return ErasureEngine(k, m, stripe_size, window, RSEncoder(k, m, stripe_size), RSDecoder(k, m), codec='rs')
+
+
+def _xor(k, m, stripe_size, window):
+    return ErasureEngine(k, m, stripe_size, window, XOREncoder(k, m, stripe_size), XORDecoder(k), codec='xor')
+
+
+def _replication(k, m, stripe_size, window):
+    return ErasureEngine(k, m, stripe_size, window, ReplicaEncoder(k, m, stripe_size), ReplicaDecoder(),
+                         codec='replication')
+
+
+def _lrc(k, m, stripe_size, window, local_groups=None):
+    if local_groups is None:
+        local_groups, global_parities = erasurelrc.layout(k, m)
+    else:
+        global_parities = m - k - local_groups
+    return erasurelrc.LRCEngine(k, local_groups, global_parities, stripe_size, window)
+
+
+register('zfec', _zfec, lambda k, m: 1 <= k <= m <= 256)
+register('rs', _rs, lambda k, m: 1 <= k <= m <= 255)
+register('xor', _xor, lambda k, m: k >= 1 and m == k + 1)
+register('replication', _replication, lambda k, m: k == 1 and m >= 1)
+register('lrc', _lrc, lambda k, m: k >= 1 and erasurelrc.layout(k, m) is not None, mds=False)
+
+
+# ==== CHOICE ====
+def preferred(k: int, m: int) -> Optional[str]:
+    """Codec saved by `bench --save` for (k, m), None if none was"""
+    try:
+        with open(CHOICES_FILE, 'r') as f:
+            name = json.load(f).get(f"{k},{m}")
+    except (OSError, json.JSONDecodeError):
+        return None
+    return name if name in _codecs and _codecs[name].supports(k, m) else None
+
+
+def save_choice(k: int, m: int, name: str) -> None:
+    try:
+        with open(CHOICES_FILE, 'r') as f:
+            choices = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        choices = {}
+    choices[f"{k},{m}"] = name
+    CHOICES_FILE.parent.mkdir(parents=True, exist_ok=True)
+    with open(CHOICES_FILE, 'w') as f:
+        json.dump(choices, f, indent=4)
+
+
+def benchmark(k: int, m: int, size: int, stripe_size: int = STRIPE_SIZE, rounds: int = 3) -> Dict[str, Dict[str, float]]:
+    """Time every codec supporting (k, m) on size bytes of random data, in memory.
+       Returns {codec: {'encode', 'decode', 'repair': seconds}}, best of rounds; decode uses
+       as many parity shares as it can and repair rebuilds share 0 from the others ('repair' is
+       left out when m == k, no share can be rebuilt then)"""
+    data = os.urandom(size)
+    results = {}
+    for name in codecs(k, m):
+        engine = create(name, k, m, stripe_size)
+        meta = {'size': size, 'k': k, 'stripe_size': engine.stripe_size}
+        stripes = [data[offset:offset + engine.stripe_size] for offset in range(0, size, engine.stripe_size)]
+        others = list(range(1, m))
+        selected = engine.select(others)
+        read = None if selected is None else [others[i] for i in selected]
+        parities_first = list(range(m - 1, -1, -1))
+        sources = [parities_first[i] for i in engine.select(parities_first)]
+
+        def encode():
+            return [[bytes(block) for block in blocks] for blocks in engine.encode_stripes(stripes)]
+
+        def decode():
+            items = ([[blocks[i] for i in sources], sources, data_size]
+                     for blocks, (_, data_size) in zip(encoded, erasurezfec.stripe_blocks(meta)))
+            return b"".join(b"".join(views) for views, _ in engine.decode_stripes(items))
+
+        def repair():
+            return [bytes(engine.repair(0, [blocks[i] for i in read], read)) for blocks in encoded]
+
+        timings = {}
+        phases = [('encode', encode), ('decode', decode)] + ([('repair', repair)] if read is not None else [])
+        for phase, run in phases:
+            best = float('inf')
+            for _ in range(rounds):
+                start = time.perf_counter()
+                result = run()
+                best = min(best, time.perf_counter() - start)
+            timings[phase] = best
+            if phase == 'encode':
+                encoded = result
+            elif phase == 'decode' and result != data:
+                raise AssertionError(f"{name} decoded wrong data")
+            elif phase == 'repair' and result != [blocks[0] for blocks in encoded]:
+                raise AssertionError(f"{name} repaired a wrong share")
+        results[name] = timings
+    return results
+
+
+def fastest(results: Dict[str, Dict[str, float]]) -> Optional[str]:
+    """MDS codec of a benchmark() result with the least encode + decode time"""
+    candidates = [name for name in results if _codecs[name].mds]
+    return min(candidates, key=lambda name: results[name]['encode'] + results[name]['decode'], default=None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Erasure codec registry')
+    subparsers = parser.add_subparsers(dest='command', help='Command to execute')
+
+    subparsers.add_parser('list', help='List the registered codecs')
+
+    bench_parser = subparsers.add_parser('bench', help='Time every codec supporting (k, m) and pick the fastest')
+    bench_parser.add_argument('-k', type=int, default=3, help='Number of chunks needed to rebuild (default: 3)')
+    bench_parser.add_argument('-m', type=int, default=5, help='Total number of chunks to create (default: 5)')
+    bench_parser.add_argument('--size', type=int, default=64, help='MB of random data to code (default: 64)')
+    bench_parser.add_argument('--rounds', type=int, default=3, help='Runs per codec, the best is kept (default: 3)')
+    bench_parser.add_argument('--save', action='store_true', help=f'Record the fastest codec in {CHOICES_FILE}')
+
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for name, codec in _codecs.items():
+            print(f"{name}{'' if codec.mds else ' (not MDS)'}")
+    elif args.command == 'bench':
+        if not codecs(args.k, args.m):
+            parser.error(f"no codec supports k={args.k} m={args.m}")
+        size = args.size * 1024 * 1024
+        results = benchmark(args.k, args.m, size, rounds=args.rounds)
+        print(f"k={args.k} m={args.m}, {args.size} MB:")
+        for name, timings in results.items():
+            rates = "  ".join(f"{phase} {size / seconds / (1024 * 1024):8.1f} MB/s" for phase, seconds in timings.items())
+            print(f"  {name:12} {rates}")
+        best = fastest(results)
+        print(f"[INFO] Fastest: {best}")
+        if args.save and best is not None:
+            save_choice(args.k, args.m, best)
+            print(f"[INFO] Saved to {CHOICES_FILE}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
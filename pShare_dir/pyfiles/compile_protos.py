@@ -4,13 +4,13 @@ import os
 def compile_protos():
     current_dir = os.path.dirname(os.path.abspath(__file__))
 
-    proto_file = os.path.join(current_dir, 'protos', 'file_service.proto')
+    proto_file = os.path.join(current_dir, 'storage_node.proto')
     
-    output_dir = os.path.join(current_dir, 'protos')
+    output_dir = current_dir
     
     protoc.main([
         'grpc_tools.protoc',
-        f'--proto_path={os.path.join(current_dir, "protos")}',
+        f'--proto_path={current_dir}',
         f'--python_out={output_dir}',
         f'--grpc_python_out={output_dir}',
         proto_file
@@ -19,4 +19,4 @@ def compile_protos():
     print("Proto files compiled")
 
 if __name__ == '__main__':
-    compile_protos()
\ No newline at end of file
+    compile_protos()
@@ -0,0 +1,386 @@
+import os
+import sys
+import time
+import socket
+import struct
+import secrets
+import argparse
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+""" Raw TCP data plane for chunk reads, beside the gRPC file service.
+
+    gRPC stays the control plane: an S-node advertises its data port in its heartbeats
+    and the R-node asks it for a session token (OpenDataSession) on the pooled channel.
+    A read is then one request header on a plain TCP connection, answered by a response
+    header and the raw chunk bytes. The S-node sends them with socket.sendfile, so they
+    never pass through Python, and the R-node receives them into a preallocated buffer
+    with recv_into. A connection serves reads one after the other and is kept for the next.
+
+    Request:  MAGIC, token, offset, length (0 = up to the end), name size, name
+    Response: MAGIC, status, length, then length bytes of the chunk when status is OK """
+
+MAGIC = b"PSD1"
+TOKEN_SIZE = 16
+REQUEST = struct.Struct("!4s16sQQH")
+RESPONSE = struct.Struct("!4sBQ")
+OK, BAD_TOKEN, NOT_FOUND, OUT_OF_RANGE, FAILED = range(5)
+STATUS_NAMES = {OK: "OK", BAD_TOKEN: "BAD_TOKEN", NOT_FOUND: "NOT_FOUND",
+                OUT_OF_RANGE: "OUT_OF_RANGE", FAILED: "FAILED"}
+
+TOKEN_TTL = 3600 # seconds a session token is accepted
+MAX_SESSIONS = 64 # tokens an S-node remembers, the oldest is dropped first
+RECV_BUFFER_SIZE = 1024 * 1024 # bytes received before a piece is yielded
+SOCKET_BUFFER_SIZE = 4 * 1024 * 1024 # SO_SNDBUF / SO_RCVBUF
+IDLE_CONNECTIONS = 4 # connections kept open per S-node between reads
+CONNECT_TIMEOUT = 5 # seconds
+IO_TIMEOUT = 30 # seconds without progress before a read is abandoned
+
+
+class DataPlaneError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{STATUS_NAMES.get(status, status)}: {message}")
+        self.status = status
+
+
+def _recv_exact(sock: socket.socket, size: int) -> Optional[bytes]:
+    """Read exactly size bytes, None if the peer closed the connection first"""
+    data = bytearray(size)
+    view = memoryview(data)
+    while len(view):
+        count = sock.recv_into(view)
+        if count == 0:
+            return None
+        view = view[count:]
+    return bytes(data)
+
+
+def _tune(sock: socket.socket) -> None:
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SOCKET_BUFFER_SIZE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_BUFFER_SIZE)
+
+
+# ==== S-NODE ====
+class Sessions:
+    """Tokens issued to the R-node over gRPC, each accepted for ttl seconds"""
+    def __init__(self, ttl: int = TOKEN_TTL, capacity: int = MAX_SESSIONS):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.tokens: Dict[bytes, float] = {} # {token: expiry}, oldest first
+
+    def issue(self) -> bytes:
+        token = secrets.token_bytes(TOKEN_SIZE)
+        with self.lock:
+            self.tokens[token] = time.monotonic() + self.ttl
+            while len(self.tokens) > self.capacity:
+                del self.tokens[next(iter(self.tokens))]
+        return token
+
+    def check(self, token: bytes) -> bool:
+        with self.lock:
+            expiry = self.tokens.get(token)
+            if expiry is not None and expiry < time.monotonic():
+                del self.tokens[token]
+                expiry = None
+        return expiry is not None
+
+
+class DataPlaneServer:
+    """Serves reads of the chunks in files_dir on a TCP port (0 = any free one)"""
+    def __init__(self, files_dir: str, sessions: Sessions, port: int = 0):
+        self.files_dir = files_dir
+        self.sessions = sessions
+        if socket.has_dualstack_ipv6():
+            self.sock = socket.create_server(("", port), family=socket.AF_INET6, backlog=64, dualstack_ipv6=True)
+        else:
+            self.sock = socket.create_server(("", port), backlog=64)
+        self.port = self.sock.getsockname()[1]
+        self.lock = threading.Lock()
+        self.reads = 0
+        self.bytes_sent = 0
+        threading.Thread(target=self._accept_loop, daemon=True).start()
+
+
+    def _accept_loop(self) -> None:
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return # closed
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+
+    def _serve(self, conn: socket.socket) -> None:
+        """Answer the reads of one connection until the R-node closes it"""
+        with conn:
+            try:
+                _tune(conn)
+                while True:
+                    header = _recv_exact(conn, REQUEST.size)
+                    if header is None:
+                        return
+                    magic, token, offset, length, name_size = REQUEST.unpack(header)
+                    name = _recv_exact(conn, name_size)
+                    if magic != MAGIC or name is None:
+                        return
+                    if not self.sessions.check(token):
+                        conn.sendall(RESPONSE.pack(MAGIC, BAD_TOKEN, 0))
+                        return
+                    self._send_chunk(conn, name.decode(), offset, length)
+            except OSError:
+                return # the R-node went away or cancelled the read
+
+
+    def _send_chunk(self, conn: socket.socket, name: str, offset: int, length: int) -> None:
+        path = os.path.join(self.files_dir, name)
+        if os.path.basename(name) != name or not os.path.isfile(path):
+            conn.sendall(RESPONSE.pack(MAGIC, NOT_FOUND, 0))
+            return
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if offset > size:
+                conn.sendall(RESPONSE.pack(MAGIC, OUT_OF_RANGE, 0))
+                return
+            count = size - offset if length == 0 else min(length, size - offset)
+            conn.sendall(RESPONSE.pack(MAGIC, OK, count))
+            sent = conn.sendfile(f, offset, count) if count else 0
+        if sent != count:
+            raise OSError(f"sent {sent} of {count} bytes of {name}")
+        with self.lock:
+            self.reads += 1
+            self.bytes_sent += sent
+
+
+    def close(self) -> None:
+        self.sock.close()
+
+
+# ==== R-NODE ====
+class _Session:
+    def __init__(self, address: Tuple[str, int], token: bytes, expires: float):
+        self.address = address
+        self.token = token
+        self.expires = expires
+        self.idle: List[socket.socket] = []
+
+
+class _Transfer:
+    """Lets a retrieval_engine.Cancellation abort a read by shutting its socket down"""
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+
+    def cancel(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class DataPlaneClient:
+    """Session tokens and idle connections of the R-node, per S-node UUID"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions: Dict[str, _Session] = {}
+        self.connections = 0 # connections opened
+        self.reused = 0 # reads served by an idle connection
+        self.bytes_received = 0
+
+
+    def read(self, uuid: str, address: Tuple[str, int], open_session: Callable[[], Tuple[bytes, int]],
+             name: str, offset: int = 0, length: int = 0, cancellation=None) -> Iterator[memoryview]:
+        """Yield length bytes (0 = up to the end) of a chunk from offset, as views of one
+           preallocated buffer that are only valid until the next piece is requested.
+           open_session() asks the S-node for (token, ttl) over gRPC. Raises DataPlaneError
+           for a refused read and OSError for a broken connection"""
+        encoded = name.encode()
+        renewed = stale = False
+        while True:
+            session = self._session(uuid, address, open_session, renew=renewed)
+            sock, reused = self._connect(session, fresh=stale)
+            try:
+                sock.sendall(REQUEST.pack(MAGIC, session.token, offset, length, len(encoded)) + encoded)
+                header = _recv_exact(sock, RESPONSE.size)
+            except OSError:
+                sock.close()
+                if reused and not stale: # an idle connection the S-node dropped meanwhile
+                    stale = True
+                    self._drop_idle(session)
+                    continue
+                raise
+            if header is None:
+                sock.close()
+                if reused and not stale:
+                    stale = True
+                    self._drop_idle(session)
+                    continue
+                if not renewed: # the S-node may have restarted
+                    renewed = True
+                    continue
+                raise OSError(f"{address} closed the connection")
+            magic, status, count = RESPONSE.unpack(header)
+            if magic == MAGIC and status == BAD_TOKEN and not renewed: # the S-node restarted
+                sock.close()
+                renewed = True
+                continue
+            break
+        if magic != MAGIC or status != OK:
+            sock.close()
+            raise DataPlaneError(status if magic == MAGIC else FAILED, f"reading {name} from {address}")
+
+        transfer = _Transfer(sock)
+        if cancellation is not None:
+            cancellation.attach(transfer)
+        done = False
+        try:
+            buffer = memoryview(bytearray(max(min(RECV_BUFFER_SIZE, count), 1)))
+            remaining = count
+            while remaining:
+                filled, size = 0, min(len(buffer), remaining)
+                while filled < size:
+                    received = sock.recv_into(buffer[filled:size])
+                    if received == 0:
+                        raise OSError(f"{address} closed the connection with {remaining - filled:,} bytes left")
+                    filled += received
+                remaining -= filled
+                with self.lock:
+                    self.bytes_received += filled
+                yield buffer[:filled]
+            done = True
+        finally:
+            if cancellation is not None:
+                cancellation.detach(transfer) # the socket may go back to the idle pool
+            if done and not (cancellation is not None and cancellation.is_set()):
+                self._release(uuid, session, sock)
+            else:
+                sock.close()
+
+
+    def _session(self, uuid: str, address: Tuple[str, int], open_session, renew: bool) -> _Session:
+        with self.lock:
+            session = self.sessions.get(uuid)
+            if session is not None and session.address == address and not renew and session.expires > time.monotonic():
+                return session
+        token, ttl = open_session()
+        # Renew a little early so a token does not expire between the check and the read
+        fresh = _Session(address, token, time.monotonic() + ttl * 0.9)
+        with self.lock:
+            stale = self.sessions.get(uuid)
+            if stale is not None:
+                fresh.idle, stale.idle = (stale.idle if stale.address == address else []), []
+            self.sessions[uuid] = fresh
+        if stale is not None:
+            for sock in stale.idle:
+                sock.close()
+        return fresh
+
+
+    def _connect(self, session: _Session, fresh: bool = False) -> Tuple[socket.socket, bool]:
+        """(socket, whether it is an idle one) for the next read; fresh skips the idle ones"""
+        with self.lock:
+            if session.idle and not fresh:
+                self.reused += 1
+                return session.idle.pop(), True
+            self.connections += 1
+        sock = socket.create_connection(session.address, timeout=CONNECT_TIMEOUT)
+        sock.settimeout(IO_TIMEOUT)
+        _tune(sock)
+        return sock, False
+
+
+    def _drop_idle(self, session: _Session) -> None:
+        """Close the idle connections of a session after one of them turned out to be dead"""
+        with self.lock:
+            idle, session.idle = session.idle, []
+        for sock in idle:
+            sock.close()
+
+
+    def _release(self, uuid: str, session: _Session, sock: socket.socket) -> None:
+        with self.lock:
+            if self.sessions.get(uuid) is session and len(session.idle) < IDLE_CONNECTIONS:
+                session.idle.append(sock)
+                return
+        sock.close()
+
+
+    def close(self, uuid: str) -> None:
+        """Forget the session of a disconnected S-node"""
+        with self.lock:
+            session = self.sessions.pop(uuid, None)
+        for sock in (session.idle if session else []):
+            sock.close()
+
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"sessions": len(self.sessions), "connections": self.connections,
+                    "reused": self.reused, "bytes_received": self.bytes_received}
+
+
+# ==== BENCHMARK ====
+def benchmark(size_mb: int = 256, rounds: int = 3) -> None:
+    """Read one chunk from a local S-node file service over gRPC and over the data plane"""
+    import tempfile
+    import snode
+    import channel_pool
+    import storage_node_pb2
+
+    with tempfile.TemporaryDirectory() as files_dir:
+        with open(os.path.join(files_dir, "bench.0"), 'wb') as f:
+            for _ in range(size_mb):
+                f.write(os.urandom(1024 * 1024))
+        service = snode.StorageService()
+        service.files_dir = files_dir
+        server = snode.FileServer(service, "127.0.0.1:0")
+        port = server.port
+        data_server = DataPlaneServer(files_dir, service.sessions)
+        pool = channel_pool.ChannelPool()
+        stub = pool.stub("bench", f"127.0.0.1:{port}")
+        client = DataPlaneClient()
+
+        def open_session():
+            session = stub.OpenDataSession(storage_node_pb2.DataSessionRequest())
+            return session.token, session.ttl
+
+        def grpc_read():
+            return sum(len(piece.content) for piece in stub.RequestFile(storage_node_pb2.FileRequest(filename="bench.0")))
+
+        def data_plane_read():
+            return sum(len(piece) for piece in client.read("bench", ("127.0.0.1", data_server.port),
+                                                           open_session, "bench.0"))
+
+        try:
+            for name, read in (("gRPC", grpc_read), ("data plane", data_plane_read)):
+                read() # warm up the page cache and the connection
+                best = float("inf")
+                for _ in range(rounds):
+                    started = time.perf_counter()
+                    if read() != size_mb * 1024 * 1024:
+                        raise DataPlaneError(FAILED, f"{name} read was truncated")
+                    best = min(best, time.perf_counter() - started)
+                print(f"{name:>10}: {size_mb / best:,.0f} MB/s")
+        finally:
+            data_server.close()
+            pool.close_all()
+            server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="S-node raw TCP data plane")
+    subparsers = parser.add_subparsers(dest="command")
+    bench_parser = subparsers.add_parser("bench", help="Compare chunk reads over gRPC and the data plane on localhost")
+    bench_parser.add_argument("--size", type=int, default=256, help="Chunk size in MB")
+    bench_parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.command == "bench":
+        benchmark(args.size, args.rounds)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,7 +5,8 @@ from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 import sys
 import binascii
-from Crypto.Protocol.KDF import scrypt
+from Crypto.Protocol.KDF import scrypt, HKDF
+from Crypto.Hash import SHA256
 import platform
 import concurrent.futures
 import math
@@ -16,6 +17,9 @@ import binascii
 import rnode
 import shutil
 import random
+import threading
+import struct
+from collections import OrderedDict
 
 import erasure
 from checksum import store_checksum_and_salt
@@ -29,6 +33,72 @@ MAX_CHUNK_NUM = 10
 n_chunk_num = 3
 p_chunk_num = 2
 META_PATH = "registry_conf/meta_files"
+SCRYPT_N = 2**20 # ~1GiB of memory and about a second of CPU per derivation
+KEY_CACHE_SIZE = 64 # derived file keys kept in memory
+# Chunks written in per-file KDF mode start with this tag, followed by salt, nonce, data, tag
+CHUNK_MAGIC = b"PSK1"
+
+# Segmented layout: SEGMENT_MAGIC, salt (32), segment size (4), plaintext size (8), then every
+# segment at a fixed offset as nonce (16) + ciphertext + tag (16). Each segment authenticates
+# the header, its index and whether it is the last one, so segments can be encrypted and
+# verified independently, in any order, by different processes
+SEGMENT_MAGIC = b"PSS1"
+SEGMENT_HEADER_SIZE = len(SEGMENT_MAGIC) + 32 + 4 + 8
+SEGMENT_OVERHEAD = 16 + 16 # nonce + tag
+SEGMENT_BUFFERS = 64 # segment size in BUFFER_SIZE units, ~4MB
+SEGMENT_TASKS_PER_WORKER = 4 # contiguous segment ranges handed to each process
+
+
+class KeyCache:
+    """Bounded LRU of scrypt-derived keys keyed by (file, salt). Evicted or cleared keys are
+       overwritten with zeros; callers only get copies. Derivations run one at a time, so
+       chunks encrypted in parallel never hold several scrypt working sets at once"""
+    def __init__(self, max_size=KEY_CACHE_SIZE):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.derive_lock = threading.Lock()
+        self.keys = OrderedDict() # {(file, salt, password key fingerprint): bytearray}
+
+    def get(self, key, salt, file_name, chunk_num=None):
+        """scrypt(key, salt), derived once per file. With chunk_num, return that chunk's
+           HKDF subkey of it instead"""
+        entry = (file_name, bytes(salt), hashlib.sha256(key).digest())
+        master = self._lookup(entry, chunk_num)
+        if master is None:
+            with self.derive_lock:
+                master = self._lookup(entry, chunk_num)
+                if master is None:
+                    derived = bytearray(scrypt(key, salt, key_len=KEY_LEN, N=SCRYPT_N, r=8, p=1))
+                    with self.lock:
+                        self.keys[entry] = derived
+                        while len(self.keys) > self.max_size:
+                            _, evicted = self.keys.popitem(last=False)
+                            self._wipe(evicted)
+                    master = self._lookup(entry, chunk_num)
+        return master
+
+    def _lookup(self, entry, chunk_num):
+        with self.lock:
+            master = self.keys.get(entry)
+            if master is None:
+                return None
+            self.keys.move_to_end(entry)
+            if chunk_num is None:
+                return bytes(master)
+            # expanded while locked, so the master cannot be wiped halfway
+            return HKDF(master, KEY_LEN, entry[1], SHA256, context=b"pshare chunk %d" % chunk_num)
+
+    def _wipe(self, buf):
+        buf[:] = bytes(len(buf))
+
+    def clear(self):
+        with self.lock:
+            for master in self.keys.values():
+                self._wipe(master)
+            self.keys.clear()
+
+
+key_cache = KeyCache()
 
 def gen_chunk_num(rnode:rnode.RegistryNode):
     global n_chunk_num
@@ -75,18 +145,23 @@ def ensure_password():
     # print("Password verified.")
 
 # Encrypt a single chunk
-def encrypt_chunk(key, input_file_path, chunk_num, chunk_size):
-    """Encrypts a chunk of a file using AES-GCM."""
+def encrypt_chunk(key, input_file_path, chunk_num, chunk_size, salt=None):
+    """Encrypts a chunk of a file using AES-GCM. With the file's salt, the chunk key is an
+       HKDF subkey of one cached scrypt derivation per file; without it the chunk gets its
+       own salt and scrypt derivation (the original format)"""
     file_name = os.path.basename(input_file_path)
     with open(input_file_path, 'rb') as input_file:
         input_file.seek(chunk_num * chunk_size)
         plaintext = input_file.read(chunk_size)
 
-    # Generate random salt
-    salt = get_random_bytes(32)
-
-    # AES key derivation using the salt
-    key = scrypt(key, salt, key_len=KEY_LEN, N=2**20, r=8, p=1)
+    if salt is None:
+        # Generate random salt, AES key derivation using the salt
+        salt = get_random_bytes(32)
+        header = b""
+        key = key_cache.get(key, salt, file_name)
+    else:
+        header = CHUNK_MAGIC
+        key = key_cache.get(key, salt, file_name, chunk_num)
 
     # Encrypt using AES-GCM
     cipher = AES.new(key, AES.MODE_GCM)
@@ -95,12 +170,114 @@ def encrypt_chunk(key, input_file_path, chunk_num, chunk_size):
 
     # Store the salt + nonce + encrypted data
     with open(f"temp/{file_name}_info_/{file_name}", "wb") as output:
+        output.write(header)
         output.write(salt)
         output.write(cipher.nonce)
         output.write(encrypted_data)
         output.write(tag)
 
 
+def _segment_layout(header):
+    """Return (segment size, plaintext size, segment count) of a segmented file header"""
+    segment_size, file_size = struct.unpack_from(">IQ", header, len(SEGMENT_MAGIC) + 32)
+    return segment_size, file_size, max(1, -(-file_size // segment_size))
+
+
+def _segment_aad(header, index, last):
+    return header + struct.pack(">QB", index, last)
+
+
+def _encrypt_segments(key, header, input_path, output_path, first, count):
+    """Encrypt segments [first, first + count) of input_path into their slots of output_path"""
+    segment_size, _, segments = _segment_layout(header)
+    in_fd = os.open(input_path, os.O_RDONLY)
+    out_fd = os.open(output_path, os.O_WRONLY)
+    try:
+        for index in range(first, first + count):
+            plaintext = os.pread(in_fd, segment_size, index * segment_size)
+            cipher = AES.new(key, AES.MODE_GCM) # fresh random 16 byte nonce
+            cipher.update(_segment_aad(header, index, index == segments - 1))
+            ciphertext, tag = cipher.encrypt_and_digest(plaintext)
+            os.pwrite(out_fd, cipher.nonce + ciphertext + tag,
+                      SEGMENT_HEADER_SIZE + index * (segment_size + SEGMENT_OVERHEAD))
+    finally:
+        os.close(in_fd)
+        os.close(out_fd)
+
+
+def _decrypt_segments(key, header, input_path, output_path, first, count):
+    """Verify and decrypt segments [first, first + count) of input_path into output_path;
+       raises ValueError on the first segment whose tag does not match"""
+    segment_size, file_size, segments = _segment_layout(header)
+    in_fd = os.open(input_path, os.O_RDONLY)
+    out_fd = os.open(output_path, os.O_WRONLY)
+    try:
+        for index in range(first, first + count):
+            plain_size = min(segment_size, file_size - index * segment_size)
+            sealed = os.pread(in_fd, plain_size + SEGMENT_OVERHEAD,
+                              SEGMENT_HEADER_SIZE + index * (segment_size + SEGMENT_OVERHEAD))
+            if len(sealed) != plain_size + SEGMENT_OVERHEAD:
+                raise ValueError(f"segment {index} is truncated")
+            cipher = AES.new(key, AES.MODE_GCM, nonce=sealed[:16])
+            cipher.update(_segment_aad(header, index, index == segments - 1))
+            plaintext = cipher.decrypt_and_verify(sealed[16:-16], sealed[-16:])
+            os.pwrite(out_fd, plaintext, index * segment_size)
+    finally:
+        os.close(in_fd)
+        os.close(out_fd)
+
+
+def _run_segments(work, key, header, input_path, output_path, workers=None):
+    """Split the segments into contiguous ranges and run work on them in a process pool"""
+    segments = _segment_layout(header)[2]
+    workers = min(workers or os.cpu_count() or 1, segments)
+    if workers <= 1:
+        work(key, header, input_path, output_path, 0, segments)
+        return
+    per_task = -(-segments // (workers * SEGMENT_TASKS_PER_WORKER))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(work, key, header, input_path, output_path, first, min(per_task, segments - first))
+                   for first in range(0, segments, per_task)]
+        for future in futures:
+            future.result()
+
+
+def _preallocate(path, size):
+    with open(path, "wb") as f:
+        f.truncate(size)
+        if hasattr(os, "posix_fallocate") and size:
+            os.posix_fallocate(f.fileno(), 0, size)
+
+
+def encrypt_segmented(key, input_file_path, output_path, salt, workers=None):
+    """Encrypt input_file_path into output_path in independent segments on every core, each
+       written with pwrite to its offset of the preallocated output"""
+    file_name = os.path.basename(input_file_path)
+    file_size = os.path.getsize(input_file_path)
+    segment_size = BUFFER_SIZE * SEGMENT_BUFFERS
+    header = SEGMENT_MAGIC + salt + struct.pack(">IQ", segment_size, file_size)
+    segments = _segment_layout(header)[2]
+    _preallocate(output_path, SEGMENT_HEADER_SIZE + file_size + segments * SEGMENT_OVERHEAD)
+    with open(output_path, "r+b") as f:
+        f.write(header)
+    _run_segments(_encrypt_segments, key_cache.get(key, salt, file_name, 0), header,
+                  input_file_path, output_path, workers)
+
+
+def decrypt_segmented(key, input_path, output_path, file_name, workers=None):
+    """Reverse of encrypt_segmented; output_path is removed if any segment fails to verify"""
+    with open(input_path, "rb") as f:
+        header = f.read(SEGMENT_HEADER_SIZE)
+    salt = header[len(SEGMENT_MAGIC):len(SEGMENT_MAGIC) + 32]
+    _preallocate(output_path, _segment_layout(header)[1])
+    try:
+        _run_segments(_decrypt_segments, key_cache.get(key, salt, file_name, 0), header,
+                      input_path, output_path, workers)
+    except Exception:
+        os.remove(output_path)
+        raise
+
+
 """  File chunks = f(snode count)
     s: n/p = {1 and 2: file copies, 3: 2/1, 4: 2/2, 5: 3/2, 6: 3/3, 7: 4/3}
     {8: 4/4, 9: 5/4, 10: 5/5, 11: 6/5, 12: 7/5, 17: 12/5, 100: 89/11, 1000: 967/33} """
@@ -123,8 +300,10 @@ def genChunkNum(rnode:rnode.RegistryNode, num_s): # pass num_s so can choose to
 
 
 # Encrypt an entire file
-def encrypt(input_file_path: str):
-    """Encrypts a file by splitting it into chunks and using the master password."""
+def encrypt(input_file_path: str, kdf_per_file: bool = True):
+    """Encrypts a file by splitting it into chunks and using the master password.
+       kdf_per_file runs scrypt once for the file and encrypts it in segments on every core
+       (encrypt_segmented), otherwise the file is one chunk with its own scrypt derivation"""
     masked_name = new_enc.encrypt_filename(input_file_path)
     if masked_name == None:
         masked_name = new_enc.encrypt_file(input_file_path)
@@ -157,10 +336,11 @@ def encrypt(input_file_path: str):
 
     file_size = os.path.getsize(input_file_path) 
 
-    # Encrypt chunks in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        futures = [executor.submit(encrypt_chunk, key, input_file_path, i, file_size) for i in range(1)]
-        concurrent.futures.wait(futures)
+    # Encrypt segments in parallel
+    if kdf_per_file:
+        encrypt_segmented(key, input_file_path, f"{temp_dir}/{os.path.basename(input_file_path)}", get_random_bytes(32))
+    else:
+        encrypt_chunk(key, input_file_path, 0, file_size)
 
     # Apply erasure coding for redundancy
     # erasure.padding(os.path.basename(input_file_path), n_chunk_num)
@@ -187,17 +367,25 @@ def decrypt_chunk(key, input_file_path, chunk_num: int):
     print(f"Decrypting {chunk_path}")
 
     with open(chunk_path, "rb") as input_file:
+        # Chunks written with one KDF per file start with CHUNK_MAGIC
+        header = input_file.read(len(CHUNK_MAGIC))
+        if header != CHUNK_MAGIC:
+            header = b""
+            input_file.seek(0)
         salt = input_file.read(32)  # Read the stored salt
         nonce = input_file.read(16)  # Read the stored nonce
         
         # DEBUG: Print salt to ensure it's being read correctly
         print(f"Chunk {chunk_num} - Read Salt: {binascii.hexlify(salt)}")
         
-        key = scrypt(key, salt, key_len=KEY_LEN, N=2**20, r=8, p=1)
+        if header:
+            key = key_cache.get(key, salt, file_name, chunk_num)
+        else:
+            key = key_cache.get(key, salt, file_name)
         cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
 
         input_size = os.path.getsize(chunk_path)
-        data_size = input_size - 64
+        data_size = input_size - 64 - len(header)
 
         encrypted_data = input_file.read(data_size)
         tag = input_file.read(16)
@@ -248,14 +436,19 @@ def decrypt(input_file_path: str):
         
 
 
-    # Decrypt each chunk in parallel
-    with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        decryption_tasks = [executor.submit(decrypt_chunk, key, input_file_path, i) for i in range(1)]
-
+    # Decrypt segments in parallel, verifying every tag as it goes
+    with open(original_path, "rb") as f:
+        segmented = f.read(len(SEGMENT_MAGIC)) == SEGMENT_MAGIC
+    if segmented:
+        try:
+            decrypt_segmented(key, original_path, input_file_path, file_name)
+        except ValueError:
+            print(f"MAC check failed for {file_name} - possible key mismatch!")
+            exit(1)
+    else:
+        decrypted_data = decrypt_chunk(key, input_file_path, 0)
         with open(input_file_path, "wb") as output:
-            for task in decryption_tasks:
-                decrypted_data = task.result()
-                output.write(decrypted_data)
+            output.write(decrypted_data)
 
     # Clean up temporary decryption files
     cmd_util.remove_all(f"temp/{file_name}_info_")
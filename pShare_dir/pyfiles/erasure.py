@@ -1,4 +1,5 @@
 from reedsolo import RSCodec, ReedSolomonError
+import numpy as np
 import argparse
 import cmd_util
 import shutil
@@ -6,228 +7,331 @@ import glob
 import os
 import math
 import sys
+import time
 
 
+""" Systematic Reed-Solomon over GF(256), n data chunks (_enc_i) and p parity chunks (_par_j).
+
+    Byte b of every chunk forms one codeword enc_0[b] .. enc_{n-1}[b], par_0[b] .. par_{p-1}[b],
+    the same codeword reedsolo's RSCodec(p) produces, so chunks stay compatible with it.
+    The parity is linear in the data: par_j = XOR_i PARITY[i][j] * enc_i, so it is computed
+    for a whole stripe of every chunk at once with a 256x256 multiplication table instead
+    of one RSCodec call per byte. Missing chunks are rebuilt the same way from the inverse
+    of the code matrix of the chunks that are left. """
 
 CHUNK_SIZE_EC = 8192
+STRIPE_SIZE = 4 * 1024 * 1024 # bytes of every chunk coded at once
+
+# Same field as RSCodec's defaults: primitive polynomial 0x11d, generator 2, fcr 0
+PRIM = 0x11d
+
+
+def _build_tables():
+    exp = np.zeros(512, dtype=np.int32)
+    log = np.zeros(256, dtype=np.int32)
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= PRIM
+    exp[255:510] = exp[:255]
+    exp[510:] = exp[:2]
+    # GF_MUL[a][b] = a * b, a row is the lookup table of "multiply by a"
+    mul = exp[log[:, None] + log[None, :]].astype(np.uint8)
+    mul[0, :] = 0
+    mul[:, 0] = 0
+    return exp, log, mul
+
+GF_EXP, GF_LOG, GF_MUL = _build_tables()
+
+
+def gf_inverse(a:int):
+    return int(GF_EXP[255 - GF_LOG[a]])
+
+
+def parity_matrix(n_chunk_num:int, p_chunk_num:int):
+    """n x p matrix, row i is the parity RSCodec(p) computes for a message that is 1 at byte i"""
+    # generator polynomial (x - a^0)(x - a^1)...(x - a^(p-1)), highest degree first
+    gen = [1]
+    for i in range(p_chunk_num):
+        gen = [a ^ int(GF_MUL[b, GF_EXP[i]]) for a, b in zip(gen + [0], [0] + gen)]
+    rows = []
+    for i in range(n_chunk_num):
+        # remainder of (e_i * x^p) / gen by synthetic division
+        msg = [0] * (n_chunk_num + p_chunk_num)
+        msg[i] = 1
+        for pos in range(n_chunk_num):
+            coef = msg[pos]
+            if coef:
+                for j in range(1, len(gen)):
+                    msg[pos + j] ^= int(GF_MUL[gen[j], coef])
+        rows.append(msg[n_chunk_num:])
+    return np.array(rows, dtype=np.uint8)
+
+
+def gf_invert_matrix(matrix):
+    """Gauss-Jordan inverse of a square GF(256) matrix"""
+    size = len(matrix)
+    a = [[int(v) for v in row] + [int(i == j) for j in range(size)] for i, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = next((r for r in range(col, size) if a[r][col]), None)
+        if pivot is None:
+            raise ValueError("singular matrix")
+        a[col], a[pivot] = a[pivot], a[col]
+        inv = gf_inverse(a[col][col])
+        a[col] = [int(GF_MUL[inv, v]) for v in a[col]]
+        for r in range(size):
+            if r != col and a[r][col]:
+                factor = a[r][col]
+                a[r] = [v ^ int(GF_MUL[factor, w]) for v, w in zip(a[r], a[col])]
+    return np.array([row[size:] for row in a], dtype=np.uint8)
+
+
+def combine(coefs, blocks):
+    """XOR_i coefs[i] * blocks[i] over equally sized uint8 arrays"""
+    out = np.zeros(len(blocks[0]), dtype=np.uint8)
+    for coef, block in zip(coefs, blocks):
+        if coef == 1:
+            out ^= block
+        elif coef:
+            out ^= GF_MUL[coef][block]
+    return out
+
+
+def encode_stripe(parity, blocks):
+    """Parity blocks of one stripe, blocks are the n data blocks as uint8 arrays"""
+    return [combine(parity[:, j], blocks) for j in range(parity.shape[1])]
+
+
+def decode_stripe(parity, blocks, missing, rsc=None):
+    """Rebuild the n data blocks of one stripe. blocks holds all n + p positions (data first),
+       the ones listed in missing are ignored. When more than n blocks are left the extra ones
+       check the result, and the bytes that do not match go through RSCodec error correction"""
+    n_chunk_num, p_chunk_num = parity.shape
+    total = n_chunk_num + p_chunk_num
+    present = [i for i in range(total) if i not in missing]
+    if len(present) < n_chunk_num:
+        raise ReedSolomonError("too many missing chunks")
+    used, extra = present[:n_chunk_num], present[n_chunk_num:]
+
+    data = [None] * n_chunk_num
+    for i in used:
+        if i < n_chunk_num:
+            data[i] = blocks[i]
+    if any(block is None for block in data):
+        # code matrix [I | PARITY] restricted to the chunks used, solve for the data
+        code = np.concatenate([np.eye(n_chunk_num, dtype=np.uint8), parity], axis=1)
+        inverse = gf_invert_matrix(code[:, used])
+        for j in range(n_chunk_num):
+            if data[j] is None:
+                data[j] = combine(inverse[:, j], [blocks[i] for i in used])
+
+    bad = np.zeros(len(data[0]), dtype=bool)
+    for i in extra:
+        expected = data[i] if i < n_chunk_num else combine(parity[:, i - n_chunk_num], data)
+        bad |= expected != blocks[i]
+    if bad.any():
+        # corrupted (not missing) bytes: correct them one codeword at a time
+        rsc = rsc or RSCodec(p_chunk_num)
+        data = [block.copy() for block in data]
+        for pos in np.nonzero(bad)[0]:
+            codeword = bytearray(0 if i in missing else int(blocks[i][pos]) for i in range(total))
+            dec = rsc.decode(codeword, erase_pos=list(missing) or None)
+            for j in range(n_chunk_num):
+                data[j][pos] = dec[0][j]
+    return data
+
+
+def _chunk_path(input_file_path:str, kind:str, i:int):
+    return f"temp/{input_file_path}_info_/{input_file_path}_{kind}_{i}"
+
 
 def padding(input_file_path:str,n_chunk_num=3):
     # padding size should be the difference between normal chunk and last chunk
-    padding_size = os.path.getsize(f"temp/{input_file_path}_info_/{input_file_path}_enc_0") - os.path.getsize(f"temp/{input_file_path}_info_/{input_file_path}_enc_{n_chunk_num-1}")
+    padding_size = os.path.getsize(_chunk_path(input_file_path, "enc", 0)) - os.path.getsize(_chunk_path(input_file_path, "enc", n_chunk_num-1))
 
     # if there is no need for padding just return
     if padding_size == 0: return 0
-    last_chunk = open(f"temp/{input_file_path}_info_/{input_file_path}_enc_{n_chunk_num-1}","ab")
-    # cast padding to one byte byte data because the way we devide, 
+    # cast padding to one byte byte data because the way we devide,
     # there should not be pad greater than number of encrypted chunk
     # one byte should be enough to fill out the gap, as we won't devide file into too many chunks
-    byte_data= int(padding_size).to_bytes(1,'big')
-
-    # write the pad to file to fill out the gap
-    for i in range(padding_size):
-        last_chunk.write(byte_data)
-    last_chunk.close()
+    with open(_chunk_path(input_file_path, "enc", n_chunk_num-1),"ab") as last_chunk:
+        # write the pad to file to fill out the gap
+        last_chunk.write(bytes([padding_size]) * padding_size)
 
     return 1
 
 def depad(input_file_path:str,n_chunk_num=3):
-    file_name = f"temp/{input_file_path}_info_/{input_file_path}_dec_{n_chunk_num-1}"
+    file_name = _chunk_path(input_file_path, "dec", n_chunk_num-1)
     # get file size
-    file_size = os.path.getsize(f"temp/{input_file_path}_info_/{input_file_path}_dec_{n_chunk_num-1}")
-    last_chunk = open(file_name,"rb")
-    # read last byte to get pad size
-    last_chunk.seek(file_size-1)
-    pad_data = last_chunk.read(1)
-    # convert byte to int
-    padding_size = int.from_bytes(pad_data,'big')
-    # there should not be pad greater than number of encrypted chunk
-    # if we get this case, should be no padding
-    if (padding_size > n_chunk_num):
-        return "Padding error"
-    print(f"padding size:{padding_size}, ")
-    # seek the head of the pad
-    last_chunk.seek(file_size - padding_size)
-    print(f"seek pos: {file_size-padding_size}")
-
-    # read padding
-    data = last_chunk.read(1)
-
-    
-    
-    cnt = 0
-    while data != b'':
-        print(f"pad read: {data}")
+    file_size = os.path.getsize(file_name)
+    with open(file_name,"rb") as last_chunk:
+        # read last byte to get pad size
+        last_chunk.seek(file_size-1)
+        padding_size = last_chunk.read(1)[0]
+        # there should not be pad greater than number of encrypted chunk
+        # if we get this case, should be no padding
+        if (padding_size > n_chunk_num):
+            return "Padding error"
         # as we write padding to fill the gap
         # content in the padding should be padding size
         # other wise padding error
-        if (padding_size != int.from_bytes(data,'big')):
+        last_chunk.seek(file_size - padding_size)
+        if last_chunk.read(padding_size) != bytes([padding_size]) * padding_size:
             print("might be a padding error, treat as no padding")
-            return 
-        cnt += 1
-        data = last_chunk.read(1)
-    # number of byte in padding should be the padding size otherwise error
-    if (cnt != padding_size): 
-        print("might be a padding error, treat as no padding")
-        return 
-    # create temporary file to record original data
-    shutil.copy(file_name,"depad")
-    last_chunk.close()
-
-    temp_chunk = open("depad","rb")
-    # for large file, we can only read a chunk each time, calculate how many time we need to read
-    iteration = int(file_size / CHUNK_SIZE_EC)
-    # to locate if padding cross the read chunk
-    shift_size = 0
-    # as computer division round down, if there is something left, need one more iteration
-    if (file_size % CHUNK_SIZE_EC != 0):
-        iteration += 1
-        # if padding cross the chunk, only for remainder chunk, if no chunk left, there is no need to 
-        # remove one iteration
-        if (file_size % CHUNK_SIZE_EC <= padding_size) :
-            iteration -= 1
-            # if cross chunk, the remainder will be the padding left in the new iteration
-            shift_size = file_size % CHUNK_SIZE_EC
-   
-    # last chunk read size should be file size - buffer block already readed (as one more iter left)
-    # iteration need to -1, padding size left in the last chunk need to - remainder, and don't need 
-    # to read pads, so need to - padding size
-    last_read_size = file_size - (iteration-1) * CHUNK_SIZE_EC - (padding_size - shift_size)
-    print(f"last read size: {last_read_size}")
-    # read pad and write to file chunk used for decryption
-    last_chunk = open(file_name,"wb")
-    for i in range(iteration):
-        if i == iteration - 1:
-            temp_data = temp_chunk.read(last_read_size)
-            last_chunk.write(temp_data)
-        else: 
-            temp_data = temp_chunk.read(CHUNK_SIZE_EC)
-            last_chunk.write(temp_data)
-    last_chunk.close()
-    temp_chunk.close()
-    # remove the temporary file
-    os.remove("depad")
+            return
+    # cut the pad off the chunk used for decryption
+    os.truncate(file_name, file_size - padding_size)
     return None
 
 
 
 
 def fill_chunk(input_file_path:str,n_chunk_num=3,p_chunk_num=2):
-    if p_chunk_num == 0: return 
-    # check if all chunk are there
-    missing_chunk = 0
-    # to find first chunk exist, as all chunk have same size, copy one chunk to another can fill the gap
-    exist_chunk_name = glob.glob(f"temp/{input_file_path}_info_/*")[0]
-    # if only last chunk survives, there is too many missing chunks, as usually we won't create
-    # parity chunk number = 2* normal chunk number
-    if exist_chunk_name == os.path.abspath(f"temp/{input_file_path}_info_/{input_file_path}_enc_{n_chunk_num-1}"):
-        raise Exception("too many missing chunk")
-    
-    # if miss one chunk, just copy another in
-    for i in range(n_chunk_num):
-        if cmd_util.check_exist(f"temp/{input_file_path}_info_/{input_file_path}_enc_{i}") == False:
-            shutil.copy(exist_chunk_name,f"temp/{input_file_path}_info_/{input_file_path}_enc_{i}")
-            missing_chunk+=1
-    for i in range(p_chunk_num):
-        if cmd_util.check_exist(f"temp/{input_file_path}_info_/{input_file_path}_par_{i}") == False:
-            shutil.copy(exist_chunk_name,f"temp/{input_file_path}_info_/{input_file_path}_par_{i}")
-            missing_chunk+=1
-    # check if there is too many chunk missing
-    if missing_chunk > p_chunk_num/2:
+    """Return the codeword positions (enc_i -> i, par_j -> n + j) of the missing chunks,
+       after copying an existing chunk in their place so every chunk file exists"""
+    if p_chunk_num == 0: return []
+    chunks = [_chunk_path(input_file_path, "enc", i) for i in range(n_chunk_num)] + \
+             [_chunk_path(input_file_path, "par", i) for i in range(p_chunk_num)]
+    missing = [i for i, chunk in enumerate(chunks) if cmd_util.check_exist(chunk) == False]
+    # the missing chunks are known, so up to p of them can be rebuilt
+    if len(missing) > p_chunk_num:
         raise Exception("too many missing chunk")
 
+    # all chunks have same size, copy one chunk to another to fill the gap
+    exist_chunk_name = chunks[next(i for i in range(len(chunks)) if i not in missing)]
+    for i in missing:
+        shutil.copy(exist_chunk_name, chunks[i])
+    return missing
+
 
 def encode(input_file_path:str = None,n_chunk_num:int=3,p_chunk_num:int=2):
-    if p_chunk_num == 0: return 
-    rsc = RSCodec(p_chunk_num)
-    
-
-    head_pos = 0
-    while True:
-        byte=b""
-        # read one byte each time from each chunk to compute reedsolomon across different chunks
-        for i in range(n_chunk_num):
-            cur_file = open(f"temp/{input_file_path}_info_/{input_file_path}_enc_{i}","rb")
-            cur_file.seek(head_pos)
-            
-            byte += cur_file.read(1)
-            cur_file.close
-        head_pos += 1
-
-        if len(byte) <= 0:
-            break
-        # generate reedsoloman encode along the file bytes
-        enc = rsc.encode(byte)
-        # find where parity byte starts
-        pos = len(enc) - p_chunk_num
-        num = 0
-        # write corresponding parity byte to corresponding chunks
-        while pos < len(enc):
-            par_file = open(f"temp/{input_file_path}_info_/{input_file_path}_par_{num}","ab")
-            par_file.write(enc[pos:pos+1])
-            par_file.close()
-            num+=1
-            pos+=1
-        
-
-    
+    if p_chunk_num == 0: return
+    parity = parity_matrix(n_chunk_num, p_chunk_num)
+    sizes = {os.path.getsize(_chunk_path(input_file_path, "enc", i)) for i in range(n_chunk_num)}
+    if len(sizes) > 1:
+        raise ValueError("data chunks differ in size, pad the last one first")
+
+    data_files = [open(_chunk_path(input_file_path, "enc", i), "rb") for i in range(n_chunk_num)]
+    par_files = [open(_chunk_path(input_file_path, "par", j), "wb") for j in range(p_chunk_num)]
+    try:
+        # one stripe of every data chunk at a time, each parity chunk written once per stripe
+        while True:
+            blocks = [np.frombuffer(f.read(STRIPE_SIZE), dtype=np.uint8) for f in data_files]
+            if len(blocks[0]) == 0:
+                break
+            for par_file, block in zip(par_files, encode_stripe(parity, blocks)):
+                par_file.write(block.tobytes())
+    finally:
+        for f in data_files + par_files:
+            f.close()
+
+
+
 def decode(input_file_path:str = None,n_chunk_num:int=3,p_chunk_num:int=2):
-    if p_chunk_num == 0: return 
+    if p_chunk_num == 0: return
     rsc = RSCodec(p_chunk_num)
+    parity = parity_matrix(n_chunk_num, p_chunk_num)
 
-    head_pos = 0
     # check if too many chunks missing, and fill up missing chunks
     try:
-        fill_chunk(input_file_path,n_chunk_num,p_chunk_num)
+        missing = fill_chunk(input_file_path,n_chunk_num,p_chunk_num)
     except Exception as e:
         return e
-    while True:
-        byte=b""
-        # read one byte each time from each chunk to compute reedsolomon across different chunks
-        for i in range(n_chunk_num):
-            if cmd_util.check_exist(f"temp/{input_file_path}_info_/{input_file_path}_enc_{i}"):
-                cur_file = open(f"temp/{input_file_path}_info_/{input_file_path}_enc_{i}","rb")
-                cur_file.seek(head_pos)
-            
-                byte += cur_file.read(1)
-                cur_file.close()
-        for i in range(p_chunk_num):
-            if cmd_util.check_exist(f"temp/{input_file_path}_info_/{input_file_path}_par_{i}"):
-                par_file = open(f"temp/{input_file_path}_info_/{input_file_path}_par_{i}","rb")
-                par_file.seek(head_pos)
-                byte += par_file.read(1)
-                par_file.close()
-        head_pos += 1
-        # if no data read, exit the loop
-        if len(byte) <= 0:
-            break
-        # decode the byte string
-        try:
-            dec = rsc.decode(byte)
-        except:
-            return "too many error, fail to decode"
-        # write data to each file used to decrypt
-        for i in range(len(dec[0])):
-            out_file = open(f"temp/{input_file_path}_info_/{input_file_path}_dec_{i}","ab")
-            out_file.write(dec[0][i:i+1])
-            out_file.close
+    chunks = [open(_chunk_path(input_file_path, "enc", i), "rb") for i in range(n_chunk_num)] + \
+             [open(_chunk_path(input_file_path, "par", i), "rb") for i in range(p_chunk_num)]
+    out_files = [open(_chunk_path(input_file_path, "dec", i), "wb") for i in range(n_chunk_num)]
+    try:
+        while True:
+            blocks = [np.frombuffer(f.read(STRIPE_SIZE), dtype=np.uint8) for f in chunks]
+            # if no data read, exit the loop
+            if len(blocks[0]) == 0:
+                break
+            try:
+                data = decode_stripe(parity, blocks, missing, rsc)
+            except ReedSolomonError:
+                return "too many error, fail to decode"
+            # write data to each file used to decrypt
+            for out_file, block in zip(out_files, data):
+                out_file.write(block.tobytes())
+    finally:
+        for f in chunks + out_files:
+            f.close()
     return None
 
 
+def benchmark(size:int, n_chunk_num:int=3, p_chunk_num:int=2, legacy_size:int=64 * 1024):
+    """MB/s of the stripe codec and of one RSCodec call per byte (the previous encode/decode,
+       without its per-byte file opens), encoding size bytes per chunk and decoding with the
+       first data chunk missing. The per-byte path only codes legacy_size bytes, it is slow"""
+    parity = parity_matrix(n_chunk_num, p_chunk_num)
+    rsc = RSCodec(p_chunk_num)
+    blocks = [np.frombuffer(os.urandom(size), dtype=np.uint8) for _ in range(n_chunk_num)]
+    codewords = blocks + encode_stripe(parity, blocks)
+    total_mb = size * n_chunk_num / (1024 * 1024)
+    legacy_mb = legacy_size * n_chunk_num / (1024 * 1024)
+    rates = {}
+
+    start = time.perf_counter()
+    encode_stripe(parity, blocks)
+    rates['encode stripes'] = total_mb / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for pos in range(legacy_size):
+        rsc.encode(bytearray(int(block[pos]) for block in blocks))
+    rates['encode per byte'] = legacy_mb / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    decode_stripe(parity, codewords, [0], rsc)
+    rates['decode stripes'] = total_mb / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for pos in range(legacy_size):
+        codeword = bytearray(int(block[pos]) for block in codewords)
+        codeword[0] = 0
+        rsc.decode(codeword, erase_pos=[0])
+    rates['decode per byte'] = legacy_mb / (time.perf_counter() - start)
+    return rates
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Reed-Solomon erasure coding of the chunks in temp/<file>_info_')
+    subparsers = parser.add_subparsers(dest='command', help='Command to execute')
+
+    encode_parser = subparsers.add_parser('encode', help='Write the parity chunks of a file')
+    encode_parser.add_argument('-f', '--filepath', type=str, required=True, help="file whose chunks are encoded")
+    encode_parser.add_argument('-n', type=int, default=3, help='Number of data chunks (default: 3)')
+    encode_parser.add_argument('-p', type=int, default=2, help='Number of parity chunks (default: 2)')
+
+    decode_parser = subparsers.add_parser('decode', help='Rebuild the data chunks of a file')
+    decode_parser.add_argument('-f', '--filepath', type=str, required=True, help="file whose chunks are decoded")
+    decode_parser.add_argument('-n', type=int, default=3, help='Number of data chunks (default: 3)')
+    decode_parser.add_argument('-p', type=int, default=2, help='Number of parity chunks (default: 2)')
 
+    bench_parser = subparsers.add_parser('bench', help='Compare the stripe codec with one RSCodec call per byte')
+    bench_parser.add_argument('--size', type=int, default=16, help='MB per data chunk (default: 16)')
+    bench_parser.add_argument('-n', type=int, default=3, help='Number of data chunks (default: 3)')
+    bench_parser.add_argument('-p', type=int, default=2, help='Number of parity chunks (default: 2)')
 
-            
-# def main(args):
-#     if args.encode == True:
-#         encode(input_file_path=args.filepath)
-#     else:
-#         decode(input_file_path=args.filepath)
+    args = parser.parse_args()
 
-# if __name__ == '__main__':
-#     parser = argparse.ArgumentParser()
-#     parser.add_argument('-f', '--filepath', type=str, required=True, help="file path need to be encode or decode")
-#     parser.add_argument('-e','--encode',action='store_true', help="whether in encode or decode mode")
-#     args = parser.parse_args()
-#     main(args)
+    if args.command == 'encode':
+        encode(args.filepath, args.n, args.p)
+    elif args.command == 'decode':
+        err = decode(args.filepath, args.n, args.p)
+        if err:
+            print(err)
+            return 1
+    elif args.command == 'bench':
+        print(f"{args.size} MB per chunk, n={args.n}, p={args.p}")
+        for name, rate in benchmark(args.size * 1024 * 1024, args.n, args.p).items():
+            print(f"{name:<18}{rate:>10.2f} MB/s")
+    else:
+        parser.print_help()
 
+    return 0
 
-    
\ No newline at end of file
+if __name__ == '__main__':
+    sys.exit(main())
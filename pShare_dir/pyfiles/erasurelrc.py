@@ -0,0 +1,226 @@
+import os
+import time
+import argparse
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import erasurezfec
+from erasurezfec import STRIPE_SIZE
+
+
+""" Local Reconstruction Codes (LRC) on top of zfec, so that losing one share costs a small
+    local group of reads instead of k.
+
+    The k data blocks of a stripe are split into l local groups; each group gets an XOR
+    parity block, and g global parities are zfec's parity blocks over all k data blocks.
+    Share numbers: 0..k-1 data, k..k+g-1 global parities, k+g..k+g+l-1 local parities, so
+    m = k + g + l and shares 0..k+g-1 are exactly what zfec(k, k+g) would produce.
+
+    A lost data share or local parity is rebuilt by XORing the rest of its group; a lost
+    global parity, or two losses in one group, needs the stripe decoded. Block sizes (and so
+    padding and share sizes) are those of erasurezfec: a share is the concatenation of its
+    blocks, so the XOR of whole shares is the share made of the XORed blocks.
+
+    The .meta of an LRC file has codec=lrc and local_groups=l; g is m - k - l. """
+
+GROUP_SIZE = 4 # data blocks per local group, i.e. the shares read to rebuild one
+
+
+def layout(k: int, m: int, group_size: int = GROUP_SIZE) -> Optional[Tuple[int, int]]:
+    """(local groups, global parities) for k data shares out of m, keeping at least one
+       global parity; None when m - k < 2 leaves no room for both"""
+    if m - k < 2:
+        return None
+    local_groups = min(-(-k // group_size), m - k - 1)
+    return local_groups, m - k - local_groups
+
+
+def groups(k: int, local_groups: int) -> List[List[int]]:
+    """The data share numbers of every local group, as even as possible"""
+    return [list(range(j * k // local_groups, (j + 1) * k // local_groups)) for j in range(local_groups)]
+
+
+def xor_blocks(blocks) -> memoryview:
+    """XOR of equally sized blocks (bytes or memoryviews), as a new buffer"""
+    result = np.frombuffer(blocks[0], dtype=np.uint8).copy()
+    for block in blocks[1:]:
+        np.bitwise_xor(result, np.frombuffer(block, dtype=np.uint8), out=result)
+    return result.data
+
+
+class LRCEncoder(erasurezfec.StripeEncoder):
+    def __init__(self, k, local_groups, global_parities, stripe_size=STRIPE_SIZE):
+        super().__init__(k, k + global_parities, stripe_size)
+        self.global_parities = global_parities
+        self.local_groups = local_groups
+        self.m = k + global_parities + local_groups
+        self.groups = groups(k, local_groups)
+
+    def encode(self, stripe, sharenums=None):
+        """Return the m blocks of one stripe, or only the blocks sharenums, in that order"""
+        wanted = list(range(self.m)) if sharenums is None else list(sharenums)
+        primary = self.primary(stripe)
+        first_local = self.k + self.global_parities
+        blocks = {}
+        coded = [n for n in wanted if n < first_local]
+        if coded:
+            blocks.update(zip(coded, self.encoder.encode(primary, tuple(coded))))
+        for n in wanted:
+            if n >= first_local:
+                blocks[n] = xor_blocks([primary[i] for i in self.groups[n - first_local]])
+        return [blocks[n] for n in wanted]
+
+
+class LRCDecoder:
+    def __init__(self, k, local_groups, global_parities):
+        self.k = k
+        self.global_parities = global_parities
+        self.first_local = k + global_parities
+        self.groups = groups(k, local_groups)
+        self.decoder = erasurezfec.StripeDecoder(k, k + global_parities)
+
+    def plan(self, sharenums) -> Optional[Tuple[List[int], List[int]]]:
+        """(local parities, global parities) to use besides the data shares of sharenums,
+           None when sharenums cannot rebuild the stripe"""
+        available = set(sharenums)
+        locals_used, missing = [], 0
+        for j, group in enumerate(self.groups):
+            lost = [i for i in group if i not in available]
+            if len(lost) == 1 and self.first_local + j in available:
+                locals_used.append(self.first_local + j)
+            else:
+                missing += len(lost)
+        globals_held = sorted(n for n in available if self.k <= n < self.first_local)
+        if missing > len(globals_held):
+            return None
+        return locals_used, globals_held[:missing]
+
+    def select(self, sharenums):
+        plan = self.plan(sharenums)
+        if plan is None:
+            return None
+        use = {n for n in sharenums if n < self.k} | set(plan[0]) | set(plan[1])
+        position = {n: i for i, n in enumerate(sharenums)}
+        return sorted(position[n] for n in use)
+
+    def decode(self, blocks, sharenums, data_size):
+        """Rebuild one stripe from the blocks of a select()ed set of shares"""
+        have = dict(zip(sharenums, blocks))
+        for j, group in enumerate(self.groups):
+            lost = [i for i in group if i not in have]
+            if len(lost) == 1 and self.first_local + j in have:
+                have[lost[0]] = xor_blocks([have[i] for i in group if i != lost[0]] + [have[self.first_local + j]])
+        if all(i in have for i in range(self.k)):
+            return erasurezfec.trim([have[i] for i in range(self.k)], data_size)
+        coded = sorted(n for n in have if n < self.first_local)[:self.k]
+        return self.decoder.decode([have[n] for n in coded], coded, data_size)
+
+    def repair_sources(self, sharenum, available) -> Optional[List[int]]:
+        """The group shares that rebuild sharenum by XOR, None for a global parity or when
+           some of them are not available"""
+        available = set(available)
+        if sharenum < self.k:
+            j = next(j for j, group in enumerate(self.groups) if sharenum in group)
+            sources = [i for i in self.groups[j] if i != sharenum] + [self.first_local + j]
+        elif sharenum >= self.first_local:
+            sources = list(self.groups[sharenum - self.first_local])
+        else:
+            return None
+        return sources if available.issuperset(sources) else None
+
+
+class LRCEngine(erasurezfec.ErasureEngine):
+    """ErasureEngine coding local groups plus global parities"""
+    def __init__(self, k, local_groups, global_parities, stripe_size=STRIPE_SIZE, window=None):
+        encoder = LRCEncoder(k, local_groups, global_parities, stripe_size)
+        super().__init__(k, encoder.m, stripe_size, window, encoder,
+                         LRCDecoder(k, local_groups, global_parities), codec='lrc')
+        self.params['local_groups'] = local_groups
+
+    def select(self, sharenums):
+        return self.decoder.select(sharenums)
+
+    def repair_sources(self, sharenum, available):
+        return self.decoder.repair_sources(sharenum, available)
+
+    def repair(self, sharenum, blocks, sharenums):
+        """XOR of the local group when sharenums holds it, a decode otherwise"""
+        sources = self.repair_sources(sharenum, sharenums)
+        if sources is None:
+            return super().repair(sharenum, blocks, sharenums)
+        have = dict(zip(sharenums, blocks))
+        return xor_blocks([have[n] for n in sources])
+
+
+def benchmark(size, k, m, group_size=GROUP_SIZE, stripe_size=STRIPE_SIZE, rounds=3):
+    """Rebuild share 0 of a size byte file coded with zfec(k, m) and with LRC of the same k
+       and m. Returns {codec: (bytes read, seconds)}, best of rounds; shares are in memory, so
+       the time is coding only and the bytes read are what the network would carry"""
+    local_groups, global_parities = layout(k, m, group_size)
+    data = os.urandom(size)
+    engines = {'zfec': erasurezfec.ErasureEngine(k, m, stripe_size),
+               'lrc': LRCEngine(k, local_groups, global_parities, stripe_size)}
+    results = {}
+    for name, engine in engines.items():
+        meta = {'size': size, 'k': k, 'stripe_size': engine.stripe_size}
+        stripes = [data[offset:offset + engine.stripe_size] for offset in range(0, size, engine.stripe_size)]
+        encoded = list(engine.encode_stripes(stripes))
+        shares = [b"".join(blocks[i] for blocks in encoded) for i in range(m)]
+        sources = engine.repair_sources(0, range(1, m))
+
+        if sources is not None:
+            read = sources
+            def rebuild():
+                return bytes(xor_blocks([shares[i] for i in sources]))
+        else:
+            read = list(range(m - k, m)) # any k other shares, a full decode
+            blocks = [block_size for block_size, _ in erasurezfec.stripe_blocks(meta)]
+            def rebuild():
+                items, offset = [], 0
+                for block_size, (_, data_size) in zip(blocks, erasurezfec.stripe_blocks(meta)):
+                    items.append(([shares[i][offset:offset + block_size] for i in read], read, data_size))
+                    offset += block_size
+                decoded = (b"".join(views) for views, _ in engine.decode_stripes(items))
+                return b"".join(block for (block,) in engine.encode_stripes(decoded, [0]))
+
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            rebuilt = rebuild()
+            best = min(best, time.perf_counter() - start)
+        if rebuilt != shares[0]:
+            raise AssertionError(f"{name} rebuilt a wrong share")
+        results[name] = (sum(len(shares[i]) for i in read), best)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local Reconstruction Codes over zfec')
+    subparsers = parser.add_subparsers(dest='command', help='Command to execute')
+
+    bench_parser = subparsers.add_parser('bench', help='Compare the cost of rebuilding one share with zfec and LRC')
+    bench_parser.add_argument('--size', type=int, default=256, help='MB of random data to code (default: 256)')
+    bench_parser.add_argument('-k', type=int, default=12, help='Number of data chunks (default: 12)')
+    bench_parser.add_argument('-m', type=int, default=16, help='Total number of chunks to create (default: 16)')
+    bench_parser.add_argument('--group-size', type=int, default=GROUP_SIZE, help=f'Data chunks per local group (default: {GROUP_SIZE})')
+    bench_parser.add_argument('--rounds', type=int, default=3, help='Runs per codec, the best is kept (default: 3)')
+
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        if layout(args.k, args.m, args.group_size) is None:
+            parser.error("LRC needs m - k >= 2")
+        local_groups, global_parities = layout(args.k, args.m, args.group_size)
+        print(f"k={args.k} m={args.m}: LRC with {local_groups} local groups and {global_parities} global parities")
+        size = args.size * 1024 * 1024
+        share_size = erasurezfec.StripeEncoder(args.k, args.m).share_size(size)
+        for name, (read, seconds) in benchmark(size, args.k, args.m, args.group_size, rounds=args.rounds).items():
+            print(f"  {name:5} repair of one share: read {read / (1024 * 1024):9.1f} MB "
+                  f"({read / share_size:.1f}x the lost share) in {seconds:.3f} s")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
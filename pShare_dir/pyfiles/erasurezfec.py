@@ -1,5 +1,9 @@
 import os
 import sys
+import time
+import threading
+import collections
+from concurrent.futures import ThreadPoolExecutor
 import zfec
 from zfec.easyfec import Encoder, Decoder
 import argparse
@@ -10,40 +14,234 @@ import argparse
     data, such that a total of m + k chunks are produced = num_snodes.
     . Requirements: 1<=m<=256, 1<=k<=m.
     
-    Algorithm used for (m,k) = f(num_snodes) is located in encrypt.py:genChunkNum """
+    Algorithm used for (m,k) = f(num_snodes) is located in encrypt.py:genChunkNum 
+    
+    Files are encoded in independent stripes of stripe_size bytes, so memory use does not
+    depend on file size. Stripe i becomes block i of every chunk: a chunk is the
+    concatenation of its blocks, block_size = stripe_size / k bytes each, except for the
+    last (shorter) stripe, which is zero padded up to a multiple of k.
+    
+    Stripes are independent, so ErasureEngine codes several of them at once on a thread
+    pool: zfec releases the GIL while it computes, so the threads use every core without
+    pickling stripes to worker processes.
+    
+    .meta layout: original size, padding of the last stripe, k, m, then key=value lines
+    (stripe_size=..., stripes=...). Stripe i starts at i * stripe_size of the input.
+    A .meta without stripe_size describes a single stripe; one whose codec= is not zfec
+    was coded by another backend of codec.py (see codec.engine_for). """
+
+STRIPE_SIZE = 4 * 1024 * 1024 # target bytes of input per stripe
+WORKERS = os.cpu_count() or 1 # stripes coded at once
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _pool():
+    """Thread pool shared by every ErasureEngine, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="zfec")
+        return _executor
+
+
+class StripeLayout:
+    """How a stripe splits into k primary blocks; every codec (see codec.py) shares it, so
+       padding and share sizes do not depend on the codec"""
+    def __init__(self, k, m, stripe_size=STRIPE_SIZE):
+        self.k = k
+        self.m = m
+        # Round so that full stripes split into k equal blocks without padding
+        self.block_size = max(1, -(-stripe_size // k))
+        self.stripe_size = self.block_size * k
+
+    def primary(self, stripe):
+        """The k primary blocks of a stripe, zero padded to equal size"""
+        view = memoryview(stripe)
+        block_size = -(-len(view) // self.k)
+        if len(view) != block_size * self.k:
+            padded = bytearray(block_size * self.k)
+            padded[:len(view)] = view
+            view = memoryview(padded)
+        return [view[i * block_size:(i + 1) * block_size] for i in range(self.k)]
+
+    def padding(self, data_size):
+        """Zero bytes added to the last stripe of a data_size byte input"""
+        last_stripe = data_size % self.stripe_size
+        if last_stripe == 0:
+            return 0
+        return -(-last_stripe // self.k) * self.k - last_stripe
+
+    def share_size(self, data_size):
+        """Size of each of the m chunks for a data_size byte input"""
+        full_stripes, last_stripe = divmod(data_size, self.stripe_size)
+        return full_stripes * self.block_size + -(-last_stripe // self.k)
+
+
+class StripeEncoder(StripeLayout):
+    def __init__(self, k, m, stripe_size=STRIPE_SIZE):
+        super().__init__(k, m, stripe_size)
+        self.encoder = zfec.Encoder(k, m)
+
+    def encode(self, stripe, sharenums=None):
+        """Return the m blocks of one stripe (the last stripe may be short), or only the blocks
+           sharenums, in that order. The primary blocks are views of stripe, which must not
+           change while they are in use"""
+        blocks = self.primary(stripe)
+        if sharenums is None:
+            return self.encoder.encode(blocks)
+        return self.encoder.encode(blocks, tuple(sharenums))
+
+
+class StripeDecoder:
+    def __init__(self, k, m):
+        self.k = k
+        self.m = m
+        self.decoder = zfec.Decoder(k, m)
+
+    def decode(self, blocks, sharenums, data_size):
+        """Rebuild one stripe from k blocks (bytes or memoryviews) and their share numbers.
+           Returns the k primary blocks as memoryviews trimmed to data_size, so the caller
+           can write them out without joining them into one more copy"""
+        order = sorted(range(len(sharenums)), key=lambda i: sharenums[i])
+        primary = self.decoder.decode([blocks[i] for i in order], [sharenums[i] for i in order])
+        return trim(primary, data_size)
+
+
+def trim(primary, data_size):
+    """Views of the primary blocks of a stripe holding its first data_size bytes"""
+    views = []
+    remaining = data_size
+    for block in primary:
+        if remaining <= 0:
+            break
+        view = memoryview(block)[:remaining]
+        views.append(view)
+        remaining -= len(view)
+    return views
+
+
+class ErasureEngine:
+    """Codes a sequence of stripes in parallel, keeping at most window of them in flight,
+       and returns the results in input order"""
+    def __init__(self, k, m, stripe_size=STRIPE_SIZE, window=None, encoder=None, decoder=None, codec="zfec"):
+        """encoder/decoder default to zfec's; another codec passes its own (see codec.py)"""
+        self.k = k
+        self.m = m
+        self.encoder = encoder or StripeEncoder(k, m, stripe_size)
+        self.decoder = decoder or StripeDecoder(k, m)
+        self.stripe_size = self.encoder.stripe_size
+        self.window = window or 2 * WORKERS
+        self.params = {'codec': codec} # .meta fields describing the codec
+
+    def select(self, sharenums):
+        """Positions in sharenums of the shares to decode a stripe from, None if too few"""
+        return list(range(self.k)) if len(sharenums) >= self.k else None
+
+    def repair_sources(self, sharenum, available):
+        """Shares of available that rebuild sharenum without a full decode (None: decode)"""
+        return None
+
+    def repair(self, sharenum, blocks, sharenums):
+        """Block sharenum of one stripe from the blocks of a select()ed set of other shares"""
+        full = len(blocks[0]) * self.k # the padded stripe, so the padding re-encodes the same
+        return self.encoder.encode(b"".join(self.decoder.decode(blocks, sharenums, full)), [sharenum])[0]
+
+    def encode_stripes(self, stripes, sharenums=None):
+        """Yield the m blocks of every stripe of stripes (immutable bytes), or only the blocks
+           sharenums when given"""
+        return self._ordered(self.encoder.encode, ((stripe, sharenums) for stripe in stripes))
+
+    def decode_stripes(self, items):
+        """For every (blocks, sharenums, data_size) of items yield (primary views, blocks):
+           the decoded stripe and the blocks it was rebuilt from, both safe to release"""
+        def decode(blocks, sharenums, data_size):
+            return self.decoder.decode(blocks, sharenums, data_size), blocks
+        return self._ordered(decode, items)
+
+    def _ordered(self, fn, items):
+        pool = _pool()
+        pending = collections.deque()
+        try:
+            for args in items:
+                pending.append(pool.submit(fn, *args))
+                if len(pending) >= self.window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def write_meta(metadata_filename, file_size, padding_size, k, m, stripe_size, **params):
+    """params (an engine's params, e.g. codec=lrc) are written as extra key=value lines"""
+    stripes = -(-file_size // stripe_size)
+    extra = "".join(f"\n{name}={value}" for name, value in params.items())
+    with open(metadata_filename, 'w') as f:
+        f.write(f"{file_size}\n{padding_size}\n{k}\n{m}\nstripe_size={stripe_size}\nstripes={stripes}{extra}")
+
+
+def read_meta(metadata_filename):
+    """Return {'size', 'padding', 'k', 'm', 'stripe_size', ...} from a .meta file"""
+    with open(metadata_filename, 'r') as f:
+        lines = [line.strip() for line in f.readlines()]
+    meta = {
+        'size': int(lines[0]),
+        'padding': int(lines[1]),
+        'k': int(lines[2]),
+        'm': int(lines[3]),
+    }
+    for line in lines[4:]:
+        if '=' in line:
+            name, value = line.split('=', 1)
+            meta[name] = int(value) if value.isdigit() else value
+    # Files encoded before striping are one stripe covering the whole (padded) file
+    meta.setdefault('stripe_size', max(meta['size'] + meta['padding'], 1))
+    stripes = -(-meta['size'] // meta['stripe_size'])
+    if meta.setdefault('stripes', stripes) != stripes:
+        raise ValueError(f"{metadata_filename}: {meta['stripes']} stripes recorded, size implies {stripes}")
+    return meta
+
+
+def stripe_blocks(meta):
+    """Yield (block_size, data_size) for every stripe described by a .meta"""
+    k = meta['k']
+    stripe_size = meta['stripe_size']
+    remaining = meta['size']
+    while remaining > 0:
+        data_size = min(stripe_size, remaining)
+        yield -(-data_size // k), data_size
+        remaining -= data_size
+
+
 def encode_file(input_file, output_dir, k, m):
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     
-    # Read the file
-    with open(input_file, 'rb') as f:
-        data = f.read()
-    
     # Get file size
-    file_size = len(data)
+    file_size = os.path.getsize(input_file)
     
     # Create encoder
-    encoder = Encoder(k, m)
-    
-    # Pad the data when needed
-    padding_size = 0
-    if file_size % k != 0:
-        padding_size = k - (file_size % k)
-        data += b'\0' * padding_size
+    engine = ErasureEngine(k, m)
+    encoder = engine.encoder
     
-    # Encode the data
-    chunks = encoder.encode(data)
-    
-    # Write the chunks to files
-    for i, chunk in enumerate(chunks):
-        chunk_filename = os.path.join(output_dir, f"{os.path.basename(input_file)}.{i}")
-        with open(chunk_filename, 'wb') as f:
-            f.write(chunk)
+    # Encode stripes in parallel, appending block i of each stripe to chunk i in order
+    chunk_files = [open(os.path.join(output_dir, f"{os.path.basename(input_file)}.{i}"), 'wb') for i in range(m)]
+    try:
+        with open(input_file, 'rb') as f:
+            stripes = iter(lambda: f.read(encoder.stripe_size), b'')
+            for blocks in engine.encode_stripes(stripes):
+                for chunk_file, block in zip(chunk_files, blocks):
+                    chunk_file.write(block)
+    finally:
+        for chunk_file in chunk_files:
+            chunk_file.close()
     
     # Write metadata file that keeps track of original file size and any padding that was added
     metadata_filename = os.path.join(output_dir, f"{os.path.basename(input_file)}.meta")
-    with open(metadata_filename, 'w') as f:
-        f.write(f"{file_size}\n{padding_size}\n{k}\n{m}")
+    write_meta(metadata_filename, file_size, encoder.padding(file_size), k, m, encoder.stripe_size, **engine.params)
     
     return True
 
@@ -59,12 +257,9 @@ def decode_file(chunks_dir, output_file, original_filename=None):
         print(f"Error: Metadata file {metadata_file} not found.")
         return False
     
-    with open(metadata_file, 'r') as f:
-        lines = f.readlines()
-        original_size = int(lines[0].strip())
-        padding_size = int(lines[1].strip())
-        k = int(lines[2].strip())
-        m = int(lines[3].strip())
+    meta = read_meta(metadata_file)
+    k = meta['k']
+    m = meta['m']
     
     # Find available chunks
     chunk_files = []
@@ -81,31 +276,72 @@ def decode_file(chunks_dir, output_file, original_filename=None):
         print(f"Error: Not enough chunks to reconstruct the file. Found {len(chunk_files)}, need at least {k}.")
         return False
     
-    # We only need k chunks to reconstruct, so just use the first k available
-    chunk_files = chunk_files[:k]
-    chunk_nums = chunk_nums[:k]
-    
-    # Read the chunks
-    chunks = []
-    for chunk_file in chunk_files:
-        with open(chunk_file, 'rb') as f:
-            chunks.append(f.read())
+    # Reconstruct the stripes in parallel, with the codec recorded in the .meta
+    import codec # imports this module
+    engine = codec.engine_for(meta)
     
-    # Create decoder and reconstruct
-    decoder = Decoder(k, m)
-    decoded_data = decoder.decode(chunks, chunk_nums, padding_size)
+    # We only need k chunks to reconstruct, the ones the codec selects
+    picked = engine.select(chunk_nums)
+    if picked is None:
+        print("Error: The chunks found cannot reconstruct the file.")
+        return False
+    chunk_files = [chunk_files[i] for i in picked]
+    chunk_nums = [chunk_nums[i] for i in picked]
     
     download_dir = "downloaded_files"
 
     output_path = os.path.join(download_dir, output_file)
     
-    # Write to output file
-    with open(output_path, 'wb') as f:
-        f.write(decoded_data[:original_size])
+    chunks = [open(chunk_file, 'rb') for chunk_file in chunk_files]
+    try:
+        with open(output_path, 'wb') as f:
+            items = (([chunk.read(block_size) for chunk in chunks], chunk_nums, data_size)
+                     for block_size, data_size in stripe_blocks(meta))
+            for decoded, _ in engine.decode_stripes(items):
+                f.writelines(decoded)
+    finally:
+        for chunk in chunks:
+            chunk.close()
     
     print(f"File successfully reconstructed as: {output_path}")
     return True
 
+def benchmark(size, k, m, stripe_size=STRIPE_SIZE, rounds=3):
+    """Compare encoding size bytes in one Encoder.encode call (the pre-stripe path) with
+       the serial and the parallel stripe paths, and time the matching decodes.
+       Returns {path: MB/s}, best of rounds"""
+    data = os.urandom(size)
+    engine = ErasureEngine(k, m, stripe_size)
+    stripe_size = engine.stripe_size
+    stripes = [data[offset:offset + stripe_size] for offset in range(0, size, stripe_size)]
+    encoded = [engine.encoder.encode(stripe) for stripe in stripes]
+    sharenums = list(range(m - k, m)) # decode from the last k shares, the slowest case
+    meta = {'size': size, 'k': k, 'stripe_size': stripe_size}
+    sizes = [data_size for _, data_size in stripe_blocks(meta)]
+    whole = Encoder(k, m).encode(data)
+
+    def decode_items():
+        return (([blocks[i] for i in sharenums], sharenums, data_size) for blocks, data_size in zip(encoded, sizes))
+
+    paths = {
+        'encode single call': lambda: Encoder(k, m).encode(data),
+        'encode stripes serial': lambda: [engine.encoder.encode(stripe) for stripe in stripes],
+        'encode stripes parallel': lambda: list(engine.encode_stripes(stripes)),
+        'decode single call': lambda: Decoder(k, m).decode([whole[i] for i in sharenums], sharenums,
+                                                           len(whole[0]) * k - size),
+        'decode stripes serial': lambda: [engine.decoder.decode(*item) for item in decode_items()],
+        'decode stripes parallel': lambda: list(engine.decode_stripes(decode_items())),
+    }
+    rates = {}
+    for name, run in paths.items():
+        best = float('inf')
+        for _ in range(rounds):
+            start = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - start)
+        rates[name] = size / (1024 * 1024) / best
+    return rates
+
 def main():
     parser = argparse.ArgumentParser(description='Apply erasure coding to files using zfec')
     subparsers = parser.add_subparsers(dest='command', help='Command to execute')
@@ -121,6 +357,13 @@ def main():
     decode_parser.add_argument('output_file', help='Path to save reconstructed file')
     decode_parser.add_argument('--original', help='Name of the original file')
     
+    bench_parser = subparsers.add_parser('bench', help='Compare single-call and striped encoding throughput')
+    bench_parser.add_argument('--size', type=int, default=256, help='MB of random data to code (default: 256)')
+    bench_parser.add_argument('-k', type=int, default=3, help='Number of chunks needed for reconstruction (default: 3)')
+    bench_parser.add_argument('-m', type=int, default=5, help='Total number of chunks to create (default: 5)')
+    bench_parser.add_argument('--stripe-size', type=int, default=STRIPE_SIZE // (1024 * 1024), help='MB per stripe (default: 4)')
+    bench_parser.add_argument('--rounds', type=int, default=3, help='Runs per path, the best is kept (default: 3)')
+    
     args = parser.parse_args()
     
     if args.command == 'encode':
@@ -130,6 +373,11 @@ def main():
         encode_file(args.input_file, args.output_dir, args.k, args.m)
     elif args.command == 'decode':
         decode_file(args.chunks_dir, args.output_file, args.original)
+    elif args.command == 'bench':
+        print(f"{args.size} MB, k={args.k}, m={args.m}, {args.stripe_size} MB stripes, {WORKERS} workers")
+        rates = benchmark(args.size * 1024 * 1024, args.k, args.m, args.stripe_size * 1024 * 1024, args.rounds)
+        for name, rate in rates.items():
+            print(f"{name:<26}{rate:>10.1f} MB/s")
     else:
         parser.print_help()
     
@@ -0,0 +1,172 @@
+import math
+import heapq
+import queue
+import threading
+import time
+from statistics import NormalDist
+from typing import Callable, Dict, List, Optional, Tuple
+
+""" Phi-accrual failure detector for the S-node heartbeats.
+
+    Every node keeps an EWMA of the mean and variance of its heartbeat intervals. The
+    suspicion level phi of a silent node is -log10 of the probability that a heartbeat
+    this late is still to come, assuming normally distributed intervals, so a node with
+    a jittery history is given more slack than a regular one instead of one fixed cutoff.
+
+    A min-heap holds the next deadline of every node: the time its phi reaches the
+    suspect or dead threshold. A single thread sleeps until the earliest deadline, so
+    a node is suspected or declared dead the moment it is due, and entries outdated by
+    a newer heartbeat are skipped when they come up (generation numbers).
+
+    Subscribers receive (event, uuid) on a dispatcher thread of their own:
+      connect - first heartbeat of a node, or first one after it was suspected or dead
+      suspect - phi passed SUSPECT_PHI
+      dead    - phi passed DEAD_PHI; the node is forgotten until it heartbeats again """
+
+CONNECT, SUSPECT, DEAD = "connect", "suspect", "dead"
+HEARTBEAT_INTERVAL = 5.0 # seconds between S-node heartbeats, assumed until measured
+SUSPECT_PHI = 3.0 # ~1 in 1,000 chance the node is only late
+DEAD_PHI = 8.0 # ~1 in 100,000,000
+INTERVAL_ALPHA = 0.2 # weight of the newest interval in the EWMAs
+MIN_STD = 0.5 # seconds, floor of the interval standard deviation
+ACCEPTABLE_PAUSE = 1.0 # seconds of extra lateness tolerated (GC, busy LAN)
+
+
+class _Node:
+    def __init__(self, now: float, interval: float):
+        self.last = now
+        self.mean = interval
+        self.variance = (interval / 4) ** 2
+        self.state = CONNECT
+        self.generation = 0 # bumped on every heartbeat, outdates the heap entries
+
+    def arrived(self, now: float) -> None:
+        interval = now - self.last
+        self.last = now
+        delta = interval - self.mean
+        self.mean += INTERVAL_ALPHA * delta
+        self.variance = (1 - INTERVAL_ALPHA) * (self.variance + INTERVAL_ALPHA * delta * delta)
+        self.generation += 1
+
+    def distribution(self) -> NormalDist:
+        return NormalDist(self.mean + ACCEPTABLE_PAUSE, max(math.sqrt(self.variance), MIN_STD))
+
+    def phi(self, now: float) -> float:
+        late = 1 - self.distribution().cdf(now - self.last)
+        return -math.log10(max(late, 1e-300))
+
+    def deadline(self, phi: float) -> float:
+        """Time at which the node's phi reaches phi without a heartbeat"""
+        return self.last + self.distribution().inv_cdf(1 - 10 ** -phi)
+
+
+class FailureDetector:
+    def __init__(self, interval: float = HEARTBEAT_INTERVAL, suspect_phi: float = SUSPECT_PHI,
+                 dead_phi: float = DEAD_PHI):
+        self.interval = interval
+        self.suspect_phi = suspect_phi
+        self.dead_phi = dead_phi
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.nodes: Dict[str, _Node] = {}
+        self.deadlines: List[Tuple[float, str, int]] = [] # heap of (deadline, uuid, generation)
+        self.subscribers: List[Callable[[str, str], None]] = []
+        self.events: "queue.Queue[Tuple[str, str]]" = queue.Queue()
+        self.should_run = True
+        threading.Thread(target=self._watch, name="failure-detector", daemon=True).start()
+        threading.Thread(target=self._dispatch, name="failure-events", daemon=True).start()
+
+
+    def subscribe(self, callback: Callable[[str, str], None]) -> None:
+        """Call callback(event, uuid) for every connect/suspect/dead event"""
+        with self.lock:
+            self.subscribers.append(callback)
+
+
+    def heartbeat(self, uuid: str) -> None:
+        """Record a heartbeat (or any sign of life) of uuid"""
+        now = time.monotonic()
+        with self.lock:
+            node = self.nodes.get(uuid)
+            if node is None:
+                node = self.nodes[uuid] = _Node(now, self.interval)
+                self.events.put((CONNECT, uuid))
+            else:
+                node.arrived(now)
+                if node.state != CONNECT:
+                    node.state = CONNECT
+                    self.events.put((CONNECT, uuid))
+            self._schedule(uuid, node, self.suspect_phi)
+
+
+    def remove(self, uuid: str) -> None:
+        """Forget a node that disconnected on its own (its heap entries are skipped)"""
+        with self.lock:
+            self.nodes.pop(uuid, None)
+
+
+    def phi(self, uuid: str) -> Optional[float]:
+        """Current suspicion level of uuid, None if it is not tracked"""
+        with self.lock:
+            node = self.nodes.get(uuid)
+            return node.phi(time.monotonic()) if node else None
+
+
+    def states(self) -> Dict[str, Tuple[str, float]]:
+        """Return {uuid: (state, phi)} of every tracked node"""
+        now = time.monotonic()
+        with self.lock:
+            return {uuid: (node.state, node.phi(now)) for uuid, node in self.nodes.items()}
+
+
+    def stop(self) -> None:
+        with self.lock:
+            self.should_run = False
+            self.wakeup.notify_all()
+        self.events.put(None)
+
+
+    def _schedule(self, uuid: str, node: _Node, phi: float) -> None:
+        """Push the time node reaches phi (caller holds the lock), waking the watcher if it is the earliest"""
+        deadline = node.deadline(phi)
+        heapq.heappush(self.deadlines, (deadline, uuid, node.generation))
+        if self.deadlines[0][0] == deadline:
+            self.wakeup.notify()
+
+
+    def _watch(self) -> None:
+        with self.lock:
+            while self.should_run:
+                if not self.deadlines:
+                    self.wakeup.wait()
+                    continue
+                deadline, uuid, generation = self.deadlines[0]
+                now = time.monotonic()
+                if deadline > now:
+                    self.wakeup.wait(deadline - now)
+                    continue
+                heapq.heappop(self.deadlines)
+                node = self.nodes.get(uuid)
+                if node is None or node.generation != generation:
+                    continue # forgotten, or heartbeated since
+                if node.state == CONNECT:
+                    node.state = SUSPECT
+                    self.events.put((SUSPECT, uuid))
+                    self._schedule(uuid, node, self.dead_phi)
+                else:
+                    del self.nodes[uuid]
+                    self.events.put((DEAD, uuid))
+
+
+    def _dispatch(self) -> None:
+        while True:
+            event = self.events.get()
+            if event is None:
+                return
+            with self.lock:
+                subscribers = list(self.subscribers)
+            for callback in subscribers:
+                try:
+                    callback(*event)
+                except Exception as e:
+                    print(f"[ERROR] {event[0]} handler for {event[1]}: {e}")
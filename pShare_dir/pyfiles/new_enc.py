@@ -4,14 +4,28 @@ import random
 import string
 import base64
 import shutil
+import struct
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from pathlib import Path
+import registry_db
 
 # directory definitions
 REGISTRY_DIR = "registry_conf"
-MAPPING_FILE = os.path.join(REGISTRY_DIR, "file_mappings", "key_name_mappings.json")
+DB_FILE = os.path.join(REGISTRY_DIR, "registry.db")
 DOWNLOADS_DIR = os.path.join(REGISTRY_DIR, "downloads")
 
+# Segmented AES-256-GCM format: header = MAGIC, segment size (4 bytes), nonce prefix
+# (8 random bytes); then every segment of SEGMENT_SIZE plaintext bytes (the last one may be
+# shorter, or empty for an empty file) as ciphertext + 16 byte tag. Segment i uses the nonce
+# prefix + i (4 bytes) and authenticates the header and whether it is the last segment, so
+# segments cannot be reordered, dropped or truncated, and segment i starts at a fixed offset.
+STREAM_MAGIC = b"PSG1"
+SEGMENT_SIZE = 1024 * 1024 # plaintext bytes per segment
+NONCE_PREFIX_SIZE = 8
+TAG_SIZE = 16
+HEADER_SIZE = len(STREAM_MAGIC) + 4 + NONCE_PREFIX_SIZE
+
 
 def reconstruct_chunk_name_to_file_name(chunk_name:str):
     comp_list = chunk_name.split(".")
@@ -44,48 +58,161 @@ def generate_random_key():
 def decrypt_filename(file_name):
     """ Provided an encrypted file name, returns the decrypted version """
     try:
-        with open(MAPPING_FILE, 'r') as f:
-            map_filename = json.load(f)
-
-        return map_filename[file_name]
+        return registry_db.open_store(DB_FILE).get_key_mapping(file_name)
     except Exception as e:
         print(e)
 
 def encrypt_filename(file_name):
     """ Provided a plaintext file name, returns the encrypted version """
     try:
-        with open(MAPPING_FILE, 'r') as f:
-            map_filename = json.load(f)
-        
-        for k, v in map_filename.items(): # encryptname: {dic with "original_filename" and "key"}
-            if v["original_filename"] == file_name:
-                return k
-        
-        return None
-
+        return registry_db.open_store(DB_FILE).masked_name(file_name)
     except Exception as e:
         print(e)
 
 def update_key_mapping(encrypted_filename, original_filename, key):
     """Map file to original file name + key"""
-    if os.path.exists(MAPPING_FILE):
-        with open(MAPPING_FILE, 'r') as f:
-            try:
-                mappings = json.load(f)
-            except json.JSONDecodeError:
-                mappings = {}
-    else:
-        mappings = {}
-    
-    # Store mapping
-    mappings[encrypted_filename] = {
-        "original_filename": original_filename,
-        "key": key
-    }
-    
-    # Write mapping
-    with open(MAPPING_FILE, 'w') as f:
-        json.dump(mappings, f, indent=4)
+    store = registry_db.open_store(DB_FILE)
+    with store.transaction() as cur:
+        store.set_key_mapping(cur, encrypted_filename, original_filename, key)
+
+
+def aead_key(key):
+    """AES-256 key of a (Fernet formatted, url-safe base64) file key"""
+    return base64.urlsafe_b64decode(key)
+
+
+def encrypted_size(plain_size, segment_size=SEGMENT_SIZE):
+    """Return the exact size of the encrypt_stream output for a plain_size byte file"""
+    segments = max(1, -(-plain_size // segment_size))
+    return HEADER_SIZE + plain_size + segments * TAG_SIZE
+
+
+def _segment_nonce(header, index):
+    return header[len(STREAM_MAGIC) + 4:] + struct.pack(">I", index)
+
+
+def _segment_aad(header, last):
+    return header + (b"\x01" if last else b"\x00")
+
+
+def encrypt_stream(input_file, key, segment_size=SEGMENT_SIZE):
+    """Yield the encrypted form of input_file one segment at a time"""
+    cipher = AESGCM(aead_key(key))
+    header = STREAM_MAGIC + struct.pack(">I", segment_size) + os.urandom(NONCE_PREFIX_SIZE)
+    yield header
+    with open(input_file, 'rb') as f:
+        # read one segment ahead to know which one is the last
+        segment = f.read(segment_size)
+        index = 0
+        while True:
+            following = f.read(segment_size)
+            last = not following
+            yield cipher.encrypt(_segment_nonce(header, index), segment, _segment_aad(header, last))
+            if last:
+                break
+            segment, index = following, index + 1
+
+
+def decrypt_segment(key, header, index, data, last):
+    """Decrypt segment index (ciphertext + tag) of a file with the given header;
+       raises cryptography.exceptions.InvalidTag if anything was tampered with"""
+    return AESGCM(aead_key(key)).decrypt(_segment_nonce(header, index), bytes(data), _segment_aad(header, last))
+
+
+def segment_span(header, cipher_size, offset, length):
+    """For length plaintext bytes from offset of a file with this header and cipher_size
+       bytes of ciphertext, return (first segment, ciphertext offset, ciphertext length) of
+       the segments holding them"""
+    if header[:len(STREAM_MAGIC)] != STREAM_MAGIC:
+        raise ValueError("Only AES-GCM segmented files support random access")
+    (segment_size,) = struct.unpack_from(">I", header, len(STREAM_MAGIC))
+    sealed = segment_size + TAG_SIZE
+    segments = max(1, -(-(cipher_size - HEADER_SIZE) // sealed))
+    first = min(offset // segment_size, segments - 1)
+    last = max(first + 1, min(segments, -(-(offset + length) // segment_size)))
+    start = HEADER_SIZE + first * sealed
+    return first, start, min(HEADER_SIZE + last * sealed, cipher_size) - start
+
+
+def decrypt_span(key, header, cipher_size, first, data, offset, length):
+    """Decrypt the ciphertext of consecutive segments from segment first (see segment_span)
+       and return the length plaintext bytes from offset"""
+    (segment_size,) = struct.unpack_from(">I", header, len(STREAM_MAGIC))
+    sealed = segment_size + TAG_SIZE
+    segments = max(1, -(-(cipher_size - HEADER_SIZE) // sealed))
+    plaintext = []
+    for position in range(0, len(data), sealed):
+        index = first + len(plaintext)
+        plaintext.append(decrypt_segment(key, header, index, data[position:position + sealed], index == segments - 1))
+    skip = offset - first * segment_size
+    return b"".join(plaintext)[skip:skip + length]
+
+
+def decrypt_range(encrypted_path, key, offset, length):
+    """Return length plaintext bytes from offset of an encrypted file, decrypting only the
+       segments that hold them"""
+    cipher_size = os.path.getsize(encrypted_path)
+    with open(encrypted_path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        first, start, span = segment_span(header, cipher_size, offset, length)
+        f.seek(start)
+        data = f.read(span)
+    return decrypt_span(key, header, cipher_size, first, data, offset, length)
+
+
+class StreamDecryptor:
+    """Incrementally decrypt encrypt_stream output, or a legacy whole-file Fernet token:
+       feed ciphertext to update() in pieces of any size and get plaintext back"""
+    def __init__(self, key):
+        self.key = key
+        self.buffer = bytearray()
+        self.format = None # STREAM_MAGIC or "legacy", known after 4 bytes
+        self.header = None
+        self.index = 0
+
+    def update(self, data) -> bytes:
+        self.buffer += data
+        if self.format is None and len(self.buffer) >= len(STREAM_MAGIC):
+            magic = bytes(self.buffer[:len(STREAM_MAGIC)])
+            self.format = STREAM_MAGIC if magic == STREAM_MAGIC else "legacy"
+            if self.format == STREAM_MAGIC:
+                self.cipher = AESGCM(aead_key(self.key))
+        if self.format == STREAM_MAGIC:
+            return self._update_aead()
+        return b"" # legacy tokens can only be decrypted whole, see finalize()
+
+    def _update_aead(self) -> bytes:
+        if self.header is None:
+            if len(self.buffer) < HEADER_SIZE:
+                return b""
+            self.header = bytes(self.buffer[:HEADER_SIZE])
+            (self.segment_size,) = struct.unpack_from(">I", self.header, len(STREAM_MAGIC))
+            del self.buffer[:HEADER_SIZE]
+
+        plaintext = []
+        offset = 0
+        sealed = self.segment_size + TAG_SIZE
+        # a full segment is only known not to be the last once more data follows it
+        while len(self.buffer) - offset > sealed:
+            plaintext.append(self._open(self.buffer[offset:offset + sealed], last=False))
+            offset += sealed
+        del self.buffer[:offset]
+        return b"".join(plaintext)
+
+    def _open(self, data, last) -> bytes:
+        segment = self.cipher.decrypt(_segment_nonce(self.header, self.index), bytes(data),
+                                      _segment_aad(self.header, last))
+        self.index += 1
+        return segment
+
+    def finalize(self) -> bytes:
+        if self.format == STREAM_MAGIC:
+            if self.header is None or len(self.buffer) < TAG_SIZE:
+                raise ValueError("Truncated encrypted stream")
+            last = self._open(self.buffer, last=True)
+            self.buffer = bytearray()
+            return last
+        return Fernet(self.key.encode()).decrypt(bytes(self.buffer))
 
 
 def encrypt_file(input_file):
@@ -94,19 +221,13 @@ def encrypt_file(input_file):
     encrypted_path = os.path.join(REGISTRY_DIR, random_filename)
     
     key = generate_random_key()
-        
-    cipher = Fernet(key.encode())
     
     try:
-        with open(input_file, 'rb') as f:
-            file_data = f.read()
-        
-        encrypted_data = cipher.encrypt(file_data)
-        
         original_filename = os.path.basename(input_file)
         
         with open(encrypted_path, 'wb') as f:
-            f.write(encrypted_data)
+            for piece in encrypt_stream(input_file, key):
+                f.write(piece)
         
         update_key_mapping(random_filename, original_filename, key)
         
@@ -116,41 +237,48 @@ def encrypt_file(input_file):
     return random_filename
 
 
+def decrypt_stream(encrypted_file_name, pieces):
+    """Decrypt ciphertext arriving as pieces (bytes or memoryviews, e.g. straight from the
+       erasure decoder) and write the plaintext once, to DOWNLOADS_DIR/original name.
+       Returns the output path; raises if there is no key mapping or the data is corrupt"""
+    file_info = decrypt_filename(encrypted_file_name)
+    if file_info is None:
+        raise KeyError(f"No mapping found for {encrypted_file_name}. Cannot decrypt.")
+
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    output_path = os.path.join(DOWNLOADS_DIR, file_info["original_filename"])
+    partial_path = output_path + ".part" # never leave a half-written file under the real name
+    decryptor = StreamDecryptor(file_info["key"])
+    try:
+        with open(partial_path, 'wb') as f:
+            for piece in pieces:
+                f.write(decryptor.update(piece))
+            f.write(decryptor.finalize())
+        os.replace(partial_path, output_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return output_path
+
+
 def decrypt_file(encrypted_file_name):
 
     try:
-        if not os.path.exists(MAPPING_FILE):
-            print(f"Mapping file {MAPPING_FILE} not found. Cannot decrypt.")
-            return
-        
-        with open(MAPPING_FILE, 'r') as f:
-            mappings = json.load(f)
-        
-        if encrypted_file_name not in mappings:
-            print(f"No mapping found for {encrypted_file_name}. Cannot decrypt.")
-            return
-        
         encrypted_file_path = os.path.join("downloaded_files", encrypted_file_name)
         
         if not os.path.exists(encrypted_file_path):
             print(f"Encrypted file {encrypted_file_path} not found.")
             return
         
-        file_info = mappings[encrypted_file_name]
-        original_filename = file_info["original_filename"]
-        key = file_info["key"]
+        def read_segments():
+            with open(encrypted_file_path, 'rb') as src:
+                while True:
+                    data = src.read(SEGMENT_SIZE)
+                    if not data:
+                        break
+                    yield data
         
-        cipher = Fernet(key.encode())
-        
-        with open(encrypted_file_path, 'rb') as f:
-            encrypted_data = f.read()
-        
-        decrypted_data = cipher.decrypt(encrypted_data)
-        
-        output_path = os.path.join(DOWNLOADS_DIR, original_filename)
-        
-        with open(output_path, 'wb') as f:
-            f.write(decrypted_data)
+        output_path = decrypt_stream(encrypted_file_name, read_segments())
         
         print(f"File decrypted successfully.")
         print(f"Saved to: {output_path}")
@@ -162,12 +290,8 @@ def list_encrypted_files():
     """List all encrypted file data from the mapping file and return as dictionary."""
     result = {}
     
-    if not os.path.exists(MAPPING_FILE):
-        return result
-    
     try:
-        with open(MAPPING_FILE, 'r') as f:
-            mappings = json.load(f)
+        mappings = registry_db.open_store(DB_FILE).key_mappings()
         
         if not mappings:
             return result
@@ -0,0 +1,122 @@
+import queue
+import threading
+from typing import Iterator, List, Optional
+
+import new_enc as enclib
+import erasurezfec as zfec
+
+""" Streaming upload pipeline: plaintext -> encrypted segments -> zfec stripes -> shares.
+
+    The file is read one segment at a time, the ciphertext is cut into stripes and
+    each stripe is erasure coded as soon as it is complete, several stripes at once on
+    the zfec engine's threads. Block i of every stripe is handed to ShareStream i,
+    which a consumer thread (one per S-node upload) drains into the open UploadFile
+    stream (the repair engine feeds decoded ciphertext through the same path). Each
+    ShareStream holds at most QUEUE_DEPTH blocks and the engine codes at most its window
+    of stripes, so memory stays bounded no matter how big the file is. """
+
+QUEUE_DEPTH = 4 # blocks buffered per share before the encoder waits on the slowest upload
+MESSAGE_SIZE = 1024 * 1024 # largest FileChunk content sent to an S-node
+
+
+class ShareStream:
+    """Bounded, single producer / single consumer queue of the blocks of one share"""
+    _DONE = object()
+    _ABORT = object()
+
+    def __init__(self, depth=QUEUE_DEPTH):
+        self.queue = queue.Queue(maxsize=depth)
+        self.failed = threading.Event() # set by the consumer when its upload dies
+        self.started = False # a block was handed to the consumer, the share cannot be resent
+
+    def write(self, block) -> None:
+        """Hand one block to the consumer, waiting while the queue is full"""
+        while not self.failed.is_set():
+            try:
+                self.queue.put(block, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        """Signal the end of the share"""
+        self.write(self._DONE)
+
+    def abort(self) -> None:
+        """Signal that the share is incomplete, the consumer must not commit it"""
+        self.write(self._ABORT)
+
+    def fail(self) -> None:
+        """Called by the consumer: stop accepting blocks and drop what is queued"""
+        self.failed.set()
+        try:
+            while True:
+                self.queue.get_nowait()
+        except queue.Empty:
+            pass
+
+    def messages(self, message_size=MESSAGE_SIZE):
+        """Yield the share as pieces of at most message_size bytes"""
+        while True:
+            block = self.queue.get()
+            self.started = True
+            if block is self._DONE:
+                return
+            if block is self._ABORT:
+                raise RuntimeError("Share aborted by the encoder")
+            view = memoryview(block)
+            for offset in range(0, len(view), message_size):
+                yield view[offset:offset + message_size].tobytes()
+
+
+def stripes_of(pieces, stripe_size: int) -> Iterator[bytes]:
+    """Regroup byte pieces (copied as they arrive) into stripes of stripe_size bytes, the last
+       one possibly shorter"""
+    pending = bytearray()
+    for piece in pieces:
+        pending += piece
+        while len(pending) >= stripe_size:
+            # Immutable copy: the encoder threads and the share queues keep views of it
+            with memoryview(pending) as view:
+                stripe = bytes(view[:stripe_size])
+            del pending[:stripe_size]
+            yield stripe
+    if pending:
+        yield bytes(pending)
+
+
+def write_shares(stripes, engine: zfec.ErasureEngine, shares: List[ShareStream],
+                 sharenums: Optional[List[int]] = None) -> None:
+    """Erasure code stripes on engine and write block i of every stripe to shares[i], or only the
+       blocks sharenums (in that order) when given. Closes the shares, or aborts them on failure"""
+    completed = False
+    try:
+        for blocks in engine.encode_stripes(stripes, sharenums):
+            for share, block in zip(shares, blocks):
+                share.write(block)
+        completed = True
+    finally:
+        for share in shares:
+            if completed:
+                share.close()
+            else:
+                share.abort() # fail the uploads rather than store a truncated share
+
+
+def encode_to_shares(input_file: str, key: str, encoder: zfec.StripeEncoder, shares: List[ShareStream],
+                     engine: Optional[zfec.ErasureEngine] = None) -> int:
+    """Encrypt input_file, erasure code the ciphertext stripe by stripe and write block i
+       of every stripe to shares[i]. Closes the shares and returns the ciphertext size.
+       Stripes are coded in parallel on engine (one matching encoder is made if None)"""
+    if engine is None:
+        engine = zfec.ErasureEngine(encoder.k, encoder.m, encoder.stripe_size)
+    cipher_size = 0
+
+    def ciphertext():
+        nonlocal cipher_size
+        for piece in enclib.encrypt_stream(input_file, key):
+            cipher_size += len(piece)
+            yield piece
+
+    write_shares(stripes_of(ciphertext(), engine.stripe_size), engine, shares)
+    return cipher_size
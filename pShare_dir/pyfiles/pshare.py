@@ -6,7 +6,6 @@ import uuid_utils
 import encrypt
 import rnode as r_node
 import snode as s_node
-import erasurezfec as zfec
 import json
 import math
 import shutil
@@ -14,6 +13,7 @@ import new_enc as enclib
 import threading
 import new_enc
 import pathlib
+import sqlite3
 
 """ pShare API """
 class pShare():
@@ -33,21 +33,20 @@ class pShare():
             to be displayed on index.html 
         """
         try:
-            with open(self.rnode.file_total_sizes, 'r') as f:
-                file_total_sizes = json.load(f) # {filename: size}
-                file_sizes_kb = {}
-                files_to_encfiles = {}
-                for item in file_total_sizes.items():
-                    # decrypt_filename produces: {'original_filename': 'name', 'key': 'key'}
-                    decrypted_filename = enclib.decrypt_filename(item[0])['original_filename']
-                    file_sizes_kb[decrypted_filename] = math.ceil(item[1] / 1000)
-                    files_to_encfiles[decrypted_filename] = item[0]
+            file_total_sizes = self.rnode.index.file_total_sizes() # {filename: size}
+            file_sizes_kb = {}
+            files_to_encfiles = {}
+            for item in file_total_sizes.items():
+                # decrypt_filename produces: {'original_filename': 'name', 'key': 'key'}
+                decrypted_filename = enclib.decrypt_filename(item[0])['original_filename']
+                file_sizes_kb[decrypted_filename] = math.ceil(item[1] / 1000)
+                files_to_encfiles[decrypted_filename] = item[0]
 
             file_availability = self.rnode.index_availability() # {filename: availability}
             
             # create a non-blocking thread in rnode.py to clear all zombies from connected S-nodes
             
-        except (json.JSONDecodeError, FileNotFoundError):
+        except (TypeError, sqlite3.Error):
             print("[ERROR] reading mapping files or no files stored yet")
             return None, None, None
              
@@ -63,9 +62,7 @@ class pShare():
             store a different chunk for any given file 
         """
         try:
-            with open(self.rnode.file_to_uuids, 'r') as f:
-                file_to_uuids = json.load(f) # {filename: [uuids]}
-            if filename in file_to_uuids:
+            if self.rnode.store.masked_name(filename) is not None:
                 return "Cannot upload the same file twice (first delete the original)"
 
             ready_clients = self.rnode.fill_storage_request(required_storage) # ready to complete the request
@@ -94,14 +91,8 @@ class pShare():
             #print(filename)
             encrypted_filename = enclib.encrypt_filename(filename)
             print(encrypted_filename)
+            # Shares are decoded and decrypted as they arrive, only the plaintext hits the disk
             result = self.rnode.download(encrypted_filename)
-            zfec.decode_file("downloaded_files", encrypted_filename, encrypted_filename)
-            enclib.decrypt_file(encrypted_filename)
-            download_dir = "downloaded_files"
-            for chunk_file in os.listdir(download_dir):
-                chunk_path = os.path.join(download_dir, chunk_file)
-                if os.path.isfile(chunk_path):
-                    os.remove(chunk_path)
             if result != "Success":
                 return f"Failed to download {filename} due to error: {result}" 
         
@@ -0,0 +1,321 @@
+import os
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+""" Embedded metadata store for the R-node.
+
+    Replaces the seven JSON mapping files in registry_conf/file_mappings with a
+    single SQLite database (WAL mode). Every mutation runs inside one transaction,
+    so an upload, delete or S-node removal either lands in every table or in none.
+
+    files(name)                      - stored (masked) file names
+    chunks(name, file, size)         - erasure chunk -> owning file and size in bytes
+    placements(uuid, chunk)          - which S-node (or aws/google) holds which chunk
+    zombies(uuid, chunk)             - chunks deleted while their S-node was offline
+    key_mappings(masked, original, key)
+
+    file_to_uuids, file_total_sizes and snodes_storage_used are derived from
+    chunks/placements through indexed queries instead of being stored separately. """
+
+DB_FILE = os.path.join("registry_conf", "registry.db")
+MAPPINGS_DIR = os.path.join("registry_conf", "file_mappings")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    name TEXT PRIMARY KEY,
+    file TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS chunks_by_file ON chunks(file);
+CREATE TABLE IF NOT EXISTS placements (
+    uuid TEXT NOT NULL,
+    chunk TEXT NOT NULL,
+    PRIMARY KEY (uuid, chunk)
+);
+CREATE INDEX IF NOT EXISTS placements_by_chunk ON placements(chunk);
+CREATE TABLE IF NOT EXISTS zombies (
+    uuid TEXT NOT NULL,
+    chunk TEXT NOT NULL,
+    PRIMARY KEY (uuid, chunk)
+);
+CREATE TABLE IF NOT EXISTS key_mappings (
+    masked_name TEXT PRIMARY KEY,
+    original_filename TEXT NOT NULL,
+    key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS key_mappings_by_original ON key_mappings(original_filename);
+CREATE TABLE IF NOT EXISTS store_info (
+    name TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# The JSON files the store replaces, in the order they are imported
+JSON_MAPPINGS = ["uuid_to_chunks", "file_to_uuids", "chunk_to_size", "snodes_storage_used",
+                 "file_total_sizes", "zombies", "key_name_mappings"]
+
+
+def chunk_file(chunk_name: str) -> str:
+    """Return the file a chunk belongs to (chunks are named file_name.{i})"""
+    return chunk_name.rsplit(".", 1)[0]
+
+
+class RegistryStore:
+    def __init__(self, db_path: str = DB_FILE):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # One connection shared between the gRPC, Flask and zombie threads, serialised by the lock
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+
+    @contextmanager
+    def transaction(self):
+        """Run a block of statements atomically, yields a cursor"""
+        with self.lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            else:
+                cur.execute("COMMIT")
+            finally:
+                cur.close()
+
+
+    def query(self, sql: str, params=()) -> list:
+        """Return all rows of a read-only query"""
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+    # ==== WRITES (take a cursor so callers can group them in one transaction) ====
+    def add_chunk(self, cur, chunk_name: str, chunk_size: int, target_uuid: str) -> None:
+        """Record that chunk_name (chunk_size bytes) is stored on target_uuid"""
+        file_name = chunk_file(chunk_name)
+        cur.execute("INSERT OR IGNORE INTO files(name) VALUES (?)", (file_name,))
+        cur.execute("INSERT INTO chunks(name, file, size) VALUES (?, ?, ?) "
+                    "ON CONFLICT(name) DO UPDATE SET size = excluded.size",
+                    (chunk_name, file_name, chunk_size))
+        cur.execute("INSERT OR IGNORE INTO placements(uuid, chunk) VALUES (?, ?)", (target_uuid, chunk_name))
+
+
+    def remove_placement(self, cur, target_uuid: str, chunk_name: str) -> None:
+        cur.execute("DELETE FROM placements WHERE uuid = ? AND chunk = ?", (target_uuid, chunk_name))
+
+
+    def retire_placement(self, cur, target_uuid: str, chunk_name: str) -> None:
+        """Drop a placement, remembering the copy as a zombie to delete when the S-node reconnects"""
+        cur.execute("DELETE FROM placements WHERE uuid = ? AND chunk = ?", (target_uuid, chunk_name))
+        cur.execute("INSERT OR IGNORE INTO zombies(uuid, chunk) VALUES (?, ?)", (target_uuid, chunk_name))
+
+
+    def delete_file(self, cur, file_name: str, zombies: List[Tuple[str, str]]) -> None:
+        """Drop every reference to file_name, remembering (uuid, chunk) pairs that still exist remotely"""
+        cur.executemany("INSERT OR IGNORE INTO zombies(uuid, chunk) VALUES (?, ?)", zombies)
+        cur.execute("DELETE FROM placements WHERE chunk IN (SELECT name FROM chunks WHERE file = ?)", (file_name,))
+        cur.execute("DELETE FROM chunks WHERE file = ?", (file_name,))
+        cur.execute("DELETE FROM files WHERE name = ?", (file_name,))
+
+
+    def remove_snode(self, cur, target_uuid: str) -> None:
+        """Forget every chunk placement of an S-node"""
+        cur.execute("DELETE FROM placements WHERE uuid = ?", (target_uuid,))
+
+
+    def clear_zombie(self, cur, target_uuid: str, chunk_name: str) -> None:
+        cur.execute("DELETE FROM zombies WHERE uuid = ? AND chunk = ?", (target_uuid, chunk_name))
+
+
+    def clear_zombies(self, cur, target_uuid: str, chunk_names: List[str]) -> None:
+        cur.executemany("DELETE FROM zombies WHERE uuid = ? AND chunk = ?",
+                        [(target_uuid, chunk_name) for chunk_name in chunk_names])
+
+
+    def set_key_mapping(self, cur, masked_name: str, original_filename: str, key: str) -> None:
+        cur.execute("INSERT OR REPLACE INTO key_mappings(masked_name, original_filename, key) VALUES (?, ?, ?)",
+                    (masked_name, original_filename, key))
+
+
+    def delete_key_mapping(self, cur, masked_name: str) -> None:
+        cur.execute("DELETE FROM key_mappings WHERE masked_name = ?", (masked_name,))
+
+
+    # ==== READS ====
+    def get_files(self) -> List[str]:
+        return [row[0] for row in self.query("SELECT name FROM files ORDER BY rowid")]
+
+
+    def file_to_uuids(self, file_name: str) -> List[str]:
+        """Return the S-nodes storing a chunk of file_name"""
+        rows = self.query("SELECT DISTINCT p.uuid FROM chunks c JOIN placements p ON p.chunk = c.name "
+                          "WHERE c.file = ?", (file_name,))
+        return [row[0] for row in rows]
+
+
+    def file_chunks(self, file_name: str) -> List[Tuple[str, str]]:
+        """Return [(uuid, chunk)] for every stored chunk of file_name"""
+        return self.query("SELECT p.uuid, c.name FROM chunks c JOIN placements p ON p.chunk = c.name "
+                          "WHERE c.file = ?", (file_name,))
+
+
+    def file_total_size(self, file_name: str) -> int:
+        rows = self.query("SELECT COALESCE(SUM(size), 0) FROM chunks WHERE file = ?", (file_name,))
+        return rows[0][0]
+
+
+    def file_total_sizes(self) -> Dict[str, int]:
+        """Return {file_name: bytes stored across all of its chunks}"""
+        rows = self.query("SELECT f.name, COALESCE(SUM(c.size), 0) FROM files f "
+                          "LEFT JOIN chunks c ON c.file = f.name GROUP BY f.name ORDER BY f.rowid")
+        return {name: size for name, size in rows}
+
+
+    def uuid_chunks(self, target_uuid: str) -> List[str]:
+        return [row[0] for row in self.query("SELECT chunk FROM placements WHERE uuid = ?", (target_uuid,))]
+
+
+    def all_chunks(self) -> List[Tuple[str, str, int]]:
+        """Return [(chunk, file, size)] for every chunk"""
+        return self.query("SELECT name, file, size FROM chunks")
+
+
+    def all_placements(self) -> List[Tuple[str, str]]:
+        """Return [(uuid, chunk)] for every placement"""
+        return self.query("SELECT uuid, chunk FROM placements")
+
+
+    def all_zombies(self) -> List[Tuple[str, str]]:
+        return self.query("SELECT uuid, chunk FROM zombies")
+
+
+    def chunk_to_snode(self, chunk_name: str) -> Optional[str]:
+        rows = self.query("SELECT uuid FROM placements WHERE chunk = ? LIMIT 1", (chunk_name,))
+        return rows[0][0] if rows else None
+
+
+    def snode_to_chunk(self, target_uuid: str, file_name: str) -> Optional[str]:
+        rows = self.query("SELECT c.name FROM placements p JOIN chunks c ON c.name = p.chunk "
+                          "WHERE p.uuid = ? AND c.file = ? LIMIT 1", (target_uuid, file_name))
+        return rows[0][0] if rows else None
+
+
+    def used_storage(self, target_uuid: str) -> int:
+        rows = self.query("SELECT COALESCE(SUM(c.size), 0) FROM placements p JOIN chunks c ON c.name = p.chunk "
+                          "WHERE p.uuid = ?", (target_uuid,))
+        return rows[0][0]
+
+
+    def all_used_storage(self) -> Dict[str, int]:
+        rows = self.query("SELECT p.uuid, SUM(c.size) FROM placements p JOIN chunks c ON c.name = p.chunk "
+                          "GROUP BY p.uuid")
+        return {uuid: used for uuid, used in rows}
+
+
+    def zombies(self, target_uuid: str) -> List[str]:
+        return [row[0] for row in self.query("SELECT chunk FROM zombies WHERE uuid = ?", (target_uuid,))]
+
+
+    def get_key_mapping(self, masked_name: str) -> Optional[Dict[str, str]]:
+        """Return {'original_filename', 'key'} for a masked file name, or None"""
+        rows = self.query("SELECT original_filename, key FROM key_mappings WHERE masked_name = ?", (masked_name,))
+        if not rows:
+            return None
+        return {"original_filename": rows[0][0], "key": rows[0][1]}
+
+
+    def masked_name(self, original_filename: str) -> Optional[str]:
+        rows = self.query("SELECT masked_name FROM key_mappings WHERE original_filename = ? LIMIT 1",
+                          (original_filename,))
+        return rows[0][0] if rows else None
+
+
+    def key_mappings(self) -> Dict[str, Dict[str, str]]:
+        rows = self.query("SELECT masked_name, original_filename, key FROM key_mappings")
+        return {masked: {"original_filename": original, "key": key} for masked, original, key in rows}
+
+
+    # ==== MIGRATION ====
+    def migrate_json(self, mappings_dir: str = MAPPINGS_DIR) -> bool:
+        """One-shot import of the legacy JSON mapping files. Each imported file is renamed
+           to *.json.migrated so the import never runs twice. Returns True if anything was imported"""
+        if self.query("SELECT value FROM store_info WHERE name = 'json_migrated'"):
+            return False
+
+        legacy = {}
+        for name in JSON_MAPPINGS:
+            path = os.path.join(mappings_dir, f"{name}.json")
+            if os.path.exists(path):
+                try:
+                    with open(path, 'r') as f:
+                        legacy[name] = json.load(f)
+                except json.JSONDecodeError:
+                    legacy[name] = {}
+
+        with self.transaction() as cur:
+            uuid_to_chunks = legacy.get("uuid_to_chunks", {})
+            chunk_to_size = legacy.get("chunk_to_size", {})
+            for target_uuid, chunk_names in uuid_to_chunks.items():
+                for chunk_name in chunk_names:
+                    self.add_chunk(cur, chunk_name, chunk_to_size.get(chunk_name, 0), target_uuid)
+
+            # Files listed without any chunk placement (i.e. only in file_to_uuids) are kept visible
+            for file_name in list(legacy.get("file_to_uuids", {})) + list(legacy.get("file_total_sizes", {})):
+                cur.execute("INSERT OR IGNORE INTO files(name) VALUES (?)", (file_name,))
+
+            # zombies.json is {uuid: [file names]}; the store tracks the chunk names directly
+            for target_uuid, file_names in legacy.get("zombies", {}).items():
+                for chunk_name in uuid_to_chunks.get(target_uuid, []):
+                    if chunk_file(chunk_name) in file_names:
+                        cur.execute("INSERT OR IGNORE INTO zombies(uuid, chunk) VALUES (?, ?)",
+                                    (target_uuid, chunk_name))
+                        cur.execute("DELETE FROM placements WHERE uuid = ? AND chunk = ?", (target_uuid, chunk_name))
+
+            for masked_name, info in legacy.get("key_name_mappings", {}).items():
+                self.set_key_mapping(cur, masked_name, info["original_filename"], info["key"])
+
+            # Chunks left only as zombie references have no live file behind them
+            cur.execute("DELETE FROM chunks WHERE name NOT IN (SELECT chunk FROM placements) "
+                        "AND file NOT IN (SELECT masked_name FROM key_mappings)")
+            cur.execute("DELETE FROM files WHERE name NOT IN (SELECT file FROM chunks) "
+                        "AND name NOT IN (SELECT masked_name FROM key_mappings)")
+            cur.execute("INSERT INTO store_info(name, value) VALUES ('json_migrated', ?)",
+                        (",".join(sorted(legacy)),))
+
+        for name in legacy:
+            path = os.path.join(mappings_dir, f"{name}.json")
+            os.replace(path, path + ".migrated")
+
+        return bool(legacy)
+
+
+_stores: Dict[str, RegistryStore] = {}
+_stores_lock = threading.Lock()
+
+def open_store(db_path: str = DB_FILE) -> RegistryStore:
+    """Return the shared store for db_path, creating (and migrating into) it on first use"""
+    key = os.path.abspath(db_path)
+    with _stores_lock:
+        if key not in _stores:
+            store = RegistryStore(key)
+            store.migrate_json(os.path.join(os.path.dirname(key), "file_mappings"))
+            _stores[key] = store
+        return _stores[key]
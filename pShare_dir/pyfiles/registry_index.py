@@ -0,0 +1,360 @@
+import os
+import json
+import shutil
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+import registry_db
+import erasurezfec
+
+""" In-memory view of the R-node metadata.
+
+    Every read (chunk -> S-nodes, S-node -> chunks, file -> stripe parameters,
+    S-node -> bytes used, ...) is served from the maps below. Writes update the
+    maps immediately, are appended to a journal file, and a background thread
+    checkpoints batches of them into the SQLite store (write-behind).
+
+    On startup the index is loaded from the store and any journal left behind by
+    a crash is replayed. Journal operations are idempotent, so replaying a batch
+    that was already checkpointed is harmless. A checkpoint that fails puts its
+    batch back in front of the pending operations and keeps its file on disk; later
+    rotations append to that file until a checkpoint succeeds. """
+
+JOURNAL_FILE = os.path.join("registry_conf", "registry.journal")
+FLUSH_INTERVAL = 1.0 # seconds between checkpoints
+FLUSH_BATCH = 512 # checkpoint early once this many operations are pending
+
+
+class RegistryIndex:
+    def __init__(self, store: registry_db.RegistryStore, meta_dir: str,
+                 journal_path: str = JOURNAL_FILE, flush_interval: float = FLUSH_INTERVAL):
+        self.store = store
+        self.meta_dir = meta_dir
+        self.journal_path = journal_path
+        self.checkpoint_path = journal_path + ".1" # journal batch being written to the store
+        self.flush_interval = flush_interval
+        self.lock = threading.RLock()
+        self.flushed = threading.Condition(self.lock)
+        self.flush_lock = threading.Lock() # one checkpoint at a time
+
+        self.files: Dict[str, None] = {} # ordered set of file names
+        self.file_chunks: Dict[str, Set[str]] = {} # {file: {chunks}}
+        self.chunk_sizes: Dict[str, int] = {} # {chunk: bytes}
+        self.chunk_uuids: Dict[str, Set[str]] = {} # {chunk: {uuids}}
+        self.uuid_chunk_map: Dict[str, Set[str]] = {} # {uuid: {chunks}}
+        self.used: Dict[str, int] = {} # {uuid: bytes stored}
+        self.zombie_map: Dict[str, Set[str]] = {} # {uuid: {chunks}}
+        self.params: Dict[str, dict] = {} # {file: .meta contents}
+
+        self.pending: List[list] = []
+        self.should_run = True
+        self._load()
+
+        self.journal = open(self.journal_path, 'a')
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+
+    # ==== STARTUP ====
+    def _load(self):
+        """Build the maps from the store, then replay (and checkpoint) any leftover journal"""
+        for chunk_name, file_name, size in self.store.all_chunks():
+            self.files.setdefault(file_name, None)
+            self.file_chunks.setdefault(file_name, set()).add(chunk_name)
+            self.chunk_sizes[chunk_name] = size
+        for file_name in self.store.get_files():
+            self.files.setdefault(file_name, None)
+        for uuid, chunk_name in self.store.all_placements():
+            self._place(uuid, chunk_name)
+        for uuid, chunk_name in self.store.all_zombies():
+            self.zombie_map.setdefault(uuid, set()).add(chunk_name)
+
+        replay = []
+        for path in (self.checkpoint_path, self.journal_path):
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    for line in f:
+                        try:
+                            replay.append(json.loads(line))
+                        except json.JSONDecodeError:
+                            break # torn last line from a crash mid-append
+        for op in replay:
+            self._apply(op)
+        if replay:
+            self._checkpoint(replay)
+        for path in (self.checkpoint_path, self.journal_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+    # ==== WRITES ====
+    def add_chunk(self, chunk_name: str, chunk_size: int, target_uuid: str) -> None:
+        self._write(["add_chunk", chunk_name, chunk_size, target_uuid])
+
+
+    def remove_placement(self, target_uuid: str, chunk_name: str) -> None:
+        self._write(["remove_placement", target_uuid, chunk_name])
+
+
+    def retire_placement(self, target_uuid: str, chunk_name: str) -> None:
+        """Forget a copy that was replaced elsewhere, keeping it as a zombie of its (absent) S-node"""
+        self._write(["retire_placement", target_uuid, chunk_name])
+
+
+    def delete_file(self, file_name: str, zombies: List[Tuple[str, str]]) -> None:
+        self._write(["delete_file", file_name, [list(zombie) for zombie in zombies]])
+
+
+    def remove_snode(self, target_uuid: str) -> None:
+        self._write(["remove_snode", target_uuid])
+
+
+    def clear_zombie(self, target_uuid: str, chunk_name: str) -> None:
+        self._write(["clear_zombie", target_uuid, chunk_name])
+
+
+    def clear_zombies(self, target_uuid: str, chunk_names: List[str]) -> None:
+        """Forget a batch of zombies of one S-node with a single journal write"""
+        self._write(["clear_zombies", target_uuid, list(chunk_names)])
+
+
+    def set_params(self, file_name: str, params: dict) -> None:
+        """Cache the .meta contents of a newly stored file"""
+        with self.lock:
+            self.params[file_name] = params
+
+
+    def _write(self, op: list) -> None:
+        with self.lock:
+            self._apply(op)
+            self.journal.write(json.dumps(op) + "\n")
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            self.pending.append(op)
+            if len(self.pending) >= FLUSH_BATCH:
+                self.flushed.notify_all()
+
+
+    def _apply(self, op: list) -> None:
+        """Apply one journal operation to the in-memory maps"""
+        kind = op[0]
+        if kind == "add_chunk":
+            _, chunk_name, chunk_size, target_uuid = op
+            file_name = registry_db.chunk_file(chunk_name)
+            old_size = self.chunk_sizes.get(chunk_name, 0)
+            for uuid in self.chunk_uuids.get(chunk_name, ()):
+                self.used[uuid] = self.used.get(uuid, 0) + chunk_size - old_size
+            self.files.setdefault(file_name, None)
+            self.file_chunks.setdefault(file_name, set()).add(chunk_name)
+            self.chunk_sizes[chunk_name] = chunk_size
+            self._place(target_uuid, chunk_name)
+        elif kind == "remove_placement":
+            _, target_uuid, chunk_name = op
+            self._unplace(target_uuid, chunk_name)
+        elif kind == "retire_placement":
+            _, target_uuid, chunk_name = op
+            self._unplace(target_uuid, chunk_name)
+            self.zombie_map.setdefault(target_uuid, set()).add(chunk_name)
+        elif kind == "delete_file":
+            _, file_name, zombies = op
+            for uuid, chunk_name in zombies:
+                self.zombie_map.setdefault(uuid, set()).add(chunk_name)
+            for chunk_name in self.file_chunks.pop(file_name, set()):
+                for uuid in list(self.chunk_uuids.get(chunk_name, ())):
+                    self._unplace(uuid, chunk_name)
+                self.chunk_sizes.pop(chunk_name, None)
+                self.chunk_uuids.pop(chunk_name, None)
+            self.files.pop(file_name, None)
+            self.params.pop(file_name, None)
+        elif kind == "remove_snode":
+            _, target_uuid = op
+            for chunk_name in list(self.uuid_chunk_map.get(target_uuid, ())):
+                self._unplace(target_uuid, chunk_name)
+            self.uuid_chunk_map.pop(target_uuid, None)
+            self.used.pop(target_uuid, None)
+        elif kind == "clear_zombie":
+            _, target_uuid, chunk_name = op
+            self.zombie_map.get(target_uuid, set()).discard(chunk_name)
+            if not self.zombie_map.get(target_uuid, True):
+                del self.zombie_map[target_uuid]
+        elif kind == "clear_zombies":
+            _, target_uuid, chunk_names = op
+            self.zombie_map.get(target_uuid, set()).difference_update(chunk_names)
+            if not self.zombie_map.get(target_uuid, True):
+                del self.zombie_map[target_uuid]
+
+
+    def _place(self, target_uuid: str, chunk_name: str) -> None:
+        holders = self.chunk_uuids.setdefault(chunk_name, set())
+        if target_uuid not in holders:
+            holders.add(target_uuid)
+            self.uuid_chunk_map.setdefault(target_uuid, set()).add(chunk_name)
+            self.used[target_uuid] = self.used.get(target_uuid, 0) + self.chunk_sizes.get(chunk_name, 0)
+
+
+    def _unplace(self, target_uuid: str, chunk_name: str) -> None:
+        holders = self.chunk_uuids.get(chunk_name, set())
+        if target_uuid in holders:
+            holders.discard(target_uuid)
+            self.uuid_chunk_map.get(target_uuid, set()).discard(chunk_name)
+            self.used[target_uuid] = self.used.get(target_uuid, 0) - self.chunk_sizes.get(chunk_name, 0)
+
+
+    # ==== WRITE-BEHIND ====
+    def _flush_loop(self):
+        while self.should_run:
+            with self.lock:
+                self.flushed.wait_for(lambda: len(self.pending) >= FLUSH_BATCH or not self.should_run,
+                                      timeout=self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"[ERROR] checkpointing registry journal: {e}")
+                with self.lock: # back off, a full batch would otherwise retry at once
+                    self.flushed.wait_for(lambda: not self.should_run, timeout=self.flush_interval)
+
+
+    def flush(self) -> None:
+        """Checkpoint every pending journal operation into the store"""
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return
+                batch, self.pending = self.pending, []
+                # Rotate the journal so new writes do not wait on the SQLite commit
+                self.journal.close()
+                if os.path.exists(self.checkpoint_path):
+                    # An earlier checkpoint failed: its file is the only copy of its batch, extend it
+                    with open(self.journal_path, 'r') as src, open(self.checkpoint_path, 'a') as dst:
+                        shutil.copyfileobj(src, dst)
+                        dst.flush()
+                        os.fsync(dst.fileno())
+                    os.remove(self.journal_path)
+                else:
+                    os.replace(self.journal_path, self.checkpoint_path)
+                self.journal = open(self.journal_path, 'a')
+            try:
+                self._checkpoint(batch)
+            except Exception:
+                with self.lock:
+                    self.pending[:0] = batch # retried by the next flush
+                raise
+            os.remove(self.checkpoint_path)
+
+
+    def _checkpoint(self, batch: List[list]) -> None:
+        store = self.store
+        with store.transaction() as cur:
+            for op in batch:
+                kind = op[0]
+                if kind == "add_chunk":
+                    store.add_chunk(cur, op[1], op[2], op[3])
+                elif kind == "remove_placement":
+                    store.remove_placement(cur, op[1], op[2])
+                elif kind == "retire_placement":
+                    store.retire_placement(cur, op[1], op[2])
+                elif kind == "delete_file":
+                    store.delete_file(cur, op[1], [tuple(zombie) for zombie in op[2]])
+                elif kind == "remove_snode":
+                    store.remove_snode(cur, op[1])
+                elif kind == "clear_zombie":
+                    store.clear_zombie(cur, op[1], op[2])
+                elif kind == "clear_zombies":
+                    store.clear_zombies(cur, op[1], op[2])
+
+
+    def close(self) -> None:
+        """Stop the checkpoint thread and write everything still pending"""
+        with self.lock:
+            self.should_run = False
+            self.flushed.notify_all()
+        self.flusher.join()
+        self.flush()
+        with self.lock:
+            self.journal.close()
+
+
+    # ==== READS ====
+    def get_files(self) -> List[str]:
+        with self.lock:
+            return list(self.files)
+
+
+    def file_to_uuids(self, file_name: str) -> List[str]:
+        """Return the S-nodes storing a chunk of file_name"""
+        with self.lock:
+            uuids = {}
+            for chunk_name in self.file_chunks.get(file_name, ()):
+                for uuid in self.chunk_uuids.get(chunk_name, ()):
+                    uuids[uuid] = None
+            return list(uuids)
+
+
+    def chunks_of(self, file_name: str) -> List[Tuple[str, str]]:
+        """Return [(uuid, chunk)] for every stored chunk of file_name"""
+        with self.lock:
+            return [(uuid, chunk_name) for chunk_name in sorted(self.file_chunks.get(file_name, ()))
+                    for uuid in self.chunk_uuids.get(chunk_name, ())]
+
+
+    def file_total_size(self, file_name: str) -> int:
+        with self.lock:
+            return sum(self.chunk_sizes.get(chunk_name, 0) for chunk_name in self.file_chunks.get(file_name, ()))
+
+
+    def file_total_sizes(self) -> Dict[str, int]:
+        """Return {file_name: bytes stored across all of its chunks}"""
+        with self.lock:
+            return {file_name: self.file_total_size(file_name) for file_name in self.files}
+
+
+    def chunk_size(self, chunk_name: str) -> int:
+        with self.lock:
+            return self.chunk_sizes.get(chunk_name, 0)
+
+
+    def uuid_chunks(self, target_uuid: str) -> List[str]:
+        with self.lock:
+            return list(self.uuid_chunk_map.get(target_uuid, ()))
+
+
+    def chunk_to_snode(self, chunk_name: str) -> Optional[str]:
+        with self.lock:
+            return next(iter(self.chunk_uuids.get(chunk_name, ())), None)
+
+
+    def snode_to_chunk(self, target_uuid: str, file_name: str) -> Optional[str]:
+        with self.lock:
+            for chunk_name in self.uuid_chunk_map.get(target_uuid, ()):
+                if registry_db.chunk_file(chunk_name) == file_name:
+                    return chunk_name
+            return None
+
+
+    def used_storage(self, target_uuid: str) -> int:
+        with self.lock:
+            return self.used.get(target_uuid, 0)
+
+
+    def all_used_storage(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.used)
+
+
+    def zombies(self, target_uuid: str) -> List[str]:
+        with self.lock:
+            return list(self.zombie_map.get(target_uuid, ()))
+
+
+    def file_params(self, file_name: str) -> Optional[dict]:
+        """Return the file's .meta contents (size, padding, k, m, stripe_size), parsed once and cached"""
+        with self.lock:
+            if file_name in self.params:
+                return self.params[file_name]
+        meta_file = os.path.join(self.meta_dir, f"{file_name}.meta")
+        if not os.path.exists(meta_file):
+            return None
+        params = erasurezfec.read_meta(meta_file)
+        with self.lock:
+            self.params[file_name] = params
+        return params
@@ -0,0 +1,275 @@
+import time
+import functools
+import itertools
+import threading
+from typing import Dict, List, Optional
+
+import codec
+import erasurelrc
+import pipeline
+from retrieval_engine import CLOUD_UUIDS, Cancellation
+from upload_engine import ShareUpload
+
+""" Background repair of the shares lost with dead S-nodes.
+
+    Every share of a file is live (one of its holders is connected), pending (its holders
+    are down, but not for GRACE_PERIOD yet, or are a disabled cloud) or lost (every holder
+    has been down for GRACE_PERIOD, or no holder is left, e.g. after remove_client). An
+    S-node counts as down from its failure detector `dead` event, or from the first scan
+    that finds it disconnected.
+
+    The repair thread wakes when the grace period of a down S-node ends, and every
+    SCAN_INTERVAL. It ranks the files with lost shares by their live shares above k, fewest
+    first, and repairs them in that order: the file is streamed from any k live shares by
+    the retrieval engine, every stripe is re-encoded into the lost share numbers only, and
+    those are uploaded to connected S-nodes holding no other share of the file. A share of
+    an LRC file (erasurelrc.py) whose local group is live is instead the XOR of that group,
+    read whole. The lost copies are then kept as zombies, so a holder that comes back
+    deletes them. """
+
+GRACE_PERIOD = 15 * 60 # seconds a down S-node has to come back before its shares are rebuilt
+SCAN_INTERVAL = 10 * 60 # seconds between scans when no grace period ends sooner
+
+
+class FileHealth:
+    """Where the shares of one file stand"""
+    def __init__(self, file_name: str, k: int, live: Dict[int, List[str]], lost: List[int], pending: List[int]):
+        self.file_name = file_name
+        self.k = k
+        self.live = live # {share number: connected holders}
+        self.lost = lost # share numbers to rebuild
+        self.pending = pending # share numbers whose holders may still come back
+
+    @property
+    def margin(self) -> int:
+        """Live shares above k; below 0 the file cannot be read (nor repaired)"""
+        return len(self.live) - self.k
+
+    def __repr__(self):
+        return (f"FileHealth({self.file_name}, live={len(self.live)}, k={self.k}, "
+                f"lost={self.lost}, pending={self.pending})")
+
+
+class RepairEngine:
+    def __init__(self, node, grace_period: float = GRACE_PERIOD, scan_interval: float = SCAN_INTERVAL):
+        """Keeps the files of node (a RegistryNode) repaired: its index, connected S-nodes,
+           retrieval engine and uploader are used, and its failure detector is followed"""
+        self.node = node
+        self.grace_period = grace_period
+        self.scan_interval = scan_interval
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.down_since: Dict[str, float] = {} # {uuid: monotonic time it was first seen down}
+        self.counters = {"files": 0, "shares": 0, "failed": 0, "unrecoverable": 0}
+        self.should_run = True
+        node.storage_service.detector.subscribe(self._on_node_event)
+        threading.Thread(target=self._run, name="repair", daemon=True).start()
+
+
+    def _on_node_event(self, event: str, uuid: str) -> None:
+        with self.lock:
+            if event == "dead":
+                self.down_since.setdefault(uuid, time.monotonic())
+                self.wakeup.notify()
+            elif event == "connect":
+                self.down_since.pop(uuid, None)
+
+
+    def stop(self) -> None:
+        with self.lock:
+            self.should_run = False
+            self.wakeup.notify_all()
+
+
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters, down=len(self.down_since))
+
+
+    # ==== HEALTH ====
+    def health(self, file_name: str) -> Optional[FileHealth]:
+        """Classify the shares of file_name, None if it has no metadata"""
+        meta = self.node.index.file_params(file_name)
+        if meta is None:
+            return None
+        connected = set(self.node.get_uuids())
+        holders: Dict[int, List[str]] = {}
+        for uuid, chunk_name in self.node.index.chunks_of(file_name):
+            holders.setdefault(int(chunk_name.rsplit('.', 1)[1]), []).append(uuid)
+
+        live, lost, pending = {}, [], []
+        for share in range(meta['m']):
+            uuids = holders.get(share, [])
+            up = [uuid for uuid in uuids if uuid in connected]
+            if up:
+                live[share] = up
+            elif all(self._lost(uuid) for uuid in uuids):
+                lost.append(share)
+            else:
+                pending.append(share)
+        return FileHealth(file_name, meta['k'], live, lost, pending)
+
+
+    def _lost(self, uuid: str) -> bool:
+        """True when a disconnected holder has been down for the grace period"""
+        if uuid in CLOUD_UUIDS:
+            return False # disabled, not gone
+        now = time.monotonic()
+        with self.lock:
+            return now - self.down_since.setdefault(uuid, now) >= self.grace_period
+
+
+    def scan(self) -> List[FileHealth]:
+        """Every file with lost shares, the ones closest to falling below k first"""
+        damaged = [health for health in map(self.health, self.node.index.get_files())
+                   if health is not None and health.lost]
+        return sorted(damaged, key=lambda health: (health.margin, health.file_name))
+
+
+    # ==== REPAIR ====
+    def repair_all(self) -> int:
+        """Repair every damaged file, most endangered first. Return the shares rebuilt"""
+        rebuilt = 0
+        for health in self.scan():
+            if not self.should_run:
+                break
+            if health.margin < 0:
+                print(f"[WARN] {health.file_name} has {len(health.live)} of {health.k} required shares, cannot repair")
+                with self.lock:
+                    self.counters["unrecoverable"] += 1
+                continue
+            rebuilt += self.repair(health.file_name)
+        return rebuilt
+
+
+    def repair(self, file_name: str) -> int:
+        """Rebuild the lost shares of file_name from k live ones, or from their local group
+           for an LRC file. Return the shares stored"""
+        health = self.health(file_name)
+        if health is None or not health.lost or health.margin < 0:
+            return 0
+        node = self.node
+        meta = node.index.file_params(file_name)
+        plan = self._targets(health)
+        if not plan:
+            print(f"[WARN] no S-node can take the lost shares of {file_name}")
+            return 0
+
+        try:
+            engine = codec.engine_for(meta)
+            if engine.select(sorted(health.live)) is None:
+                print(f"[WARN] the live shares of {file_name} cannot rebuild it, cannot repair")
+                with self.lock:
+                    self.counters["unrecoverable"] += 1
+                return 0
+            share_size = engine.encoder.share_size(meta['size'])
+            streams = {share: pipeline.ShareStream() for share in plan}
+            uploads = []
+            for share, stream in streams.items():
+                chunk_name = f"{file_name}.{share}"
+                send = functools.partial(node._stream_share, plan[share], chunk_name, share_size, stream)
+                uploads.append(ShareUpload(share, plan[share], chunk_name, send, stream=stream))
+            # LRC: a share whose local group is live is the XOR of the group, the rest need a decode
+            local = {share: engine.repair_sources(share, health.live) for share in plan}
+            local = {share: sources for share, sources in local.items() if sources}
+            decoded = [share for share in plan if share not in local]
+
+            batch = node.uploader.start(uploads)
+            try:
+                feeders = [threading.Thread(target=self._xor_share, daemon=True,
+                                            args=(file_name, sources, health.live, share_size, streams[share]))
+                           for share, sources in local.items()]
+                for feeder in feeders:
+                    feeder.start()
+                if decoded:
+                    holders = [(uuid, f"{file_name}.{share}") for share, uuids in health.live.items() for uuid in uuids]
+                    ciphertext = node.retriever.stream(holders, meta)
+                    pipeline.write_shares(pipeline.stripes_of(ciphertext, engine.stripe_size), engine,
+                                          [streams[share] for share in decoded], decoded)
+                for feeder in feeders:
+                    feeder.join()
+            finally:
+                result = batch.wait()
+        except Exception as e:
+            print(f"[ERROR] repairing {file_name}: {e}")
+            with self.lock:
+                self.counters["failed"] += 1
+            return 0
+
+        # The rebuilt shares replace the lost copies, which a returning holder deletes
+        for share in result.stored:
+            chunk_name = f"{file_name}.{share}"
+            for uuid, held in node.index.chunks_of(file_name):
+                if held == chunk_name and uuid != plan[share]:
+                    node.index.retire_placement(uuid, chunk_name)
+        with self.lock:
+            self.counters["files"] += 1
+            self.counters["shares"] += len(result.stored)
+            self.counters["failed"] += len(result.failed)
+        print(f"[INFO] Repaired {file_name}: rebuilt {len(result.stored)} of {len(plan)} lost shares")
+        return len(result.stored)
+
+
+    def _xor_share(self, file_name: str, sources: List[int], live: Dict[int, List[str]], share_size: int,
+                   stream: pipeline.ShareStream) -> None:
+        """Write the XOR of the source shares (read whole, in lockstep) to stream"""
+        cancellation = Cancellation()
+        readers = []
+        for share in sources:
+            uuid = min(live[share], key=lambda holder: holder in CLOUD_UUIDS) # S-nodes before the cloud
+            opener = self.node.open_cloud_stream if uuid in CLOUD_UUIDS else self.node.open_chunk_stream
+            pieces = opener(uuid, f"{file_name}.{share}", cancellation, offset=0, length=share_size)
+            readers.append(pipeline.stripes_of(pieces, pipeline.MESSAGE_SIZE))
+        completed = False
+        try:
+            for pieces in itertools.zip_longest(*readers):
+                if None in pieces:
+                    raise ValueError(f"the shares of {file_name} differ in size")
+                stream.write(erasurelrc.xor_blocks(pieces))
+            completed = True
+        except Exception as e:
+            print(f"[ERROR] rebuilding a share of {file_name} from its local group: {e}")
+        finally:
+            cancellation.cancel()
+            if completed:
+                stream.close()
+            else:
+                stream.abort()
+
+
+    def _targets(self, health: FileHealth) -> Dict[int, str]:
+        """{lost share: S-node} spreading the shares over the least used connected S-nodes,
+           those holding no share of the file first. S-nodes with a zombie of the same chunk
+           are skipped, as its cleanup would delete the rebuilt share"""
+        index = self.node.index
+        holding = {uuid for uuid, _ in index.chunks_of(health.file_name)}
+        candidates = [uuid for uuid in self.node.get_uuids() if uuid not in CLOUD_UUIDS]
+        used = {uuid: index.used_storage(uuid) for uuid in candidates}
+        plan = {}
+        for share in health.lost:
+            chunk_name = f"{health.file_name}.{share}"
+            eligible = [uuid for uuid in candidates if chunk_name not in index.zombies(uuid)]
+            if not eligible:
+                continue
+            target = min(eligible, key=lambda uuid: (uuid in holding, used[uuid]))
+            plan[share] = target
+            holding.add(target)
+            used[target] += index.chunk_size(chunk_name)
+        return plan
+
+
+    def _run(self) -> None:
+        while True:
+            with self.lock:
+                if not self.should_run:
+                    return
+                now = time.monotonic()
+                ends = [since + self.grace_period for since in self.down_since.values()
+                        if since + self.grace_period > now]
+                self.wakeup.wait(min(ends, default=now + self.scan_interval) - now)
+                if not self.should_run:
+                    return
+            try:
+                self.repair_all()
+            except Exception as e:
+                print(f"[ERROR] repair pass: {e}")
@@ -0,0 +1,309 @@
+import time
+import itertools
+import threading
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import codec
+import erasurezfec as zfec
+
+""" Parallel, first-k-wins retrieval of the chunks of a file, decoded as it streams in.
+
+    k + EXTRA_REQUESTS holders are asked at once, fastest first according to a per
+    S-node history (EWMAs of seconds per MB and of the failure rate). Every share is
+    received into a small bounded buffer and the stripes are decoded as soon as any k
+    shares hold the next block, so nothing is written to disk. Once the first stripe
+    is decoded the shares that did not make the first k are cancelled. A share that
+    fails, or k shares stalling for STALL_TIMEOUT, brings in the next holder, which
+    skips ahead to the current stripe. The cloud copies (aws/google) are only used
+    once the LAN holders cannot deliver k shares. Every share is only requested from
+    the first block still needed, and a range of stripes can be fetched on its own. """
+
+CLOUD_UUIDS = ("aws", "google")
+EXTRA_REQUESTS = 1 # holders asked on top of the k required
+STALL_TIMEOUT = 10.0 # seconds without progress before asking one more holder
+LATENCY_ALPHA = 0.3 # weight of the newest sample in the latency EWMA
+BUFFERED_BLOCKS = 2 # blocks a share may receive ahead of the decoder
+
+
+class RetrievalError(Exception):
+    pass
+
+
+class Cancellation:
+    """Cancels one transfer: cancel() aborts the attached gRPC call"""
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def attach(self, call) -> None:
+        with self.lock:
+            self.calls.append(call)
+            if self.event.is_set():
+                call.cancel()
+
+    def detach(self, call) -> None:
+        """Forget a call that finished, so cancel() leaves it (and its connection) alone"""
+        with self.lock:
+            if call in self.calls:
+                self.calls.remove(call)
+
+    def cancel(self) -> None:
+        with self.lock:
+            self.event.set()
+            for call in self.calls:
+                call.cancel()
+
+    def is_set(self) -> bool:
+        return self.event.is_set()
+
+
+class ShareReader:
+    """Receives one share in a background thread, one block-sized slot per stripe. Slots are
+       never resized, so the decoder can work on memoryviews of them while more data arrives.
+       Only the blocks of stripes skip_to..end (default: the last) are requested, stripes the
+       decoder moves past meanwhile are skipped, and at most `buffered` full slots wait for
+       the decoder"""
+    def __init__(self, target_uuid: str, chunk_name: str, block_sizes: List[int], skip_to: int,
+                 cond: threading.Condition, buffered: int = BUFFERED_BLOCKS, end: Optional[int] = None):
+        self.target_uuid = target_uuid
+        self.chunk_name = chunk_name
+        self.sharenum = int(chunk_name.rsplit('.', 1)[1])
+        self.block_sizes = block_sizes
+        self.starts = [0] + list(itertools.accumulate(block_sizes))[:-1] # share offset of each block
+        self.skip_to = skip_to # first stripe the decoder still needs
+        self.end = len(block_sizes) if end is None else end # stripe after the last one needed
+        self.cond = cond
+        self.buffered = buffered
+        self.ready: Dict[int, bytearray] = {} # {stripe: full slot}
+        self.cancellation = Cancellation()
+        self.failed = False
+        self.done = False # run() returned, nothing left to cancel
+        self.received = 0
+        self.started = time.monotonic()
+
+    def run(self, open_stream) -> None:
+        stripe, slot, filled = self.skip_to, None, 0
+        position = self.starts[stripe] if stripe < self.end else 0
+        length = sum(self.block_sizes[stripe:self.end])
+        if length == 0:
+            return # nothing left to fetch (an open stream would send the whole chunk)
+        try:
+            for piece in open_stream(self.target_uuid, self.chunk_name, self.cancellation,
+                                     offset=position, length=length):
+                view = memoryview(piece)
+                self.received += len(view)
+                while len(view) and stripe < self.end:
+                    if stripe < self.skip_to: # the decoder moved past this stripe
+                        stripe, slot = self.skip_to, None
+                        continue
+                    if position < self.starts[stripe]:
+                        skip = min(len(view), self.starts[stripe] - position)
+                        view, position = view[skip:], position + skip
+                        continue
+                    if slot is None:
+                        slot, filled = bytearray(self.block_sizes[stripe]), 0
+                    count = min(len(view), len(slot) - filled)
+                    slot[filled:filled + count] = view[:count]
+                    view, filled, position = view[count:], filled + count, position + count
+                    if filled == len(slot):
+                        with self.cond:
+                            while len(self.ready) >= self.buffered and not self.cancellation.is_set():
+                                self.cond.wait()
+                            if self.cancellation.is_set():
+                                return
+                            if stripe >= self.skip_to:
+                                self.ready[stripe] = slot
+                                self.cond.notify_all()
+                        stripe, slot = stripe + 1, None
+                if self.cancellation.is_set():
+                    return
+            if stripe < self.end:
+                raise RetrievalError(f"{self.chunk_name} from {self.target_uuid} is truncated")
+        except Exception as e:
+            if not self.cancellation.is_set():
+                print(f"[ERROR] receiving {self.chunk_name} from {self.target_uuid}: {e}")
+                with self.cond:
+                    self.failed = True
+                    self.cond.notify_all()
+
+    def has(self, stripe: int) -> bool:
+        return stripe in self.ready
+
+    def block(self, stripe: int) -> memoryview:
+        return memoryview(self.ready[stripe])
+
+    def release(self, stripe: int) -> None:
+        """The decoder is done with everything before stripe (caller holds cond)"""
+        self.skip_to = max(self.skip_to, stripe)
+        for done in [s for s in self.ready if s < stripe]:
+            del self.ready[done]
+
+    def cancel(self) -> None:
+        self.cancellation.cancel()
+        with self.cond:
+            self.cond.notify_all()
+
+
+class RetrievalResult:
+    def __init__(self, required: int):
+        self.required = required
+        self.shares: Dict[str, str] = {} # {chunk: uuid} that delivered the first stripe
+        self.failed: List[Tuple[str, str]] = [] # (uuid, chunk) transfers that failed
+        self.cancelled: List[Tuple[str, str]] = [] # transfers stopped as surplus
+        self.used_cloud = False
+        self.bytes = 0 # bytes decoded
+        self.elapsed = 0.0
+
+    def __repr__(self):
+        return (f"RetrievalResult(shares={len(self.shares)}/{self.required}, failed={len(self.failed)}, "
+                f"cancelled={len(self.cancelled)}, cloud={self.used_cloud}, elapsed={self.elapsed:.2f}s)")
+
+
+class RetrievalEngine:
+    def __init__(self, open_stream: Callable[..., Iterator[bytes]],
+                 open_cloud_stream: Callable[..., Iterator[bytes]]):
+        """open_stream(uuid, chunk, cancellation, offset=, length=) yields length bytes from
+           offset of a chunk held by an S-node, open_cloud_stream(provider, chunk, cancellation,
+           offset=, length=) of one stored on aws/google"""
+        self.open_stream = open_stream
+        self.open_cloud_stream = open_cloud_stream
+        self.lock = threading.Lock()
+        self.latency: Dict[str, float] = {} # {uuid: EWMA seconds per MB}
+        self.failure_rate: Dict[str, float] = {} # {uuid: EWMA of failed transfers, 0..1}
+
+
+    # ==== LATENCY HISTORY ====
+    def record(self, target_uuid: str, seconds: float, size: int) -> None:
+        sample = seconds / max(size / (1024 * 1024), 1e-3)
+        with self.lock:
+            old = self.latency.get(target_uuid)
+            self.latency[target_uuid] = sample if old is None else (1 - LATENCY_ALPHA) * old + LATENCY_ALPHA * sample
+            self.failure_rate[target_uuid] = (1 - LATENCY_ALPHA) * self.failure_rate.get(target_uuid, 0.0)
+
+
+    def record_failure(self, target_uuid: str) -> None:
+        with self.lock:
+            old = self.failure_rate.get(target_uuid, 0.0)
+            self.failure_rate[target_uuid] = (1 - LATENCY_ALPHA) * old + LATENCY_ALPHA
+
+
+    def rank(self, holders: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+        """Order holders fastest first, nodes that failed recently last; nodes without
+           history go first among the reliable ones so they get measured"""
+        with self.lock:
+            return sorted(holders, key=lambda holder: (round(self.failure_rate.get(holder[0], 0.0), 1),
+                                                       self.latency.get(holder[0], 0.0)))
+
+
+    # ==== RETRIEVAL ====
+    def stream(self, holders: List[Tuple[str, str]], meta: dict, result: Optional[RetrievalResult] = None,
+               first_stripe: int = 0, last_stripe: Optional[int] = None) -> Iterator[memoryview]:
+        """Yield the erasure-decoded contents (the ciphertext) of a file described by meta
+           (see erasurezfec.read_meta), fetched from holders [(uuid, chunk)]; only stripes
+           first_stripe..last_stripe (exclusive, default: all) when given. The yielded views
+           are only valid until the next item is requested"""
+        k, m = meta['k'], meta['m']
+        result = result if result is not None else RetrievalResult(k)
+        engine = codec.engine_for(meta)
+        stripes = list(zfec.stripe_blocks(meta))
+        block_sizes = [block_size for block_size, _ in stripes]
+        last_stripe = len(stripes) if last_stripe is None else min(last_stripe, len(stripes))
+        # Every stripe being decoded pins one slot of each chosen share
+        buffered = max(BUFFERED_BLOCKS, engine.window + 1)
+
+        cond = threading.Condition()
+        lan = self.rank([holder for holder in holders if holder[0] not in CLOUD_UUIDS])
+        cloud = [holder for holder in holders if holder[0] in CLOUD_UUIDS]
+        active: List[ShareReader] = []
+        started = time.monotonic()
+        gathering = first_stripe # stripe whose blocks are being collected
+
+        def launch(count):
+            """Start up to count readers on chunks nobody is receiving (caller holds cond),
+               return how many were started"""
+            started = 0
+            while started < count:
+                busy = {reader.chunk_name for reader in active}
+                holder = next((h for h in lan if h[1] not in busy), None)
+                opener = self.open_stream
+                if holder is None:
+                    holder = next((h for h in cloud if h[1] not in busy), None)
+                    opener = self.open_cloud_stream
+                    if holder is None:
+                        return started
+                    cloud.remove(holder)
+                    result.used_cloud = True
+                else:
+                    lan.remove(holder)
+                reader = ShareReader(holder[0], holder[1], block_sizes, gathering, cond, buffered, last_stripe)
+                threading.Thread(target=self._receive, args=(reader, opener), daemon=True).start()
+                active.append(reader)
+                started += 1
+            return started
+
+        def decodable(readers):
+            return engine.select([reader.sharenum for reader in readers]) is not None
+
+        def gather():
+            """Yield (blocks, sharenums, data_size) of every stripe once the shares delivered
+               so far can rebuild it (any k for zfec)"""
+            nonlocal gathering
+            for stripe in range(first_stripe, last_stripe):
+                data_size = stripes[stripe][1]
+                gathering = stripe
+                with cond:
+                    while True:
+                        for reader in [r for r in active if r.failed]:
+                            active.remove(reader)
+                            result.failed.append((reader.target_uuid, reader.chunk_name))
+                        ready = [r for r in active if r.has(stripe)]
+                        picked = engine.select([reader.sharenum for reader in ready])
+                        if picked is not None:
+                            break
+                        # Replace failed shares (LRC may need more than k when some are local parities)
+                        while not decodable(active) and launch(max(1, k - len(active))):
+                            pass
+                        if not decodable(active):
+                            raise RetrievalError(f"Only {len(active)} of {k} required chunks can be reached")
+                        if not cond.wait(timeout=STALL_TIMEOUT):
+                            launch(1) # hedge against a stalled holder
+
+                    chosen = [ready[i] for i in picked]
+                    if stripe == first_stripe:
+                        # First k wins: keep the shares that delivered the first stripe
+                        result.shares = {reader.chunk_name: reader.target_uuid for reader in chosen}
+                        for reader in [r for r in active if r not in chosen]:
+                            result.cancelled.append((reader.target_uuid, reader.chunk_name))
+                            active.remove(reader)
+                            reader.cancel()
+                    yield [reader.block(stripe) for reader in chosen], [reader.sharenum for reader in chosen], data_size
+
+        try:
+            with cond:
+                launch(k + EXTRA_REQUESTS)
+            # Several stripes are decoded at once on the erasure engine's threads
+            for stripe, (decoded, blocks) in enumerate(engine.decode_stripes(gather()), first_stripe):
+                for view in decoded:
+                    result.bytes += len(view)
+                    yield view
+                for view in decoded + blocks:
+                    view.release()
+                with cond:
+                    for reader in active:
+                        reader.release(stripe + 1)
+                    cond.notify_all()
+        finally:
+            for reader in active:
+                if not reader.done:
+                    reader.cancel()
+            result.elapsed = time.monotonic() - started
+
+
+    def _receive(self, reader: ShareReader, opener) -> None:
+        reader.run(opener)
+        reader.done = True
+        if reader.failed:
+            self.record_failure(reader.target_uuid)
+        elif not reader.cancellation.is_set() and reader.target_uuid not in CLOUD_UUIDS:
+            self.record(reader.target_uuid, time.monotonic() - reader.started, reader.received)
@@ -1,4 +1,5 @@
 import grpc
+import asyncio
 from concurrent import futures
 import storage_node_pb2
 import storage_node_pb2_grpc
@@ -21,58 +22,88 @@ import aws_util
 import new_enc as enclib
 import shutil
 import erasurezfec as zfec
+import codec
 import encrypt
 import math
+import functools
 import cmd_util
+import registry_db
+from registry_index import RegistryIndex
+import pipeline
+from upload_engine import UploadEngine, ShareUpload
+from retrieval_engine import RetrievalEngine, RetrievalResult, CLOUD_UUIDS
+from repair import RepairEngine
+from channel_pool import ChannelPool
+import data_plane
+from failure_detector import FailureDetector
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 NODES_FILE = Path("registry_conf/nodes.json")
+CONNECT_TIMEOUT = 5 # seconds to wait for an S-node channel before giving up on a transfer
+FETCH_TIMEOUT = 10 # base deadline of a chunk download, in seconds...
+MIN_FETCH_RATE = 1024 * 1024 # ...plus one second per MB of chunk
+RESUME_ATTEMPTS = 3 # times an interrupted file upload resumes from the bytes already stored
+RESUME_BACKOFF = 1.0 # seconds, times the attempt number
+READ_RESUME_ATTEMPTS = 3 # times a broken chunk read is re-requested from the last byte received
+RESUMABLE_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+                   grpc.StatusCode.INTERNAL, grpc.StatusCode.UNKNOWN)
+ZOMBIE_BATCH = 256 # zombies forgotten per journal write while an S-node confirms their deletion
+ZOMBIE_CONNECT_WAIT = 30 # seconds a reconnected S-node has to report its file port
+ZOMBIE_DELETE_TIMEOUT = 0.05 # seconds of DeleteFiles deadline per zombie, on top of FETCH_TIMEOUT
+MIGRATION_WORKERS = 4 # chunks moved between S-nodes at once when draining one
+MIGRATION_BANDWIDTH = 100 * 1024 * 1024 # bytes per second shared by those moves, 0 = no cap
+ERASURE_CODEC = "zfec" # a codec.py codec, e.g. "lrc" for cheaper repairs, or "auto": the one `codec.py bench --save` found fastest
+USE_DATA_PLANE = True # read chunks on the S-nodes' raw TCP data plane when they advertise one
+
+
+def _peer_ip(peer):
+    """ IP of a gRPC peer string ('ipv4:ip:port' or 'ipv6:[ip]:port'), None for anything else """
+    if not peer.startswith(("ipv4:", "ipv6:")):
+        return None
+    return peer.split(':', 1)[1].rsplit(':', 1)[0]
+
 
 class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
     def __init__(self):
         self.connected_clients: Dict[str, str] = {} # Clients: {UUID, IP:Port}
         self.client_contexts: Dict[str, grpc.ServicerContext] = {} # Store specific gRPC stuff needed for each client as each client has specific gRPC handling
         self.client_last_heartbeat: Dict[str, float] = {}  # Add timestamp tracking: {UUID: timestamp}
+        self.detector = FailureDetector() # decides when a silent node is suspected / dead
         self.client_file_ports: Dict[str, int] = {} # {UUID: port}
+        self.client_data_ports: Dict[str, int] = {} # {UUID: data plane port}, see data_plane.py
         self.client_storage_capacity: Dict[str, int] = {} # Client {UUID : storage_capacity}
         self.client_hostnames: Dict[str, str] = {} # {UUID: hostname}
         self.download_dir = "downloaded_files"
         os.makedirs(self.download_dir, exist_ok=True)
         self.nodes = self.load_nodes()  # Load nodes from file
         self.snodes_file = Path("registry_conf/snodes.json")
-        self.zombies = Path("registry_conf/file_mappings/zombies.json")
         self.snodes = self.load_snodes() # Load snodes from file, {UUID: hostname}
         self.pending_nodes: Dict[str, str] = {}  # {UUID: address}
         self.pending_hostnames: Dict[str, str] = {} # For pending snodes: {UUID: hostname}
         self.pending_storage: Dict[str, str] = {} # For pending snodes: {UUID: tribute storage}
+        self.channels = ChannelPool() # {UUID: long-lived channel to the S-node's file service}
+        self.data_plane = data_plane.DataPlaneClient() # {UUID: data plane session + idle connections}
 
-        # Start heartbeat monitoring thread
-        self._start_heartbeat_monitor()
-
-
-    # Check on clients every 5 secs
-    def _start_heartbeat_monitor(self):
-        """Remove clients who haven't sent a signal in the last 5 seconds"""
-        def monitor_heartbeats():
-            while True:
-                current_time = time.time()
-                ianctive_clients = []
-                # Check for clients that haven't sent a heartbeat in 5 seconds
-                for uuid, last_time in self.client_last_heartbeat.items():
-                    if current_time - last_time > 5:  # 5 second timeout
-                        ianctive_clients.append(uuid)
-                # Remove inactive clients
-                for uuid in ianctive_clients:
-                    self._handle_client_disconnect(uuid)
-                time.sleep(5)  # Check every 5 seconds
+        # Remove clients as soon as the failure detector declares them dead
+        self.detector.subscribe(self._on_node_event)
 
-        
-        # Do this in a non-blocking thread
-        threading.Thread(target=monitor_heartbeats, daemon=True).start()
+
+    def _seen(self, uuid: str) -> None:
+        """Record a sign of life (heartbeat or UUID handshake) of a client"""
+        self.client_last_heartbeat[uuid] = time.time()
+        self.detector.heartbeat(uuid)
+
+
+    def _on_node_event(self, event: str, uuid: str) -> None:
+        if event == "suspect":
+            logging.warning(f"Client {uuid} missed its heartbeats (phi {self.detector.phi(uuid) or 0:.1f})")
+        elif event == "dead":
+            self._handle_client_disconnect(uuid)
 
 
     def _handle_client_disconnect(self, uuid: str) -> None:
         """Remove client information when it disconnects"""
+        self.detector.remove(uuid)
         if uuid in self.connected_clients:
             addr = self.connected_clients[uuid]
             logging.info(f"\nClient disconnected - UUID: {uuid}, Address: {addr}")
@@ -91,8 +122,38 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
         self.client_contexts.pop(uuid, None)
         self.client_last_heartbeat.pop(uuid, None)
         self.client_file_ports.pop(uuid, None)
+        self.client_data_ports.pop(uuid, None)
         self.client_storage_capacity.pop(uuid, None)
         self.client_hostnames.pop(uuid, None)
+        self.channels.close(uuid)
+        self.data_plane.close(uuid)
+
+
+    def file_address(self, uuid):
+        """ Return 'ip:port' of the S-node's file service, None if it is not known yet """
+        client_addr = self.connected_clients.get(uuid, "")
+        port = self.client_file_ports.get(uuid)
+        if not port or client_addr.count(':') < 2:
+            return None
+        ip = client_addr.split(':')[1]  # peer is 'ipv4:ip:port'
+        return f"{ip}:{port}"
+
+
+    def data_address(self, uuid):
+        """ Return (ip, port) of the S-node's data plane, None if it does not advertise one """
+        address = self.file_address(uuid)
+        port = self.client_data_ports.get(uuid)
+        if address is None or not port:
+            return None
+        return (address.rsplit(':', 1)[0], port)
+
+
+    def stub(self, uuid):
+        """ Return a stub on the pooled channel to a connected S-node """
+        address = self.file_address(uuid)
+        if address is None:
+            raise Exception(f"Storage node {uuid} is not connected")
+        return self.channels.stub(uuid, address)
 
     
     def load_nodes(self):
@@ -150,12 +211,12 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
         del self.pending_nodes[uuid]
         
 
-    def Heartbeat(self, request_iterator, context):
-        """Handle heartbeats from clients"""
+    async def Heartbeat(self, request_iterator, context):
+        """Handle heartbeats from clients (a coroutine per S-node stream, see register_service)"""
         client_uuid = None
         
         try:
-            for request in request_iterator:
+            async for request in request_iterator:
                 client_uuid = request.uuid
     
                 if client_uuid not in self.connected_clients:
@@ -167,10 +228,14 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
                     return
                 
                 # Update last heartbeat timestamp
-                self.client_last_heartbeat[client_uuid] = time.time()
+                self._seen(client_uuid)
                 self.client_contexts[client_uuid] = context
-                # Store specific file service port
+                # Store specific file service port, and keep a channel open to it
                 self.client_file_ports[client_uuid] = request.file_service_port
+                self.client_data_ports[client_uuid] = request.data_port
+                address = self.file_address(client_uuid)
+                if address is not None:
+                    self.channels.open(client_uuid, address)
                 # Store client committed storage
                 self.client_storage_capacity[client_uuid] = request.storage_capacity_mb
                 
@@ -186,10 +251,11 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
             logging.error(f"Heartbeat error for client {client_uuid}: {e}", exc_info=True)
         finally:
             if client_uuid:
-                self._handle_client_disconnect(client_uuid)
+                # Closing the S-node's channels blocks, and the stream may be cancelled: not awaited
+                asyncio.get_running_loop().run_in_executor(None, self._handle_client_disconnect, client_uuid)
 
 
-    def RequestUUID(self, request, context):
+    async def RequestUUID(self, request, context):
         """Handle when a client requests a UUID (first connection)"""
         try:
             if request.type == 'request_uuid':
@@ -204,7 +270,7 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
                 self.pending_nodes[client_uuid] = client_addr
 
                 # Initial connection time
-                self.client_last_heartbeat[client_uuid] = time.time()
+                self._seen(client_uuid)
 
                 # Snode provides storage and hostname information on first request
                 self.pending_storage[client_uuid] = request.storage_capacity_mb
@@ -223,20 +289,20 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
                 )
         except Exception as e:
             logging.error(f"Exception in RequestUUID: {e}", exc_info=True)
-            context.abort(grpc.StatusCode.INTERNAL, "Internal error during UUID generation")
+            await context.abort(grpc.StatusCode.INTERNAL, "Internal error during UUID generation")
 
 
-    def ValidateUUID(self, request, context):
+    async def ValidateUUID(self, request, context):
         """ Handle reconnection requests from previously connected, known storage nodes """
         try:
             client_uuid = request.uuid
             client_addr = context.peer()
             
             # UUID known, approve connection immediately
-            self.nodes = self.load_nodes() # reload
+            self.nodes = await asyncio.to_thread(self.load_nodes) # reload, off the event loop
             if client_uuid in self.nodes:
                 self.connected_clients[client_uuid] = client_addr
-                self.client_last_heartbeat[client_uuid] = time.time()
+                self._seen(client_uuid)
                 logging.info(f"Validated known UUID {client_uuid} for client at {client_addr}")
                 
                 return storage_node_pb2.UUIDResponse(
@@ -247,7 +313,7 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
             else:
                 # Unknown UUID, add to pending list quietly after first warning
                 if client_uuid not in self.pending_nodes:
-                    self.client_last_heartbeat[client_uuid] = time.time() # if >15 seconds from last request, pending node removed
+                    self._seen(client_uuid) # pending node removed once the failure detector declares it dead
                     self.pending_nodes[client_uuid] = client_addr
                     logging.warning(f"New node pending approval - UUID: {client_uuid}, Address: {client_addr}")
                 # Don't repeatedly log warnings
@@ -255,7 +321,7 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
                 # Prevent available snodes being periodically disconnected if
                 # they send a request within (heartbeat check time) seconds
                 else:
-                    self.client_last_heartbeat[client_uuid] = time.time()
+                    self._seen(client_uuid)
 
             # Add back to pending nodes (which is cleared on disconnect)
             self.pending_nodes[client_uuid] = client_addr
@@ -270,7 +336,20 @@ class StorageService(storage_node_pb2_grpc.StorageServiceServicer):
 
         except Exception as e:
             logging.error(f"Exception in ValidateUUID: {e}", exc_info=True)
-            context.abort(grpc.StatusCode.INTERNAL, "Internal error during UUID validation")
+            await context.abort(grpc.StatusCode.INTERNAL, "Internal error during UUID validation")
+
+
+    async def ResolvePeer(self, request, context):
+        """ Give a connected S-node the file service address of another connected S-node, the
+        source of a PullChunk. The asking S-node must call from the address it connected from,
+        so only approved S-nodes learn addresses, and only of approved S-nodes """
+        asking = self.connected_clients.get(request.uuid, "")
+        if _peer_ip(asking) is None or _peer_ip(asking) != _peer_ip(context.peer()):
+            return storage_node_pb2.PeerAddress(success=False, message="Unknown S-node")
+        address = self.file_address(request.peer)
+        if address is None:
+            return storage_node_pb2.PeerAddress(success=False, message=f"Storage node {request.peer} is not connected")
+        return storage_node_pb2.PeerAddress(success=True, address=address)
    
 
     def get_total_storage(self) -> int:
@@ -295,15 +374,9 @@ class RegistryNode:
         self.service_name = service_name
         self.full_name = f"{service_name}.{service_type}"
         self.server = None
+        self.loop = None # event loop of the registry service, see register_service
         self.storage_service = StorageService()
         self.mappings_dir = os.path.join(os.getcwd(), "registry_conf", "file_mappings")
-        self.uuid_to_chunks = os.path.join(self.mappings_dir, "uuid_to_chunks.json")
-        self.file_total_sizes = os.path.join(self.mappings_dir, "file_total_sizes.json")
-        self.file_to_uuids = os.path.join(self.mappings_dir, "file_to_uuids.json")
-        self.snodes_storage_used = os.path.join(self.mappings_dir, "snodes_storage_used.json")
-        self.key_name_mappings = os.path.join(self.mappings_dir, "key_name_mappings.json")
-        self.chunk_to_size = os.path.join(self.mappings_dir, "chunk_to_size.json")
-        self.zombies = os.path.join(self.mappings_dir, "zombies.json") # uuid: list of files to delete
         self.meta_files = os.path.join(os.getcwd(), "registry_conf", "meta_files")
         self.registry_dir = os.path.join(os.getcwd(), "registry_conf")
         self.upload_dir = os.path.join(os.getcwd(), "uploading_files")
@@ -312,25 +385,21 @@ class RegistryNode:
         os.makedirs(self.mappings_dir, exist_ok=True)
         os.makedirs(self.meta_files, exist_ok=True)
 
-        # Create the .json files if they do not already exist
-        if not os.path.exists(self.uuid_to_chunks):
-            f = open(self.uuid_to_chunks, 'w')
-            json.dump({}, f, indent=4)
-        if not os.path.exists(self.chunk_to_size):
-            f = open(self.chunk_to_size, 'w')
-            json.dump({}, f, indent=4)
-        if not os.path.exists(self.file_total_sizes):
-            f = open(self.file_total_sizes, 'w')
-            json.dump({}, f, indent=4)
-        if not os.path.exists(self.file_to_uuids):
-            f = open(self.file_to_uuids, 'w')
-            json.dump({}, f, indent=4)
-        if not os.path.exists(self.snodes_storage_used):
-            f = open(self.snodes_storage_used, 'w')
-            json.dump({}, f, indent=4)
-        if not os.path.exists(self.zombies):
-            f = open(self.zombies, 'w')
-            json.dump({}, f, indent=4)
+        # File/chunk/S-node mappings (imports the legacy file_mappings/*.json on first start)
+        self.store = registry_db.open_store(os.path.join(self.registry_dir, "registry.db"))
+        # Every lookup is served from memory, writes reach the store through a write-behind journal
+        self.index = RegistryIndex(self.store, self.meta_files,
+                                   journal_path=os.path.join(self.registry_dir, "registry.journal"))
+        # Shares of a file are uploaded concurrently, with per S-node limits and retries
+        self.uploader = UploadEngine()
+        # Chunks are streamed from several holders at once, first k win
+        self.retriever = RetrievalEngine(self.open_chunk_stream, self.open_cloud_stream)
+        # Zombies of an S-node are deleted as soon as it reconnects
+        self.zombie_lock = threading.Lock()
+        self.cleaning: Set[str] = set() # uuids whose zombies are being deleted
+        self.storage_service.detector.subscribe(self._on_node_event)
+        # Shares lost with S-nodes that stay dead are rebuilt from the surviving ones
+        self.repairer = RepairEngine(self)
 
         self.aws = False
         self.google = False
@@ -396,24 +465,35 @@ class RegistryNode:
         self.zeroconf.register_service(info)
         logging.info(f"Registered service {self.full_name} on {local_ip}:{port}")
 
-        # Create the gRPC server
-        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+        # The registry service runs on grpc.aio in an event loop thread of its own: heartbeat
+        # streams and UUID handshakes are coroutines instead of each holding a worker thread
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="registry-service", daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self._start_server(port), self.loop).result()
+        
+        return info
+
+
+    async def _start_server(self, port: int):
+        self.server = grpc.aio.server()
         storage_node_pb2_grpc.add_StorageServiceServicer_to_server(
             self.storage_service, self.server
         )
         # No SSL/TLS, won't matter since it's LAN(?)
         self.server.add_insecure_port(f'[::]:{port}')
-        self.server.start()
-        
-        return info
+        await self.server.start()
 
 
     def unregister_service(self, info):
         """Stop broadcast"""
         if self.server:
-            self.server.stop(0)
+            asyncio.run_coroutine_threadsafe(self.server.stop(0), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
         self.zeroconf.unregister_service(info)
         self.zeroconf.close()
+        self.repairer.stop()
+        self.storage_service.channels.close_all()
+        self.index.close() # checkpoint the journal before exiting
 
 
     def get_pending_hostname(self, uuid):
@@ -427,110 +507,114 @@ class RegistryNode:
 
 
     def distribute(self, filename, uuids, m, k):
-        """ Upload the file specified by the absolute_path/filename to specified uuids with k parity chunks """
+        """ Upload the file specified by the absolute_path/filename to specified uuids with k parity chunks.
+            The file is encrypted, erasure coded and uploaded as a stream of stripes: share i
+            goes straight into the UploadFile call of uuids[i] (all m uploads run at once),
+            nothing is written to disk except the shares bound for cloud storage """
         try:
             if enclib.encrypt_filename(filename) is not None:
                 return "Cannot upload the same file twice!"
-    
-            # takes file from pyfiles/uploading_files, creates (m, k) chunks in pyfiles/file_chunked
-            output_dir = os.path.join(os.getcwd(), "registry_conf", "file_chunked")
-            dest = os.path.join(os.getcwd(), "uploading_files")
-            absolute_path = os.path.join(dest, filename)
 
-            masked_filename = enclib.encrypt_file(absolute_path)
-
-            if not masked_filename:
-                return "Error encrypting file on upload"
-            
-            file_encrypted_path = os.path.join("registry_conf", masked_filename)
-            
-            if (zfec.encode_file(input_file = file_encrypted_path, output_dir = output_dir, m = m, k = k)):
-                remove_file = os.path.join(os.getcwd(), "registry_conf", masked_filename)
-                # clear encrypted file
-                os.remove(remove_file)
-            # On success, uploads (cwd)/file_chunked/filename.{i} to snode[i], 
-            #..., (cwd)/file_chunked/file_name.{m} to snode[n]
-                chunk_dir = os.path.join(os.getcwd(), "registry_conf", "file_chunked")
-                meta_dir = os.path.join(os.getcwd(), "registry_conf", "meta_files")
-
-                for i in range(m):
-                    chunk_name = f"{masked_filename}.{i}"
-                    chunk_path_i = os.path.join(chunk_dir, chunk_name)
-                    self.upload_file_to_snode(uuids[i], chunk_path_i)
-                    os.remove(chunk_path_i) # clear the folder
-            
-                # Move meta file from pyfiles/file_chunked to pyfiles/meta_files dir
-                meta_name = f"{masked_filename}.meta"
-                old_meta_path = os.path.join(chunk_dir, meta_name)
-                new_meta_path = os.path.join(meta_dir, meta_name)
-                shutil.move(old_meta_path, new_meta_path)
+            absolute_path = os.path.join(os.getcwd(), "uploading_files", filename)
+            masked_filename = enclib.generate_random_filename(10) + '.enc'
+            key = enclib.generate_random_key()
+
+            engine = self._erasure_engine(k, m)
+            encoder = engine.encoder
+            cipher_size = enclib.encrypted_size(os.path.getsize(absolute_path))
+            share_size = encoder.share_size(cipher_size)
+
+            shares = [pipeline.ShareStream() for _ in range(m)]
+            uploads = []
+            for i in range(m):
+                chunk_name = f"{masked_filename}.{i}"
+                if uuids[i] in ("aws", "google"):
+                    send = functools.partial(self._spool_share_to_cloud, uuids[i], chunk_name, shares[i])
+                else:
+                    send = functools.partial(self._stream_share, uuids[i], chunk_name, share_size, shares[i])
+                uploads.append(ShareUpload(i, uuids[i], chunk_name, send, stream=shares[i]))
 
-                return "Upload successful!"
+            # Map the file before its first share is indexed, so listings never meet an unmapped file
+            enclib.update_key_mapping(masked_filename, filename, key)
+            batch = self.uploader.start(uploads)
+            failure = None
+            try:
+                pipeline.encode_to_shares(absolute_path, key, encoder, shares, engine)
+            except Exception as e:
+                failure = f"While attempting to upload file, encountered error: {e}"
+            result = batch.wait()
+            if failure is None and not result.succeeded(k):
+                failure = f"Upload failed: only {len(result.stored)} of {m} chunks were stored"
+
+            if failure is not None:
+                # The file cannot be rebuilt: take back the shares that made it, then the mapping
+                for i in result.stored:
+                    self._delete_chunk(uuids[i], f"{masked_filename}.{i}")
+                self.index.delete_file(masked_filename, [])
+                with self.store.transaction() as cur:
+                    self.store.delete_key_mapping(cur, masked_filename)
+                return failure
+
+            meta_path = os.path.join(self.meta_files, f"{masked_filename}.meta")
+            zfec.write_meta(meta_path, cipher_size, encoder.padding(cipher_size), k, m, encoder.stripe_size, **engine.params)
+            self.index.set_params(masked_filename, zfec.read_meta(meta_path))
+
+            if result.failed:
+                return f"Upload successful! ({len(result.failed)} of {m} chunks could not be stored)"
+            return "Upload successful!"
 
         except Exception as e:
             return f"While attempting to upload file, encountered error: {e}"
 
 
-    def update_json(self,chunk_name:str,chunk_size:int,target_uuid:str):
-                
-            # update uuid file mappings here
-                # chunk_name = (erasure) chunk name
-                with open(self.uuid_to_chunks, 'r') as f:
-                    uuid_to_chunks = json.load(f)
-                with open(self.file_total_sizes, 'r') as f:
-                    file_total_sizes = json.load(f)
-                with open(self.file_to_uuids, 'r') as f:
-                    file_to_uuids = json.load(f)
-                with open(self.snodes_storage_used, 'r') as f:
-                    snodes_storage_used = json.load(f)
-                if target_uuid not in uuid_to_chunks:
-                    uuid_to_chunks[target_uuid] = [chunk_name]
-                if chunk_name not in uuid_to_chunks[target_uuid]:
-                    uuid_to_chunks[target_uuid].append(chunk_name)
-                # Load chunk_to_size.json
-                with open(self.chunk_to_size, 'r') as f:
-                    chunk_to_size = json.load(f)
-                
-                # Load snodes_storage_used.json
-                with open(self.snodes_storage_used, 'r') as f:
-                    snodes_storage_used = json.load(f) # uuid: total storage
+    def _erasure_engine(self, k, m):
+        """Engine coding k of m shares with ERASURE_CODEC (zfec when it does not support k and m)"""
+        name = codec.preferred(k, m) if ERASURE_CODEC == "auto" else ERASURE_CODEC
+        if name in codec.codecs(k, m):
+            return codec.create(name, k, m)
+        return codec.create(codec.DEFAULT_CODEC, k, m)
 
-                # write storage space used for the chunk
-                if chunk_name in chunk_to_size:
-                    chunk_to_size[chunk_name] = chunk_to_size[chunk_name] + chunk_size
-                else:
-                    chunk_to_size[chunk_name] = chunk_size
-                
-                # write new storage space taken by the file (both for the file, and each snode it is stored on)
-                full_file_name = chunk_name[:-2] 
-                if target_uuid not in file_total_sizes:
-                    file_total_sizes[full_file_name] = chunk_size
-                else:
-                    file_total_sizes[full_file_name] = file_total_sizes[full_file_name] + chunk_size
 
-                if target_uuid not in snodes_storage_used:
-                    snodes_storage_used[target_uuid] = chunk_size
-                else:
-                    snodes_storage_used[target_uuid] = snodes_storage_used[target_uuid] + chunk_size
-                
-                # update {file: [uuids]}
-                if full_file_name not in file_to_uuids:
-                    file_to_uuids[full_file_name] = [target_uuid]
-                elif target_uuid not in file_to_uuids[full_file_name]:
-                    file_to_uuids[full_file_name].append(target_uuid)
-                
-                # write changes
-                with open(self.uuid_to_chunks, 'w') as f:
-                    json.dump(uuid_to_chunks, f, indent=4)
-                with open(self.file_total_sizes, 'w') as f:
-                    json.dump(file_total_sizes, f, indent=4)
-                with open(self.file_to_uuids, 'w') as f:
-                    json.dump(file_to_uuids, f, indent=4)
-                with open(self.snodes_storage_used, 'w') as f:
-                    json.dump(snodes_storage_used, f, indent=4)
-                with open(self.chunk_to_size, 'w') as f:
-                    json.dump(chunk_to_size, f, indent=4)
-  
+    def _stream_share(self, target_uuid, chunk_name, share_size, share):
+        return self.upload_stream_to_snode(target_uuid, chunk_name, share_size, share.messages())
+
+
+    def _spool_share_to_cloud(self, target_uuid, chunk_name, share):
+        """Cloud uploads need a file: write the share to file_chunked, upload it, then remove it"""
+        chunk_dir = os.path.join(os.getcwd(), "registry_conf", "file_chunked")
+        os.makedirs(chunk_dir, exist_ok=True)
+        chunk_path = os.path.join(chunk_dir, chunk_name)
+        try:
+            with open(chunk_path, 'wb') as f:
+                for piece in share.messages():
+                    f.write(piece)
+            return self.upload_file_to_snode(target_uuid, chunk_path)
+        except Exception as e:
+            print(f"[ERROR] spooling {chunk_name}: {e}")
+            return False
+        finally:
+            if os.path.exists(chunk_path):
+                os.remove(chunk_path)
+
+
+    def _delete_chunk(self, target_uuid, chunk_name):
+        """Delete one chunk wherever it is stored (S-node or cloud)"""
+        if target_uuid == "google":
+            google_util.delete_file(chunk_name)
+        elif target_uuid == "aws":
+            aws_util.delete_file(chunk_name)
+        else:
+            self.remote_delete_file(chunk_name=chunk_name, target_uuid=target_uuid)
+
+
+    def _wait_connected(self, target_uuid):
+        """Block until the pooled channel to the S-node is connected, or raise after CONNECT_TIMEOUT"""
+        grpc.channel_ready_future(self.storage_service.channels.channel(target_uuid)).result(timeout=CONNECT_TIMEOUT)
+
+
+    def record_chunk(self, chunk_name:str, chunk_size:int, target_uuid:str):
+        """ Record that the (erasure) chunk chunk_name, of chunk_size bytes, is now stored on target_uuid """
+        self.index.add_chunk(chunk_name, chunk_size, target_uuid)
 
 
     def upload_file_to_snode(self, 
@@ -541,7 +625,7 @@ class RegistryNode:
         if target_uuid == "aws":
             try:
                 aws_util.upload(filename)
-                self.update_json(chunk_name,chunk_size,target_uuid)
+                self.record_chunk(chunk_name,chunk_size,target_uuid)
                 return True
             except Exception as e:
                 print(f"[ERROR] AWS Upload: {e}")
@@ -549,117 +633,82 @@ class RegistryNode:
         if target_uuid == "google":
             try:
                 google_util.upload_to_gcs(filename)
-                self.update_json(chunk_name,chunk_size,target_uuid)
+                self.record_chunk(chunk_name,chunk_size,target_uuid)
                 return True
             except Exception as e:
                 print(f"[ERROR] Google Upload: {e}")
                 return False
+
+        def file_contents(offset):
+            with open(filename, 'rb') as f:
+                f.seek(offset)
+                while True:
+                    piece = f.read(pipeline.MESSAGE_SIZE)
+                    if not piece:
+                        break
+                    yield piece
+
+        # A file can be re-read from any offset: after an interruption, continue from the
+        # bytes the S-node has stored instead of sending the whole chunk again
+        offset = 0
+        for attempt in range(RESUME_ATTEMPTS + 1):
+            if attempt:
+                time.sleep(RESUME_BACKOFF * attempt)
+                offset, complete = self.query_upload(target_uuid, chunk_name)
+                if complete and offset == chunk_size:
+                    self.record_chunk(chunk_name, chunk_size, target_uuid)
+                    return True
+                if complete or offset > chunk_size:
+                    offset = 0
+                print(f"[WARN] resuming upload of {chunk_name} to {target_uuid} at byte {offset:,}")
+            if self.upload_stream_to_snode(target_uuid, chunk_name, chunk_size, file_contents(offset), offset):
+                return True
+        return False
+
+
+    def query_upload(self, target_uuid: str, chunk_name: str) -> Tuple[int, bool]:
+        """Return (bytes stored, upload complete) of chunk_name on the S-node, (0, False) if unknown"""
         try:
-            with open(self.uuid_to_chunks, 'r') as f:
-                uuid_to_chunks = json.load(f)
-            with open(self.file_total_sizes, 'r') as f:
-                file_total_sizes = json.load(f)
-            with open(self.file_to_uuids, 'r') as f:
-                file_to_uuids = json.load(f)
-            with open(self.snodes_storage_used, 'r') as f:
-                snodes_storage_used = json.load(f)
+            status = self.storage_service.stub(target_uuid).QueryUpload(
+                storage_node_pb2.UploadQuery(filename=chunk_name), timeout=CONNECT_TIMEOUT)
+            return status.size, status.complete
+        except Exception as e:
+            print(f"[WARN] querying upload of {chunk_name} on {target_uuid}: {e}")
+            return 0, False
+
 
+    def upload_stream_to_snode(self, target_uuid: str, chunk_name: str, total_size: int, contents,
+                               start_offset: int = 0) -> bool:
+        """Stream the pieces yielded by contents (at most 1MB each) to the S-node as chunk_name,
+           contents starting at byte start_offset of the chunk"""
+        try:
             # Get client context for target S-node
             context = self.storage_service.client_contexts.get(target_uuid)
             if not context or target_uuid not in self.storage_service.connected_clients:
                 print(f"[ERROR] Storage node {target_uuid} is not connected")
                 return False
             
-            client_addr = self.storage_service.connected_clients[target_uuid]
-            ip = client_addr.split(':')[1]  # Get the IP address part
-            port = self.storage_service.client_file_ports.get(target_uuid)
-        
-            # Create a channel to the storage node
-            channel = grpc.insecure_channel(f'{ip}:{port}')
-
             # A stub is an object that allows use of server methods like local functions
-            stub = storage_node_pb2_grpc.StorageServiceStub(channel)
-            
+            stub = self.storage_service.stub(target_uuid)
+            # Connect before handing over contents, so a failed connection can be retried
+            self._wait_connected(target_uuid)
 
             def file_chunk_generator():
-                CHUNK_SIZE = 1024 * 1024  # 1MB chunks
-                try:
-                    with open(filename, 'rb') as f:
-                        offset = 0
-                        while True:
-                            chunk = f.read(CHUNK_SIZE)
-                            if not chunk:
-                                break
-                            yield storage_node_pb2.FileChunk(
-                                content=chunk,
-                                filename=os.path.basename(filename),
-                                offset=offset,
-                                total_size=chunk_size
-                            )
-                            offset += len(chunk)
-                except FileNotFoundError:
-                    print(f"[ERROR] File {filename} not found")
-                    return
-                except Exception as e:
-                    print(f"[ERROR] failed to read file: {e}")
-                    return
+                offset = start_offset
+                for piece in contents:
+                    yield storage_node_pb2.FileChunk(
+                        content=piece,
+                        filename=chunk_name,
+                        offset=offset,
+                        total_size=total_size
+                    )
+                    offset += len(piece)
 
             # Send the file chunks to the storage node
             response = stub.UploadFile(file_chunk_generator())
 
             if response.success:
-                # update uuid file mappings here
-                # chunk_name = (erasure) chunk name
-                chunk_name = os.path.basename(filename)
-                if target_uuid not in uuid_to_chunks:
-                    uuid_to_chunks[target_uuid] = [chunk_name]
-                if chunk_name not in uuid_to_chunks[target_uuid]:
-                    uuid_to_chunks[target_uuid].append(chunk_name)
-
-                # Load chunk_to_size.json
-                with open(self.chunk_to_size, 'r') as f:
-                    chunk_to_size = json.load(f)
-                
-                # Load snodes_storage_used.json
-                with open(self.snodes_storage_used, 'r') as f:
-                    snodes_storage_used = json.load(f) # uuid: total storage
-
-                # write storage space used for the chunk
-                if chunk_name in chunk_to_size:
-                    chunk_to_size[chunk_name] = chunk_to_size[chunk_name] + chunk_size
-                else:
-                    chunk_to_size[chunk_name] = chunk_size
-                
-                # write new storage space taken by the file (both for the file, and each snode it is stored on)
-                full_file_name = chunk_name[:-2] 
-                if target_uuid not in file_total_sizes:
-                    file_total_sizes[full_file_name] = chunk_size
-                else:
-                    file_total_sizes[full_file_name] = file_total_sizes[full_file_name] + chunk_size
-
-                if target_uuid not in snodes_storage_used:
-                    snodes_storage_used[target_uuid] = chunk_size
-                else:
-                    snodes_storage_used[target_uuid] = snodes_storage_used[target_uuid] + chunk_size
-                
-                # update {file: [uuids]}
-                if full_file_name not in file_to_uuids:
-                    file_to_uuids[full_file_name] = [target_uuid]
-                elif target_uuid not in file_to_uuids[full_file_name]:
-                    file_to_uuids[full_file_name].append(target_uuid)
-                
-                # write changes
-                with open(self.uuid_to_chunks, 'w') as f:
-                    json.dump(uuid_to_chunks, f, indent=4)
-                with open(self.file_total_sizes, 'w') as f:
-                    json.dump(file_total_sizes, f, indent=4)
-                with open(self.file_to_uuids, 'w') as f:
-                    json.dump(file_to_uuids, f, indent=4)
-                with open(self.snodes_storage_used, 'w') as f:
-                    json.dump(snodes_storage_used, f, indent=4)
-                with open(self.chunk_to_size, 'w') as f:
-                    json.dump(chunk_to_size, f, indent=4)
-                
+                self.record_chunk(chunk_name, total_size, target_uuid)
                 return True
             else:
                 print(f"[ERROR] Upload failed: {response.message}")
@@ -673,16 +722,12 @@ class RegistryNode:
     def availability_util(self, file_name):
         """ Accept a filename, return {snode_name: connected_status} for all snodes storing the file """
         try:
-            with open(self.file_to_uuids, 'r') as f:
-                file_to_uuids = json.load(f) # {filename: [uuids]}
-
             # List of UUIDs storing the specified filename
-            relevant_uuids = file_to_uuids[file_name]
+            relevant_uuids = self.index.file_to_uuids(file_name)
+            uuids_to_names = self.storage_service.snodes
 
             snode_to_availability = {}
             for uuid in relevant_uuids:
-                with self.storage_service.snodes_file.open('r') as f:
-                    uuids_to_names = json.load(f)
                 available = 0
                 if uuid in self.storage_service.connected_clients:
                     available = 1
@@ -696,118 +741,173 @@ class RegistryNode:
 
     def get_used_storage(self, uuid):
         """ Return the storage used by a specified snode """
-        with open(self.snodes_storage_used, 'r') as f:
-            snodes_storage_used = json.load(f)
-        
-        return snodes_storage_used[uuid] if uuid in snodes_storage_used else 0
+        return self.index.used_storage(uuid)
 
 
 
     def download(self, filename: str) -> bool:
-        """ Download all the chunks, and puts them in downloaded_files,
-        to be decrypted and reassembled """
+        """ Fetch, decode and decrypt the file in one pass: shares stream from the holders
+        (in parallel, fastest first, cloud copies only when the S-nodes cannot deliver k)
+        into the zfec decoder and the decryptor, and only the plaintext is written, to
+        registry_conf/downloads/<original name> """
         print(f"Received: {filename}")
-        try: self.download_from_cloud(filename)
-        except Exception as e:
-            print()
         try:
-            with open(self.file_to_uuids, 'r') as f:
-                file_to_uuids = json.load(f)
-            with open(self.uuid_to_chunks, 'r') as f:
-                uuid_to_chunks = json.load(f)
-
-            file_uuids = file_to_uuids[filename]
             connected_uuids = self.get_uuids()
-            # all connected uuids containing a chunk (uuids not unique in list, since node can store multiple chunks)
-            expanded_chunk_mapping = []
-            available_chunks = 0
-
-            # Add data to uuid_to_chunk: {uuid1: chunk1, uuid1: chunk7, uuid4: chunk8, ...}
-            for uuid in connected_uuids:
-                if uuid not in file_uuids:
-                    break
-                
-                # Now iterating through connected, relevant uuid chunks
-                for chunk in uuid_to_chunks[uuid]:
-                    stored_chunks = uuid_to_chunks[uuid] # stored on this node
-                    for chunk in stored_chunks:
-                        if chunk[:-2] == filename:
-                            expanded_chunk_mapping.append((uuid, chunk))
-                            available_chunks = available_chunks + 1
-
-            num_required = self.get_required(filename)
-            if available_chunks < num_required:
+            # (uuid, chunk) for every reachable copy; one S-node may hold several chunks, in the
+            # case that it is carrying a chunk from an S-node that previously stored this file
+            holders = [(uuid, chunk) for uuid, chunk in self.index.chunks_of(filename) if uuid in connected_uuids]
+
+            meta = self.index.file_params(filename)
+            if meta is None:
+                return f"No metadata for {filename}"
+            if len({chunk for _, chunk in holders}) < meta['k']:
                 return f"Not enough required S-nodes to reconstruct"
 
-
-            # Get k random chunks from the n available
-            subset_available = random.sample(range(0, available_chunks), num_required)
-            # A file cannot be reuploaded until deleted, so the chunks will
-            # be unique (i.e. snode.example1 cannot have the same chunk as snode.example2)
-            # But one S-node may have multiple chunks, in the case that it is carrying
-            # a chunk from an S-node that previously stored this file but was deleted
-            for index in subset_available:
-                expanded_map = expanded_chunk_mapping[index]
-                self.download_chunk(expanded_map[0], expanded_map[1]) # uuid, stored_chunk
-            
-            enclib.decrypt_file(filename)
+            result = RetrievalResult(meta['k'])
+            output_path = enclib.decrypt_stream(filename, self.retriever.stream(holders, meta, result))
+            print(f"[INFO] {result}, saved to {output_path}")
             return "Success"
         
         except Exception as e:
             return f"Error on download: {e}"
 
 
+    def read_range(self, filename: str, offset: int, length: int) -> bytes:
+        """ Return length plaintext bytes from offset of a stored file, fetching only the stripes
+        that hold the encrypted segments covering them (plus the first stripe, for the header).
+        Raises if the file cannot be reached or predates the AES-GCM format """
+        connected_uuids = self.get_uuids()
+        holders = [(uuid, chunk) for uuid, chunk in self.index.chunks_of(filename) if uuid in connected_uuids]
+        meta = self.index.file_params(filename)
+        file_info = enclib.decrypt_filename(filename)
+        if meta is None or file_info is None:
+            raise KeyError(f"No metadata for {filename}")
+        stripe_size = meta['stripe_size']
+
+        def fetch(start, size):
+            """Ciphertext bytes [start, start + size), decoding only the stripes around them"""
+            first_stripe = start // stripe_size
+            last_stripe = -(-(start + size) // stripe_size)
+            data = b"".join(bytes(view) for view in self.retriever.stream(holders, meta, None, first_stripe, last_stripe))
+            skip = start - first_stripe * stripe_size
+            return data[skip:skip + size]
+
+        header = fetch(0, enclib.HEADER_SIZE)
+        first, start, span = enclib.segment_span(header, meta['size'], offset, length)
+        return enclib.decrypt_span(file_info['key'], header, meta['size'], first, fetch(start, span), offset, length)
+
+
     def download_chunk(self, target_uuid, chunk_name):
-        """ Download a specified chunk from the target uuid """
+        """ Download a specified chunk from the target uuid into downloaded_files. The chunk is
+        written to <chunk>.part and kept when the transfer fails, so calling this again resumes
+        it instead of starting over """
+        os.makedirs("downloaded_files", exist_ok=True)
+        save_path = os.path.join("downloaded_files", chunk_name)
+        part_path = save_path + ".part"
         try:
-            # Check if node is connected
-            if target_uuid not in self.storage_service.connected_clients:
-                print(f"[ERROR] Storage node {target_uuid} is not connected!")
-                raise Exception("Target UUID could not be reached")
-                    
-            client_addr = self.storage_service.connected_clients[target_uuid]
-            ip = client_addr.split(':')[1]
-            port = self.storage_service.client_file_ports.get(target_uuid)
-            
-            if not port:
-                print(f"[ERROR] No file service port found for storage node {target_uuid}")
-                return False
-                
-            # Create channel to storage node
-            print(f"[INFO] Connecting to storage node at {ip}:{port}")
-            channel = grpc.insecure_channel(f'{ip}:{port}')
-            stub = storage_node_pb2_grpc.StorageServiceStub(channel)
-            
-            # Prepare download request
-            request = storage_node_pb2.FileRequest(filename=chunk_name)
-            os.makedirs("downloaded_files", exist_ok=True)
-            save_path = os.path.join("downloaded_files", chunk_name)
-
-            total_size = 0
-            with open(save_path, 'wb') as f:
-                try:
-                    for chunk in stub.RequestFile(request):
-                        f.write(chunk.content)
-                        total_size += len(chunk.content)
-                        if chunk.total_size > 0:
-                            progress = (total_size / chunk.total_size) * 100
-                            print(f"\rDownloading: {progress:.1f}%", end="", flush=True)
-                except grpc.RpcError as rpc_error:
-                    print(f"\nRPC error: {rpc_error.code()}: {rpc_error.details()}")
-                    if os.path.exists(save_path):
-                        os.remove(save_path)
-                    return False
-                        
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            with open(part_path, 'ab') as f:
+                for content in self.open_chunk_stream(target_uuid, chunk_name, offset=offset):
+                    f.write(content)
+            os.replace(part_path, save_path)
             print(f"File downloaded successfully to {save_path}")
             return True
-            
+
         except Exception as e:
             print(f"Download error details: {str(e)}")
-            print(f"Error type: {type(e)}")
-            if 'save_path' in locals() and os.path.exists(save_path):
-                os.remove(save_path)
             return False
 
+
+    def open_chunk_stream(self, target_uuid, chunk_name, cancellation=None, offset=0, length=0):
+        """ Yield length bytes (0 = up to the end) of a chunk stored on the target uuid from
+        offset, as they arrive; each piece is only valid until the next one is requested. The
+        chunk is read on the S-node's data plane when it advertises one (USE_DATA_PLANE), over
+        gRPC otherwise or once the data plane failed. Each gRPC request has a deadline scaled
+        to the bytes left; a transfer that breaks is re-requested from the last byte received
+        (READ_RESUME_ATTEMPTS times). Stops early if cancellation (see retrieval_engine) is set """
+        # Check if node is connected
+        if target_uuid not in self.storage_service.connected_clients:
+            print(f"[ERROR] Storage node {target_uuid} is not connected!")
+            raise Exception("Target UUID could not be reached")
+        if not self.storage_service.client_file_ports.get(target_uuid):
+            raise Exception(f"No file service port found for storage node {target_uuid}")
+
+        stub = self.storage_service.stub(target_uuid)
+        self._wait_connected(target_uuid)
+
+        remaining = length or max(self.index.chunk_size(chunk_name) - offset, 0)
+        data_address = self.storage_service.data_address(target_uuid) if USE_DATA_PLANE else None
+        attempt = 0
+        while True:
+            try:
+                if data_address is not None:
+                    pieces = self._read_data_plane(stub, target_uuid, data_address, chunk_name, cancellation,
+                                                   offset, remaining if length else 0)
+                else:
+                    pieces = self._read_grpc(stub, chunk_name, cancellation, offset, remaining if length else 0,
+                                             FETCH_TIMEOUT + remaining / MIN_FETCH_RATE)
+                for piece in pieces:
+                    offset += len(piece)
+                    remaining = max(remaining - len(piece), 0)
+                    yield piece
+                return
+            except (OSError, data_plane.DataPlaneError) as e:
+                stopped = cancellation is not None and cancellation.is_set()
+                if stopped or data_address is None:
+                    raise
+                print(f"[WARN] data plane read of {chunk_name} from {target_uuid} failed ({e}), continuing over gRPC at byte {offset:,}")
+                data_address = None
+            except grpc.RpcError as e:
+                stopped = cancellation is not None and cancellation.is_set()
+                if stopped or e.code() not in RESUMABLE_CODES or attempt == READ_RESUME_ATTEMPTS:
+                    raise
+                attempt += 1
+                print(f"[WARN] read of {chunk_name} from {target_uuid} broke ({e.code().name}), resuming at byte {offset:,}")
+                time.sleep(RESUME_BACKOFF * attempt)
+
+
+    def _read_grpc(self, stub, chunk_name, cancellation, offset, length, deadline):
+        responses = stub.RequestFile(storage_node_pb2.FileRequest(filename=chunk_name, offset=offset, length=length),
+                                     timeout=deadline)
+        if cancellation is not None:
+            cancellation.attach(responses)
+        for chunk in responses:
+            yield chunk.content
+
+
+    def _read_data_plane(self, stub, target_uuid, data_address, chunk_name, cancellation, offset, length):
+        def open_session():
+            session = stub.OpenDataSession(storage_node_pb2.DataSessionRequest(), timeout=CONNECT_TIMEOUT)
+            return session.token, session.ttl
+        return self.storage_service.data_plane.read(target_uuid, data_address, open_session, chunk_name,
+                                                    offset, length, cancellation)
+
+
+    def open_cloud_stream(self, provider, chunk_name, cancellation=None, offset=0, length=0):
+        """ Yield length bytes (0 = up to the end) from offset of a chunk stored on aws/google
+        (the SDKs download the whole chunk to a file, which is removed once read) """
+        os.makedirs("downloaded_files", exist_ok=True)
+        save_path = os.path.join("downloaded_files", chunk_name)
+        try:
+            if provider == "aws" and self.aws:
+                aws_util.download(save_path)
+            elif provider == "google" and self.google:
+                google_util.download_from_gcs(save_path)
+            if not os.path.exists(save_path):
+                raise Exception(f"{provider} download of {chunk_name} failed")
+            with open(save_path, 'rb') as f:
+                f.seek(offset)
+                remaining = length or os.path.getsize(save_path) - offset
+                while remaining > 0 and not (cancellation and cancellation.is_set()):
+                    piece = f.read(min(pipeline.MESSAGE_SIZE, remaining))
+                    if not piece:
+                        break
+                    remaining -= len(piece)
+                    yield piece
+        finally:
+            if os.path.exists(save_path):
+                os.remove(save_path)
+
      
     def get_random_snodes(self, n: int):
         """Choose N random S-nodes"""
@@ -829,39 +929,20 @@ class RegistryNode:
         """ Disconnect from an S-node (will then require approval on its next connection attempt) """
 
         # Open jsons
-        with open(self.uuid_to_chunks, 'r') as f:
-            uuid_to_chunks = json.load(f)
         with open(NODES_FILE, 'r') as f:
             gen_nodes_file = json.load(f)
         with open(self.storage_service.snodes_file, 'r') as f:
             gen_snodes_file = json.load(f)
 
-        if uuid in uuid_to_chunks:
-            # Remove any stored files
-            file_names = uuid_to_chunks[uuid] # returns chunk names, which end with .{i} (i.e. .2) so need [:-2]
-            for file_name in file_names:
-                file_name = file_name[:-2]
-                self.redistribute(file_name, uuid)
-            del uuid_to_chunks[uuid]
+        # Move any stored chunks onto the remaining S-nodes
+        self.drain(uuid)
         
         # clear temp memory of client        
         self.storage_service.pop_client(uuid)
 
-        with open(self.file_to_uuids, 'r') as f:
-            file_to_uuids = json.load(f)
-        """ Since the redistribute function call updates this json, it is necessary to load it here"""
-        with open(self.snodes_storage_used, 'r') as f:
-            snodes_storage_used = json.load(f)
-
-        # Delete all mentions of the S-node in .json files
-        for file, uuids in file_to_uuids.items():
-            if uuid in uuids:
-                file_to_uuids[file].remove(uuid)
-            if uuids is None:
-                del file_to_uuids[file]
-        
-        if uuid in snodes_storage_used:
-            del snodes_storage_used[uuid]
+        # Delete all mentions of the S-node (placements drive file_to_uuids and storage used)
+        self.index.remove_snode(uuid)
+        self.storage_service.snodes.pop(uuid, None)
         
         if uuid in gen_nodes_file:
             del gen_nodes_file[uuid]
@@ -870,10 +951,6 @@ class RegistryNode:
             del gen_snodes_file[uuid]
 
         # Write changes
-        with open(self.uuid_to_chunks, 'w') as f:
-            json.dump(uuid_to_chunks, f, indent=4)
-        with open(self.snodes_storage_used, 'w') as f:
-            json.dump(snodes_storage_used, f, indent=4)
         with open(NODES_FILE, 'w') as f:
             json.dump(gen_nodes_file, f, indent=4)
         with open(self.storage_service.snodes_file, 'w') as f:
@@ -888,132 +965,121 @@ class RegistryNode:
                 idea is that this disconnect should not affect the data on other S-nodes
             2) If no other connected client, stores disconnecting client's chunk on the R-node (so skip upload step)
         """
-        try:
-            with open(self.uuid_to_chunks, 'r') as f:
-                uuid_to_chunks = json.load(f)
+        relevant_chunks = [chunk for chunk in self.index.uuid_chunks(uuid) if registry_db.chunk_file(chunk) == file_name]
+        return self._move_chunks(uuid, relevant_chunks)
 
-            num_snodes = len(self.get_uuids())
-            relevant_chunks = uuid_to_chunks[uuid]
 
-            for relevant_chunk in relevant_chunks:
-                # Download target chunk from disconnecting S-node
-                self.download_chunk(uuid, relevant_chunk)
+    def drain(self, uuid):
+        """Move every chunk off an S-node (see redistribute), all files at once"""
+        return self._move_chunks(uuid, self.index.uuid_chunks(uuid))
 
-            """Case 1: no S-nodes to send the chunk to: store locally"""
-            if num_snodes < 2:
-                return 1
 
-            """Case 2: can re-upload chunk(s) from disconnecting S-node"""
-            for relevant_chunk in relevant_chunks:
-                download_path = os.path.join(os.getcwd(), "downloaded_files", relevant_chunk)
-                upload_path = os.path.join(os.getcwd(), "uploading_files", relevant_chunk)
-                if os.path.exists(download_path):
-                    shutil.move(download_path, upload_path)
-                
-                # A bit of a hack: sample 2 so even if get current in sample, won't reupload to it
-                random_snodes = self.get_random_snodes(2)
-                if uuid in random_snodes:
-                    random_snodes.remove(uuid)
-                target_snode = random_snodes[0]
+    def _move_chunks(self, uuid, chunk_names):
+        try:
+            targets = [target for target in self.get_uuids() if target != uuid and target not in CLOUD_UUIDS]
 
+            """Case 1: no S-nodes to send the chunk to: store locally"""
+            if not targets:
+                for chunk_name in chunk_names:
+                    # Download target chunk from disconnecting S-node
+                    self.download_chunk(uuid, chunk_name)
+                return 1
 
-                # Expects full path
-                full_path = os.path.join(os.getcwd(), "uploading_files", relevant_chunk)
-                self.upload_file_to_snode(target_snode, full_path)
-                
-                # Remove from disconnecting S-node
-                self.remote_delete_file(relevant_chunk, uuid)
-            
+            """Case 2: the other S-nodes pull the chunk(s) straight from the disconnecting S-node"""
+            self.migrate_chunks(uuid, chunk_names, targets)
             return 2
         
         except Exception as e:
             print(e)
 
 
+    def migrate_chunks(self, source_uuid: str, chunk_names: List[str], targets: List[str],
+                       bandwidth: int = MIGRATION_BANDWIDTH, workers: int = MIGRATION_WORKERS) -> Dict[str, str]:
+        """ Move chunks from source_uuid to targets, MIGRATION_WORKERS at a time, each target S-node
+        pulling its chunk from the source itself (PullChunk) so no chunk byte crosses the R-node;
+        bandwidth (bytes per second, 0 = no cap) is shared by the transfers running at once.
+        Every chunk goes to the least used target that holds no other chunk of its file, if any.
+        Return {chunk: target} of the chunks moved """
+        used = {target: self.get_used_storage(target) for target in targets}
+        plan = []
+        for chunk_name in chunk_names:
+            holders = {holder for holder, _ in self.index.chunks_of(registry_db.chunk_file(chunk_name))}
+            candidates = [target for target in targets if target not in holders] or targets
+            target = min(candidates, key=lambda t: used[t])
+            used[target] += self.index.chunk_size(chunk_name)
+            plan.append((chunk_name, target))
+
+        workers = max(1, min(workers, len(plan)))
+        max_rate = bandwidth // workers
+        moved = {}
+        with futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="migrate") as pool:
+            jobs = {pool.submit(self.migrate_chunk, source_uuid, chunk_name, target, max_rate): (chunk_name, target)
+                    for chunk_name, target in plan}
+            for job in futures.as_completed(jobs):
+                chunk_name, target = jobs[job]
+                if job.result():
+                    moved[chunk_name] = target
+        print(f"[INFO] Migrated {len(moved)} of {len(plan)} chunks off {source_uuid}")
+        return moved
+
+
+    def migrate_chunk(self, source_uuid: str, chunk_name: str, target_uuid: str, max_rate: int = 0) -> bool:
+        """ Have target_uuid pull chunk_name from source_uuid at up to max_rate bytes per second,
+        resuming an interrupted pull from the bytes stored; then move the placement over and
+        delete the source's copy """
+        try:
+            if self.storage_service.file_address(source_uuid) is None:
+                raise Exception(f"Storage node {source_uuid} is not connected")
+            size = self.index.chunk_size(chunk_name)
+            stub = self.storage_service.stub(target_uuid)
+            self._wait_connected(target_uuid)
+            request = storage_node_pb2.PullRequest(filename=chunk_name, source_uuid=source_uuid, size=size, max_rate=max_rate)
+            timeout = FETCH_TIMEOUT + size / min(max_rate or MIN_FETCH_RATE, MIN_FETCH_RATE)
+
+            for attempt in range(RESUME_ATTEMPTS + 1):
+                if attempt:
+                    time.sleep(RESUME_BACKOFF * attempt)
+                    print(f"[WARN] resuming migration of {chunk_name} to {target_uuid}")
+                try:
+                    response = stub.PullChunk(request, timeout=timeout)
+                except grpc.RpcError as e:
+                    print(f"[WARN] migrating {chunk_name} to {target_uuid}: {e.code().name}")
+                    continue
+                if response.success:
+                    break
+                print(f"[WARN] migrating {chunk_name} to {target_uuid}: {response.message}")
+            else:
+                print(f"[ERROR] could not migrate {chunk_name} from {source_uuid} to {target_uuid}")
+                return False
+
+            self.record_chunk(chunk_name, size, target_uuid)
+            self.index.remove_placement(source_uuid, chunk_name)
+            self.remote_delete_file(chunk_name, source_uuid)
+            return True
+
+        except Exception as e:
+            print(f"[ERROR] migrating {chunk_name} to {target_uuid}: {e}")
+            return False
+
+
     def delete_file(self, file_name):
         """ Delete a file from all connected snodes, and remove all references to it """
-        # Open jsons
         try:
-            with open(self.file_total_sizes, 'r') as f:
-                file_total_sizes = json.load(f)
-            with open(self.uuid_to_chunks, 'r') as f:
-                uuid_to_chunks = json.load(f)
-            with open(self.file_to_uuids, 'r') as f:
-                file_to_uuids = json.load(f)
-            with open(self.key_name_mappings, 'r') as f:
-                key_name_mappings = json.load(f)
-            with open(self.snodes_storage_used, 'r') as f:
-                snodes_storage_used = json.load(f)
-            with open(self.chunk_to_size, 'r') as f:
-                chunk_to_size = json.load(f)
-            with open(self.zombies, 'r') as f:
-                zombies = json.load(f)
-
-            # Some S-nodes where the file is stored may not be connected: add them to
-            # the zombies.json file so that when the S-nodes next connect, the appropriate 
+            # Some S-nodes where the file is stored may not be connected: record their
+            # chunks as zombies so that when the S-nodes next connect, the appropriate 
             # files are removed
-            relevant_uuids = file_to_uuids[file_name] if file_name in file_to_uuids else None
             connected_uuids = self.get_uuids()
-            if relevant_uuids:
-                for uuid in relevant_uuids:
-                    if uuid not in connected_uuids and uuid not in zombies:
-                        # The S-node has no other zombie files
-                        zombies[uuid] = [file_name]
-                    elif uuid not in connected_uuids:
-                        zombies[uuid].append(file_name)
-                    else:
-                        chunk_name = self.snode_to_chunk(target_uuid=uuid, file_name=file_name)
-                        if uuid == "gopgle":
-                            google_util.delete_file(chunk_name)
-                        elif uuid == "aws":
-                            aws_util.delete_file(chunk_name)
-                        else:
-                            self.remote_delete_file(chunk_name=chunk_name, target_uuid=uuid)
-
-            # Remove from chunk_to_size and update snodes_storage_used based on the freed space
-            to_delete = []
-            for chunk_name, size in chunk_to_size.items():
-                if chunk_name[:-2] == file_name:
-                    relevant_snode = self.chunk_to_snode(chunk_name)
-                    snodes_storage_used[relevant_snode] = snodes_storage_used[relevant_snode] - size
-                    to_delete.append(chunk_name)
-            for chunk_name in to_delete: # then delete the collected items
-                del chunk_to_size[chunk_name]
-
-            # Remove from uuid_to_chunks.json
-            for uuid, chunks in uuid_to_chunks.items():
-                if uuid in self.get_uuids(): # leave zombie references
-                    for chunk in chunks:
-                        if chunk[:-2] == file_name: # chunks have file_name.{i} i.e. my_file.1
-                            uuid_to_chunks[uuid].remove(chunk)
-            
-            # Remove from key_name_mappings.json    
-            if file_name in key_name_mappings:
-                del key_name_mappings[file_name]
+            zombies = []
+            for uuid, chunk_name in self.index.chunks_of(file_name):
+                if uuid not in connected_uuids:
+                    zombies.append((uuid, chunk_name))
+                else:
+                    self._delete_chunk(uuid, chunk_name)
 
-            # Remove from file_total_sizes.json
-            if file_name in file_total_sizes:
-                del file_total_sizes[file_name]
-            
-            # Remove from file_to_uuids.json
-            if file_name in file_to_uuids:
-                del file_to_uuids[file_name]
-            
-            # Write changes
-            with open(self.file_total_sizes, 'w') as f:
-                json.dump(file_total_sizes, f, indent=4)
-            with open(self.uuid_to_chunks, 'w') as f:
-                json.dump(uuid_to_chunks, f, indent=4)
-            with open(self.file_to_uuids, 'w') as f:
-                json.dump(file_to_uuids, f, indent=4)
-            with open(self.key_name_mappings, 'w') as f:
-                json.dump(key_name_mappings, f, indent=4)
-            with open(self.chunk_to_size, 'w') as f:
-                json.dump(chunk_to_size, f, indent=4)
-            with open(self.snodes_storage_used, 'w') as f:
-                json.dump(snodes_storage_used, f, indent=4)
-            with open(self.zombies, 'w') as f:
-                json.dump(zombies, f, indent=4)
+            # Remove every reference to the file (chunks, placements, sizes), then its key mapping
+            self.index.delete_file(file_name, zombies)
+            with self.store.transaction() as cur:
+                self.store.delete_key_mapping(cur, file_name)
             
             return "Success"
 
@@ -1023,12 +1089,7 @@ class RegistryNode:
     def remote_delete_file(self, chunk_name, target_uuid):
         """Attempt to remote delete the file stored on the S-node"""
         try:
-            client_addr = self.storage_service.connected_clients[target_uuid]
-            ip = client_addr.split(':')[1]
-            port=self.storage_service.client_file_ports.get(target_uuid)
-            channel = grpc.insecure_channel(f'{ip}:{port}')
-            
-            stub = storage_node_pb2_grpc.StorageServiceStub(channel)
+            stub = self.storage_service.stub(target_uuid)
             request = storage_node_pb2.FileDelete(filename=chunk_name)
             response = stub.DeleteFile(request)
             if response.success:
@@ -1042,27 +1103,11 @@ class RegistryNode:
  
     def chunk_to_snode(self, chunk_name):
         """Return the S-node associated with a specified chunk, or None"""
-        with open(self.uuid_to_chunks, 'r') as f:
-            uuid_to_chunks = json.load(f)
-        
-        for uuid, chunks in uuid_to_chunks.items():
-            for chunk in chunks:
-                if chunk == chunk_name:
-                    return uuid
-        
-        return None
+        return self.index.chunk_to_snode(chunk_name)
     
     def snode_to_chunk(self, target_uuid, file_name):
         """Return the chunk associated with a specified S-node and file_name, or None"""
-        with open(self.uuid_to_chunks, 'r') as f:
-            uuid_to_chunks = json.load(f)
-        
-        if target_uuid not in uuid_to_chunks:
-            return None
-        
-        for chunk in uuid_to_chunks[target_uuid]:
-            if chunk[:-2] == file_name:
-                return chunk
+        return self.index.snode_to_chunk(target_uuid, file_name)
 
     
 
@@ -1096,27 +1141,17 @@ class RegistryNode:
 
         num_files_to_upload = min(len(files), len(snodes))
         
-        # Upload each file to a different storage node
-        results = {}
+        # Upload every file at once, each to a different storage node
+        uploads = []
         for i in range(num_files_to_upload):
             file_path = os.path.join(folder_path, files[i])
-            snode_uuid = snodes[i]
-            if snode_uuid == "google":
-                try:
-                    google_util.upload_to_gcs(file_path)
-                    success = True
-                except Exception as e: 
-                    success = e
+            send = functools.partial(self.upload_file_to_snode, snodes[i], file_path)
+            uploads.append(ShareUpload(i, snodes[i], files[i], send))
+        result = self.uploader.upload(uploads)
 
-            elif snode_uuid == "aws":
-                try:
-                    aws_util.upload(file_path)
-                    success = True
-                except Exception as e:
-                    success = e
-            else:
-                success = self.upload_file_to_snode(snode_uuid, file_path)
-            
+        results = {}
+        for i in range(num_files_to_upload):
+            results[files[i]] = (snodes[i], i in result.stored)
         return results
         
 
@@ -1146,21 +1181,15 @@ class RegistryNode:
 
 
     def get_files(self):
-        """Return {filename: [uuids where stored]} for all stored files"""
-        with open(self.file_to_uuids, 'r') as f:
-            file_to_uuids = json.load(f)
-
-        return file_to_uuids.keys()
+        """Return the names of all stored files"""
+        return self.index.get_files()
 
    
     def index_availability_util(self, file_name):
         """Accept a filename, return `Yes` if available, otherwise `No`"""
         try:
-            with open(self.file_to_uuids, 'r') as f:
-                file_to_uuids = json.load(f)
-
             # List of UUIDs storing the specified filename
-            relevant_uuids = file_to_uuids[file_name]
+            relevant_uuids = self.index.file_to_uuids(file_name)
             all_connected_uuids = self.storage_service.connected_clients.keys()
             relevant_connected_uuids = []
 
@@ -1187,9 +1216,7 @@ class RegistryNode:
         required_storage = math.ceil(required_storage / 1000000) # bytes to mb
         client_list = self.get_client_list()
         uuids_with_space = []
-
-        with open(self.snodes_storage_used, 'r') as f:
-            snodes_storage_used = json.load(f)
+        snodes_storage_used = self.index.all_used_storage()
                 
         for client in client_list:
             uuid = client["uuid"]
@@ -1208,12 +1235,8 @@ class RegistryNode:
     def get_required(self, filename: str):
         """Return the required number of chunks to reconstruct the specified file"""
         try:
-            meta_dir = os.path.join(os.getcwd(), "registry_conf", "meta_files")
-            filename = filename + ".meta"
-            meta_file = os.path.join(meta_dir, filename)
-            with open(meta_file, 'r') as f:
-                lines = f.readlines()
-                return int(lines[3].strip()) - int(lines[2].strip())
+            # zfec's k is the number of chunks needed out of m
+            return self.index.file_params(filename)['k']
 
         except Exception as e:
             print(f"[ERROR] on get_required: {e}")
@@ -1222,10 +1245,7 @@ class RegistryNode:
     def get_m(self, filename: str):
         """Return the number of S-nodes a file is chunked across"""
         try:
-            meta_file = os.path.join(meta_dir, filename)
-            with open(meta_file, 'r') as f:
-                lines = f.readlines()
-                return int(lines[3].strip())
+            return self.index.file_params(filename)['m']
         
         except Exception as e:
             print(f"[ERROR] on get_m: {e}")
@@ -1255,45 +1275,62 @@ class RegistryNode:
         return pending_nodes 
 
     
+    def _on_node_event(self, event: str, uuid: str) -> None:
+        """Free the zombies of an S-node as soon as it (re)connects"""
+        if event == "connect" and uuid not in CLOUD_UUIDS and self.index.zombies(uuid):
+            threading.Thread(target=self.clear_zombies_of, args=(uuid,), daemon=True).start()
+
+
+    def clear_zombies_of(self, target_uuid: str) -> int:
+        """ Delete the zombies of one S-node (chunks deleted by the R-node while it was not connected)
+        over a single DeleteFiles stream, forgetting them in batches of ZOMBIE_BATCH as the S-node
+        confirms them, so an interrupted cleanup resumes where it stopped. Return the number cleared """
+        with self.zombie_lock:
+            if target_uuid in self.cleaning:
+                return 0
+            self.cleaning.add(target_uuid)
+        cleared, batch = 0, []
+        try:
+            # The file port arrives with the first heartbeat after the UUID handshake
+            deadline = time.monotonic() + ZOMBIE_CONNECT_WAIT
+            while self.storage_service.file_address(target_uuid) is None:
+                if target_uuid not in self.storage_service.connected_clients or time.monotonic() > deadline:
+                    return 0
+                time.sleep(0.5)
+            zombies = self.index.zombies(target_uuid)
+            if not zombies:
+                return 0
+            stub = self.storage_service.stub(target_uuid)
+            self._wait_connected(target_uuid)
+            requests = (storage_node_pb2.FileDelete(filename=chunk_name) for chunk_name in zombies)
+            for result in stub.DeleteFiles(requests, timeout=FETCH_TIMEOUT + len(zombies) * ZOMBIE_DELETE_TIMEOUT):
+                if not result.success:
+                    print(f"[WARN] {target_uuid} could not delete {result.filename}: {result.message}")
+                    continue
+                batch.append(result.filename)
+                if len(batch) >= ZOMBIE_BATCH:
+                    self.index.clear_zombies(target_uuid, batch)
+                    cleared, batch = cleared + len(batch), []
+        except Exception as e:
+            print(f"[ERROR] clearing zombies of {target_uuid}: {e}")
+        finally:
+            if batch:
+                self.index.clear_zombies(target_uuid, batch)
+                cleared += len(batch)
+            with self.zombie_lock:
+                self.cleaning.discard(target_uuid)
+        if cleared:
+            print(f"[INFO] Cleared {cleared} zombie chunks from {target_uuid}")
+        return cleared
+
+
     def clear_zombies(self):
         """Delete any files on connected S-nodes that have been deleted
            (but this change has yet to reflect remotely on the S-node)"""
-        # Delete zombies: chunks deleted by the R-node while the S-node was not connected,
-        # and now need to be freed for their storage space
-        while True:
-            try:
-                with open(self.zombies, 'r') as f:
-                    zombies = json.load(f) # {uuid: [zombie_chunknames]}
-                with open(self.uuid_to_chunks, 'r') as f:
-                    uuid_to_chunks = json.load(f)
-                
-                
-                for client_uuid in self.get_uuids():
-                    if client_uuid in zombies:
-                        zombie_files = zombies[client_uuid] 
-                        for file_name in zombie_files:
-                            chunk_name = self.snode_to_chunk(client_uuid, file_name)
-                            client_addr = self.storage_service.connected_clients[client_uuid]
-                            ip = client_addr.split(':')[1]
-                            port=self.storage_service.client_file_ports.get(client_uuid)
-                            channel = grpc.insecure_channel(f'{ip}:{port}')
-                            
-                            stub = storage_node_pb2_grpc.StorageServiceStub(channel)
-                            if chunk_name is None:
-                                return
-                            request = storage_node_pb2.FileDelete(filename=chunk_name)
-                            response = stub.DeleteFile(request)
-
-                            uuid_to_chunks[client_uuid].remove(chunk_name)
-                        
-
-                        del zombies[client_uuid] # all zombie files cleared from S-node
-                
-                with open(self.zombies, 'w') as f:
-                    json.dump(zombies, f, indent=4)
-            except Exception as e:
-                print(f"Error in clear zombies: {e}")
-            time.sleep(10)
+        # Nodes that connect later are cleaned on their connect event, see _on_node_event
+        for client_uuid in self.get_uuids():
+            if client_uuid not in CLOUD_UUIDS and self.index.zombies(client_uuid):
+                self.clear_zombies_of(client_uuid)
 
 
 if __name__ == "__main__":
@@ -1302,7 +1339,7 @@ if __name__ == "__main__":
 
     try:
         while True:
-            command = input("\nEnter command (list/pending/approve/reject/help/quit/upload/download/uploadfolder): ").strip().lower()
+            command = input("\nEnter command (list/pending/approve/reject/help/quit/upload/download/uploadfolder/channels/repair): ").strip().lower()
             
             if command == "help":
                 print("\nAvailable commands:")
@@ -1313,6 +1350,8 @@ if __name__ == "__main__":
                 print("  upload      - Upload a file to a storage node")
                 print("  download    - Download a file from a storage node")
                 print("  uploadfolder - Upload all files from a folder across storage nodes")
+                print("  channels    - Show S-node channel pool counters")
+                print("  repair      - Rebuild the shares lost with dead S-nodes now")
                 print("  help        - Show this help message")
                 print("  quit        - Exit the program")
                 
@@ -1364,7 +1403,7 @@ if __name__ == "__main__":
                     continue
                 
                 # Attempt download
-                if self.download(filename):
+                if service.download(filename) == "Success":
                     print(f"Successfully downloaded {filename}")
                 else:
                     print(f"Failed to download {filename}")
@@ -1446,6 +1485,14 @@ if __name__ == "__main__":
                 total_storage = service.get_total_storage()
                 print(f"\nTotal available storage across all nodes: {total_storage} GB")
 
+            elif command == "channels":
+                print(service.storage_service.channels.stats())
+
+            elif command == "repair":
+                for health in service.repairer.scan():
+                    print(health)
+                print(f"Rebuilt {service.repairer.repair_all()} shares, {service.repairer.stats()}")
+
             elif command == "quit":
                 break
 
@@ -5,7 +5,7 @@ import warnings
 
 import storage_node_pb2 as storage__node__pb2
 
-GRPC_GENERATED_VERSION = '1.70.0'
+GRPC_GENERATED_VERSION = '1.71.0'
 GRPC_VERSION = grpc.__version__
 _version_not_supported = False
 
@@ -49,16 +49,41 @@ class StorageServiceStub(object):
                 request_serializer=storage__node__pb2.FileChunk.SerializeToString,
                 response_deserializer=storage__node__pb2.FileResponse.FromString,
                 _registered_method=True)
+        self.QueryUpload = channel.unary_unary(
+                '/storage.StorageService/QueryUpload',
+                request_serializer=storage__node__pb2.UploadQuery.SerializeToString,
+                response_deserializer=storage__node__pb2.UploadStatus.FromString,
+                _registered_method=True)
         self.RequestFile = channel.unary_stream(
                 '/storage.StorageService/RequestFile',
                 request_serializer=storage__node__pb2.FileRequest.SerializeToString,
                 response_deserializer=storage__node__pb2.FileChunk.FromString,
                 _registered_method=True)
+        self.PullChunk = channel.unary_unary(
+                '/storage.StorageService/PullChunk',
+                request_serializer=storage__node__pb2.PullRequest.SerializeToString,
+                response_deserializer=storage__node__pb2.FileResponse.FromString,
+                _registered_method=True)
+        self.ResolvePeer = channel.unary_unary(
+                '/storage.StorageService/ResolvePeer',
+                request_serializer=storage__node__pb2.PeerRequest.SerializeToString,
+                response_deserializer=storage__node__pb2.PeerAddress.FromString,
+                _registered_method=True)
         self.DeleteFile = channel.unary_unary(
                 '/storage.StorageService/DeleteFile',
                 request_serializer=storage__node__pb2.FileDelete.SerializeToString,
                 response_deserializer=storage__node__pb2.FileResponse.FromString,
                 _registered_method=True)
+        self.DeleteFiles = channel.stream_stream(
+                '/storage.StorageService/DeleteFiles',
+                request_serializer=storage__node__pb2.FileDelete.SerializeToString,
+                response_deserializer=storage__node__pb2.DeleteResult.FromString,
+                _registered_method=True)
+        self.OpenDataSession = channel.unary_unary(
+                '/storage.StorageService/OpenDataSession',
+                request_serializer=storage__node__pb2.DataSessionRequest.SerializeToString,
+                response_deserializer=storage__node__pb2.DataSession.FromString,
+                _registered_method=True)
         self.Heartbeat = channel.stream_stream(
                 '/storage.StorageService/Heartbeat',
                 request_serializer=storage__node__pb2.HeartbeatRequest.SerializeToString,
@@ -89,18 +114,48 @@ class StorageServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def QueryUpload(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def RequestFile(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def PullChunk(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def ResolvePeer(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def DeleteFile(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def DeleteFiles(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def OpenDataSession(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def Heartbeat(self, request_iterator, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -125,16 +180,41 @@ def add_StorageServiceServicer_to_server(servicer, server):
                     request_deserializer=storage__node__pb2.FileChunk.FromString,
                     response_serializer=storage__node__pb2.FileResponse.SerializeToString,
             ),
+            'QueryUpload': grpc.unary_unary_rpc_method_handler(
+                    servicer.QueryUpload,
+                    request_deserializer=storage__node__pb2.UploadQuery.FromString,
+                    response_serializer=storage__node__pb2.UploadStatus.SerializeToString,
+            ),
             'RequestFile': grpc.unary_stream_rpc_method_handler(
                     servicer.RequestFile,
                     request_deserializer=storage__node__pb2.FileRequest.FromString,
                     response_serializer=storage__node__pb2.FileChunk.SerializeToString,
             ),
+            'PullChunk': grpc.unary_unary_rpc_method_handler(
+                    servicer.PullChunk,
+                    request_deserializer=storage__node__pb2.PullRequest.FromString,
+                    response_serializer=storage__node__pb2.FileResponse.SerializeToString,
+            ),
+            'ResolvePeer': grpc.unary_unary_rpc_method_handler(
+                    servicer.ResolvePeer,
+                    request_deserializer=storage__node__pb2.PeerRequest.FromString,
+                    response_serializer=storage__node__pb2.PeerAddress.SerializeToString,
+            ),
             'DeleteFile': grpc.unary_unary_rpc_method_handler(
                     servicer.DeleteFile,
                     request_deserializer=storage__node__pb2.FileDelete.FromString,
                     response_serializer=storage__node__pb2.FileResponse.SerializeToString,
             ),
+            'DeleteFiles': grpc.stream_stream_rpc_method_handler(
+                    servicer.DeleteFiles,
+                    request_deserializer=storage__node__pb2.FileDelete.FromString,
+                    response_serializer=storage__node__pb2.DeleteResult.SerializeToString,
+            ),
+            'OpenDataSession': grpc.unary_unary_rpc_method_handler(
+                    servicer.OpenDataSession,
+                    request_deserializer=storage__node__pb2.DataSessionRequest.FromString,
+                    response_serializer=storage__node__pb2.DataSession.SerializeToString,
+            ),
             'Heartbeat': grpc.stream_stream_rpc_method_handler(
                     servicer.Heartbeat,
                     request_deserializer=storage__node__pb2.HeartbeatRequest.FromString,
@@ -232,6 +312,33 @@ class StorageService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def QueryUpload(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/storage.StorageService/QueryUpload',
+            storage__node__pb2.UploadQuery.SerializeToString,
+            storage__node__pb2.UploadStatus.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def RequestFile(request,
             target,
@@ -259,6 +366,60 @@ class StorageService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def PullChunk(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/storage.StorageService/PullChunk',
+            storage__node__pb2.PullRequest.SerializeToString,
+            storage__node__pb2.FileResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def ResolvePeer(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/storage.StorageService/ResolvePeer',
+            storage__node__pb2.PeerRequest.SerializeToString,
+            storage__node__pb2.PeerAddress.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def DeleteFile(request,
             target,
@@ -286,6 +447,60 @@ class StorageService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def DeleteFiles(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/storage.StorageService/DeleteFiles',
+            storage__node__pb2.FileDelete.SerializeToString,
+            storage__node__pb2.DeleteResult.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def OpenDataSession(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/storage.StorageService/OpenDataSession',
+            storage__node__pb2.DataSessionRequest.SerializeToString,
+            storage__node__pb2.DataSession.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def Heartbeat(request_iterator,
             target,
@@ -0,0 +1,159 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+""" Concurrent upload of the shares of a file.
+
+    Every share is sent on its own worker so the upload takes as long as the slowest
+    transfer instead of the sum of all of them. A per S-node semaphore caps how many
+    uploads run against one node at once, and failed shares are retried with a short
+    backoff when their source can be replayed (a file on disk, or a stream nothing
+    has been read from yet). The outcome of every share is gathered in one UploadResult. """
+
+MAX_WORKERS = 16 # file uploads in flight across all S-nodes
+PER_NODE_LIMIT = 2 # uploads in flight to any one S-node
+RETRIES = 2 # extra attempts per share
+RETRY_BACKOFF = 0.5 # seconds, doubled after every failed attempt
+
+
+class ShareUpload:
+    """One share to store: send() performs a single attempt and returns True on success.
+       stream is the pipeline.ShareStream feeding send(), None when it reads a file"""
+    def __init__(self, index: int, target_uuid: str, chunk_name: str, send: Callable[[], bool], stream=None):
+        self.index = index
+        self.target_uuid = target_uuid
+        self.chunk_name = chunk_name
+        self.send = send
+        self.stream = stream
+
+    def can_retry(self) -> bool:
+        """A file can be resent, a stream only if nothing was read from it yet"""
+        return self.stream is None or not self.stream.started
+
+    def abandon(self) -> None:
+        """The share failed for good: stop the encoder from waiting on it"""
+        if self.stream is not None:
+            self.stream.fail()
+
+
+class UploadResult:
+    """Outcome of every share of one upload"""
+    def __init__(self, uploads: List[ShareUpload]):
+        self.targets: Dict[int, str] = {upload.index: upload.target_uuid for upload in uploads}
+        self.chunks: Dict[int, str] = {upload.index: upload.chunk_name for upload in uploads}
+        self.stored: List[int] = [] # share indexes that were stored
+        self.failed: Dict[int, str] = {} # {share index: reason}
+        self.attempts: Dict[int, int] = {upload.index: 0 for upload in uploads}
+        self.elapsed = 0.0 # seconds from start to the last share finishing
+
+    def succeeded(self, required: int) -> bool:
+        """True when at least required shares were stored"""
+        return len(self.stored) >= required
+
+    def __repr__(self):
+        return (f"UploadResult(stored={len(self.stored)}/{len(self.targets)}, "
+                f"failed={self.failed}, elapsed={self.elapsed:.2f}s)")
+
+
+class UploadBatch:
+    """Handle on a running upload, wait() blocks until every share finished"""
+    def __init__(self, result: UploadResult, futures: list, threads: List[threading.Thread]):
+        self.result = result
+        self.futures = futures
+        self.threads = threads
+        self.started = time.monotonic()
+
+    def wait(self) -> UploadResult:
+        for future in self.futures:
+            future.result()
+        for thread in self.threads:
+            thread.join()
+        self.result.elapsed = time.monotonic() - self.started
+        return self.result
+
+
+class UploadEngine:
+    def __init__(self, max_workers: int = MAX_WORKERS, per_node_limit: int = PER_NODE_LIMIT,
+                 retries: int = RETRIES, retry_backoff: float = RETRY_BACKOFF):
+        self.max_workers = max_workers
+        self.per_node_limit = per_node_limit
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upload")
+        self.lock = threading.Lock()
+        self.node_slots: Dict[str, threading.Semaphore] = {}
+
+
+    def start(self, uploads: List[ShareUpload]) -> UploadBatch:
+        """Start sending every share and return at once. Streamed shares are fed by the
+           caller while they upload, so they all have to run at the same time: each gets its
+           own thread instead of waiting for a pool worker, and its S-node slot is taken here"""
+        streamed = [upload for upload in uploads if upload.stream is not None]
+        per_node: Dict[str, int] = {}
+        for upload in streamed:
+            per_node[upload.target_uuid] = per_node.get(upload.target_uuid, 0) + 1
+        if max(per_node.values(), default=0) > self.per_node_limit:
+            raise ValueError(f"Cannot stream more than {self.per_node_limit} shares to one S-node")
+
+        # Fixed order, so two uploads waiting on each other's S-nodes never deadlock
+        for target_uuid in sorted(per_node):
+            for _ in range(per_node[target_uuid]):
+                self._slot(target_uuid).acquire()
+
+        result = UploadResult(uploads)
+        threads = []
+        for upload in streamed:
+            thread = threading.Thread(target=self._run, args=(upload, result), daemon=True)
+            thread.start()
+            threads.append(thread)
+        futures = [self.executor.submit(self._run, upload, result) for upload in uploads if upload.stream is None]
+        return UploadBatch(result, futures, threads)
+
+
+    def upload(self, uploads: List[ShareUpload]) -> UploadResult:
+        """Send every share and wait for all of them"""
+        return self.start(uploads).wait()
+
+
+    def _slot(self, target_uuid: str) -> threading.Semaphore:
+        with self.lock:
+            if target_uuid not in self.node_slots:
+                self.node_slots[target_uuid] = threading.Semaphore(self.per_node_limit)
+            return self.node_slots[target_uuid]
+
+
+    def _run(self, upload: ShareUpload, result: UploadResult) -> None:
+        slot = self._slot(upload.target_uuid)
+        if upload.stream is None:
+            slot.acquire() # streamed shares got theirs in start()
+        try:
+            self._attempt(upload, result)
+        finally:
+            slot.release()
+
+
+    def _attempt(self, upload: ShareUpload, result: UploadResult) -> None:
+        backoff = self.retry_backoff
+        reason = "not attempted"
+        for attempt in range(self.retries + 1):
+            result.attempts[upload.index] = attempt + 1
+            try:
+                if upload.send():
+                    result.stored.append(upload.index)
+                    return
+                reason = "upload failed"
+            except Exception as e:
+                reason = str(e)
+            if attempt == self.retries or not upload.can_retry():
+                break
+            print(f"[WARN] upload of {upload.chunk_name} to {upload.target_uuid} failed, retrying")
+            time.sleep(backoff)
+            backoff *= 2
+
+        result.failed[upload.index] = reason
+        upload.abandon()
+
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
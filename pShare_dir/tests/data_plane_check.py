@@ -0,0 +1,99 @@
+import os
+import sys
+import types
+import shutil
+import functools
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pyfiles"))
+import encrypt # noqa: F401 (rnode needs it imported first)
+import rnode
+import snode
+import codec
+import pipeline
+import data_plane
+import channel_pool
+from retrieval_engine import RetrievalEngine
+
+""" Scripted check of data plane connection reuse: after a download, the connections of
+    the shares that completed go back to the idle pool, so the next download reuses them
+    and no read falls back to gRPC. An idle connection the S-node closed meanwhile is
+    replaced by a fresh one, not by gRPC either.
+
+    Run from the parent directory:
+      python tests/data_plane_check.py """
+
+K, M = 2, 3
+SIZE = 10 * 1024 * 1024 + 12345
+
+
+def main():
+    work = tempfile.mkdtemp()
+    data = os.urandom(SIZE)
+    engine = codec.create("zfec", K, M, 1024 * 1024)
+    shares = [bytearray() for _ in range(M)]
+    for blocks in engine.encode_stripes(pipeline.stripes_of([data], engine.stripe_size)):
+        for share, block in enumerate(blocks):
+            shares[share] += block
+    meta = {'size': SIZE, 'k': K, 'm': M, 'stripe_size': engine.stripe_size}
+
+    pool = channel_pool.ChannelPool()
+    servers, ports, addresses = [], {}, {}
+    for share in range(M):
+        uuid = f"node{share}"
+        files_dir = os.path.join(work, uuid)
+        os.makedirs(files_dir)
+        with open(os.path.join(files_dir, f"file.enc.{share}"), 'wb') as f:
+            f.write(shares[share])
+        service = snode.StorageService()
+        service.files_dir = files_dir
+        server = snode.FileServer(service, "127.0.0.1:0")
+        data_server = data_plane.DataPlaneServer(files_dir, service.sessions)
+        servers.append((server, data_server))
+        ports[uuid] = server.port
+        addresses[uuid] = ("127.0.0.1", data_server.port)
+
+    client = data_plane.DataPlaneClient()
+    storage_service = types.SimpleNamespace(connected_clients=dict.fromkeys(ports), client_file_ports=ports,
+                                            stub=lambda uuid: pool.stub(uuid, f"127.0.0.1:{ports[uuid]}"),
+                                            data_address=addresses.get, data_plane=client)
+    node = types.SimpleNamespace(storage_service=storage_service, _wait_connected=lambda uuid: None,
+                                 index=types.SimpleNamespace(chunk_size=lambda chunk: len(shares[0])))
+    fallbacks = []
+    def read_grpc(*args, **kwargs):
+        fallbacks.append(args[1])
+        return rnode.RegistryNode._read_grpc(node, *args, **kwargs)
+    node._read_grpc = read_grpc
+    node._read_data_plane = functools.partial(rnode.RegistryNode._read_data_plane, node)
+    retriever = RetrievalEngine(functools.partial(rnode.RegistryNode.open_chunk_stream, node), None)
+    holders = [(f"node{share}", f"file.enc.{share}") for share in range(M)]
+
+    def download():
+        return b"".join(bytes(view) for view in retriever.stream(holders, meta))
+
+    try:
+        assert download() == data
+        first = client.stats()
+        assert download() == data
+        second = client.stats()
+        assert second["reused"] > first["reused"], (first, second)
+        assert not fallbacks, fallbacks
+        print(f"[INFO] second download reused {second['reused'] - first['reused']} connections: OK")
+
+        # The idle connections break (as when an S-node closes them): the next download reconnects
+        for session in client.sessions.values():
+            for sock in session.idle:
+                sock.shutdown(data_plane.socket.SHUT_RDWR)
+        assert download() == data
+        assert not fallbacks, fallbacks
+        print("[INFO] download after the idle connections were closed: OK")
+    finally:
+        for server, data_server in servers:
+            data_server.close()
+            server.stop()
+        pool.close_all()
+        shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pyfiles"))
+import registry_db
+from registry_index import RegistryIndex
+
+""" Scripted check of the registry journal recovery: checkpoints that fail (e.g. a locked
+    database) must keep their operations, both in memory and on disk, until one succeeds
+    or the R-node restarts.
+
+    Run from the parent directory:
+      python tests/registry_journal_check.py """
+
+
+def snapshot(index):
+    return {file_name: sorted(index.chunks_of(file_name)) for file_name in index.get_files()}
+
+
+def stored(store):
+    return sorted(store.all_placements())
+
+
+def main():
+    work = tempfile.mkdtemp()
+    db_path = os.path.join(work, "registry.db")
+    journal_path = os.path.join(work, "registry.journal")
+    store = registry_db.RegistryStore(db_path)
+    index = RegistryIndex(store, work, journal_path=journal_path, flush_interval=3600)
+
+    # The store refuses two checkpoints, as a locked or full database would
+    transaction = store.transaction
+    failures = [2]
+    @contextmanager
+    def flaky_transaction():
+        if failures[0]:
+            failures[0] -= 1
+            raise registry_db.sqlite3.OperationalError("database is locked")
+        with transaction() as cur:
+            yield cur
+    store.transaction = flaky_transaction
+
+    index.add_chunk("a.enc.0", 10, "n1")
+    index.add_chunk("a.enc.1", 10, "n2")
+    for _ in range(2):
+        try:
+            index.flush()
+        except registry_db.sqlite3.OperationalError as e:
+            print(f"[INFO] checkpoint failed as expected: {e}")
+        index.add_chunk("b.enc.0", 20, "n3")
+    assert len(index.pending) == 4, index.pending
+    assert stored(store) == []
+    expected = snapshot(index)
+
+    # Crash: a restart replays the failed batches and the journal
+    restarted = RegistryIndex(registry_db.RegistryStore(db_path), work, journal_path=journal_path, flush_interval=3600)
+    assert snapshot(restarted) == expected, snapshot(restarted)
+    assert stored(restarted.store) == [("n1", "a.enc.0"), ("n2", "a.enc.1"), ("n3", "b.enc.0")]
+    print("[INFO] restart after failed checkpoints: OK")
+
+    # No crash: the next checkpoint writes everything that failed before
+    store = registry_db.RegistryStore(os.path.join(work, "second.db"))
+    index = RegistryIndex(store, work, journal_path=os.path.join(work, "second.journal"), flush_interval=3600)
+    transaction = store.transaction
+    failures[0] = 1
+    store.transaction = flaky_transaction
+    index.add_chunk("c.enc.0", 5, "n1")
+    try:
+        index.flush()
+    except registry_db.sqlite3.OperationalError:
+        pass
+    index.add_chunk("c.enc.1", 5, "n2")
+    index.flush()
+    assert stored(store) == [("n1", "c.enc.0"), ("n2", "c.enc.1")]
+    assert not os.path.exists(index.checkpoint_path)
+    print("[INFO] retry after a failed checkpoint: OK")
+
+
+if __name__ == "__main__":
+    main()